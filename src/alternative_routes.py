@@ -0,0 +1,249 @@
+import heapq
+
+import numpy as np
+
+from bidirectional_astar import heuristic_scale
+from instrumentation import record_search
+from overpass import haversine_array
+
+METRICS = ('length', 'speed')
+
+# uma alternativa pode custar até (1 + MAX_STRETCH) vezes a melhor rota
+MAX_STRETCH = 0.25
+
+# fração do custo de uma alternativa que pode ser dividida com cada rota já escolhida
+MAX_OVERLAP = 0.6
+
+# trecho mínimo (fração do custo da melhor rota) que a alternativa percorre nas duas árvores ao
+# mesmo tempo (o "platô"); sem ele a rota pode ser só um desvio curto e sem sentido
+MIN_PLATEAU = 0.2
+
+# platôs examinados por métrica, dos mais promissores para os menos
+MAX_CANDIDATES = 64
+
+
+def _lower_bounds(cgraph, node, scale):
+    """Limite inferior (linha reta, ver heuristic_scale) do custo de cada nó até node, como lista."""
+    lat, lng = float(cgraph.y[node]), float(cgraph.x[node])
+    return (haversine_array(np.asarray(cgraph.y), np.asarray(cgraph.x), lat, lng) * scale).tolist()
+
+
+def _bounded_tree(offsets, adjacency, weights, edge_ids, source, target, bound, max_stretch, limit):
+    """
+    A* de source até target que continua depois de chegar, guardando a aresta (posição no grafo)
+    que chegou a cada nó. edge_ids converte a posição na adjacência para a do grafo (None = a
+    mesma, busca direta). Com bound (limite inferior até target) consistente, cada nó sai da
+    heap já com o custo exato.
+
+    A busca fecha todos os nós com custo + bound(nó) até limit, que cai para
+    (1 + max_stretch) vezes o custo de target quando ele é fechado: uma elipse entre as
+    pontas, em vez do círculo de um Dijkstra. Retorna (custo dos nós fechados, aresta e nó
+    anterior de cada nó).
+    """
+    inf = float('inf')
+    cost = {source: 0.0}
+    edges = {source: -1}
+    parents = {source: -1}
+    settled = {}
+    minHeap = [(bound[source], 0.0, source)]
+    heappop = heapq.heappop
+    heappush = heapq.heappush
+    pops = stale_pops = relaxed_edges = 0
+
+    while minHeap:
+        key, current_cost, node = heappop(minHeap)
+        pops += 1
+        if key > limit:
+            break
+        if node in settled:
+            stale_pops += 1
+            continue
+        settled[node] = current_cost
+        if node == target:
+            # folga de arredondamento, para as rotas somadas aresta por aresta caberem no limite
+            limit = min(limit, current_cost * (1 + max_stretch) * (1 + 1e-9))
+
+        first, last = offsets[node], offsets[node + 1]
+        relaxed_edges += last - first
+        for e in range(first, last):
+            neighbour = adjacency[e]
+            new_cost = current_cost + weights[e]
+            if new_cost < cost.get(neighbour, inf):
+                key = new_cost + bound[neighbour]
+                if key <= limit:
+                    cost[neighbour] = new_cost
+                    edges[neighbour] = e if edge_ids is None else edge_ids[e]
+                    parents[neighbour] = node
+                    heappush(minHeap, (key, new_cost, neighbour))
+
+    record_search('alternative_routes', pushes=pops + len(minHeap), pops=pops, stale_pops=stale_pops,
+                  relaxed_edges=relaxed_edges)
+    return settled, edges, parents
+
+
+def _plateaus(cgraph, forward, forward_edges, forward_parents, backward, backward_edges, limit):
+    """
+    Trechos (platôs) que estão nas duas árvores: a aresta u -> v chegou em v pela árvore direta
+    e é a que sai de u pela árvore reversa. Todo nó de um platô tem o mesmo custo total
+    (ida + volta), o da rota que passa por ele. Retorna a lista de (início, fim) de cada platô
+    e o dict nó -> aresta seguinte no platô.
+    """
+    plateau_next = {}
+    has_previous = set()
+    for node, node_cost in forward.items():
+        e = forward_edges[node]
+        if e == -1 or node not in backward or node_cost + backward[node] > limit:
+            continue
+        u = forward_parents[node]
+        if u in backward and backward_edges[u] == e:
+            plateau_next[u] = e
+            has_previous.add(node)
+
+    targets = cgraph.adjacency('length')[1]
+    plateaus = []
+    for start in plateau_next:
+        if start in has_previous:
+            continue
+        end = start
+        while end in plateau_next:
+            end = targets[plateau_next[end]]
+        plateaus.append((start, end))
+    return plateaus, plateau_next
+
+
+def _via_route(cgraph, source, target, start, end, forward, backward, plateau_next):
+    """
+    Arestas da rota source -> start (árvore direta) -> end (platô) -> target (árvore reversa).
+    forward e backward são (arestas, nós anteriores) de cada árvore.
+    """
+    forward_edges, forward_parents = forward
+    backward_edges, backward_parents = backward
+    edges = []
+    node = start
+    while node != source:
+        edges.append(forward_edges[node])
+        node = forward_parents[node]
+    edges.reverse()
+    node = start
+    targets = cgraph.adjacency('length')[1]
+    while node != end:
+        e = plateau_next[node]
+        edges.append(e)
+        node = targets[e]
+    while node != target:
+        edges.append(backward_edges[node])
+        node = backward_parents[node]
+    return edges
+
+
+def alternatives(cgraph, start_node, end_node, weight_type, k=3, max_speed=None, max_stretch=MAX_STRETCH,
+                 max_overlap=MAX_OVERLAP, min_plateau=MIN_PLATEAU):
+    """
+    Até k rotas diferentes entre dois nós (ids do OSM) numa métrica, a primeira é a melhor.
+
+    Método dos platôs: uma árvore de caminhos mínimos a partir da origem e outra (no grafo
+    invertido) a partir do destino, as duas só com os nós que cabem numa rota de até
+    (1 + max_stretch) vezes o custo da melhor (pela linha reta até a outra ponta, com
+    max_speed como no A* bidirecional). Cada trecho que aparece nas duas árvores ao mesmo tempo define uma rota (ida pela
+    primeira árvore, o trecho, volta pela segunda), e todas as alternativas saem dessas duas
+    buscas, sem rodar o Dijkstra de novo com penalidades.
+
+    Uma alternativa é aceita se o platô cobre pelo menos min_plateau do custo da melhor rota,
+    se não passa por um nó duas vezes e se divide no máximo max_overlap do seu custo com cada
+    rota já escolhida. Os candidatos são examinados em ordem de custo fora do platô.
+
+    Retorna a lista de rotas (mesmo formato de shortest_and_fastest); vazia se não há caminho.
+    """
+    source = cgraph.index[start_node]
+    target = cgraph.index[end_node]
+    inf = float('inf')
+    scale = heuristic_scale(cgraph, weight_type, max_speed)
+
+    offsets, targets, weights = cgraph.adjacency(weight_type)
+    forward, forward_edges, forward_parents = _bounded_tree(
+        offsets, targets, weights, None, source, target, _lower_bounds(cgraph, target, scale), max_stretch, inf
+    )
+    if target not in forward:
+        return []
+    best = forward[target]
+    limit = best * (1 + max_stretch) * (1 + 1e-9)
+    r_offsets, r_sources, r_weights = cgraph.reverse_adjacency(weight_type)
+    backward, backward_edges, backward_parents = _bounded_tree(
+        r_offsets, r_sources, r_weights, cgraph.reverse_edges(), target, source,
+        _lower_bounds(cgraph, source, scale), max_stretch, limit
+    )
+
+    plateaus, plateau_next = _plateaus(
+        cgraph, forward, forward_edges, forward_parents, backward, backward_edges, limit
+    )
+    # (custo fora do platô, custo total, início, fim), só os platôs longos o bastante
+    candidates = []
+    for start, end in plateaus:
+        plateau = forward[end] - forward[start]
+        if plateau >= min_plateau * best:
+            total = forward[start] + backward[start]
+            candidates.append((total - plateau, total, start, end))
+    candidates.sort()
+    # a melhor rota vem primeiro, direto da árvore de ida (com empates ela pode não ser um platô só)
+    candidates.insert(0, (0.0, best, target, target))
+
+    lengths = np.asarray(cgraph.length)
+    times = np.asarray(cgraph.travel_time)
+    node_ids = cgraph.node_ids
+    routes = []
+    chosen = []
+    for outside, total, start, end in candidates[:MAX_CANDIDATES]:
+        if len(routes) == k:
+            break
+        edges = _via_route(
+            cgraph, source, target, start, end, (forward_edges, forward_parents),
+            (backward_edges, backward_parents), plateau_next
+        )
+        path = [source] + [targets[e] for e in edges]
+        if len(set(path)) != len(path):
+            continue
+        shared = [sum(weights[e] for e in edges if e in route_edges) for route_edges in chosen]
+        if any(cost > max_overlap * total for cost in shared):
+            continue
+
+        chosen.append(set(edges))
+        routes.append({
+            "path": [int(node_ids[node]) for node in path],
+            "edges": edges,
+            "cost": total,
+            "distance": float(lengths[edges].sum()),
+            "time": float(times[edges].sum()),
+        })
+    return routes
+
+
+def merge_alternatives(cgraph, routes, weight_type, k=3, max_overlap=MAX_OVERLAP):
+    """
+    Junta alternativas (com 'cost') de buscas entre pontas diferentes da mesma viagem, como as
+    de cada par de nós em spatial_index.routes_between_snaps: em ordem de custo, cada rota entra
+    se não passa duas vezes pela mesma rua e divide no máximo max_overlap do seu custo com cada
+    rota já escolhida, as regras de alternatives. A primeira é sempre a melhor de todas as buscas
+    (com os dois pontos na mesma rua de mão única, ela pode começar e terminar na mesma aresta).
+    """
+    weights = cgraph.weights(weight_type)
+    routes = sorted(routes, key=lambda route: route["cost"])
+    chosen = []
+    merged = []
+    for route in routes:
+        if len(merged) == k:
+            break
+        edges = set(route["edges"])
+        if merged and len(edges) != len(route["edges"]):
+            continue
+        shared = [float(weights[sorted(edges & route_edges)].sum()) for route_edges in chosen]
+        if any(cost > max_overlap * route["cost"] for cost in shared):
+            continue
+        chosen.append(edges)
+        merged.append(route)
+    return merged
+
+
+def alternative_routes(cgraph, start_node, end_node, k=3, **options):
+    """alternatives() nas duas métricas: {'length': [...], 'speed': [...]}, a melhor de cada uma primeiro."""
+    return {weight_type: alternatives(cgraph, start_node, end_node, weight_type, k, **options)
+            for weight_type in METRICS}
@@ -1,12 +1,46 @@
+import datetime
+import math
+import os
+import numpy as np
 import osmnx as ox
 import matplotlib.pyplot as plt
-import networkx as nx
-import heapq
 import pprint
-from heapdict import heapdict
 import folium
 import streamlit as st
 from streamlit_folium import st_folium
+from folium.elements import JSCSSMixin
+from folium.plugins import PolyLineFromEncoded
+from branca.element import MacroElement
+from jinja2 import Template
+from graph_loader import GraphLoader, OsmClient
+from routing_service import (
+    RouteRequest, RoutingService, ServiceBusy, alternatives_job, isochrones_job, pareto_job, route_job
+)
+from spatial_index import SpatialIndex
+from isochrones import ISOCHRONE_COLORS
+from route_cache import RouteCache, graph_version, speed_profile_hash
+from speed_profiles import DEFAULT_PROFILE, load_speed_profiles, profile_graph
+from live_traffic import CLOSED, LiveTraffic
+from instrumentation import METRICS, finish_trace, span, start_trace
+from route_geometry import bounds, encode_polyline, route_geometry, view_for_bounds
+from route_summary import route_summary, street_names
+
+# perfis de velocidade (carro, horário de pico, bicicleta...) de speed_profiles.json
+SPEED_PROFILES = load_speed_profiles()
+
+# cidades carregadas em segundo plano assim que o servidor sobe (separadas por ";")
+PREFETCH_PLACES = [place for place in os.environ.get("PREFETCH_PLACES", "").split(";") if place.strip()]
+
+# processos do serviço de rotas (0 = threads no próprio processo do Streamlit)
+ROUTING_WORKERS = int(os.environ.get("ROUTING_WORKERS", min(4, os.cpu_count() or 1)))
+
+# opções de trânsito ao vivo: multiplicador do tempo de viagem das ruas escolhidas
+TRAFFIC_LEVELS = {
+    "Interditada": CLOSED,
+    "Muito lenta (4x o tempo)": 4.0,
+    "Lenta (2x o tempo)": 2.0,
+    "Normal": 1.0,
+}
 
 def salvar_grafo_txt(graph, filename="./logs/graph_object.txt"):
     """
@@ -22,221 +56,333 @@ def salvar_grafo_txt(graph, filename="./logs/graph_object.txt"):
         f.write("\n\n=== graph._edge ===\n")
         f.write(pp.pformat(graph.edges))
 
-def dijkstra(graph, start_node, end_node, weight_type):
+def plot_city_graph(graph, route):
     """
-    weight_type='length'
-        Calcula a rota mais curta entre dois nós usando o algoritmo de Dijkstra.
-        O peso da aresta é a distância ('length').
-    weight_type='speed'
-        Calcula a rota mais rápida entre dois nós usando o algoritmo de Dijkstra.
-        O peso da aresta é a velocidade média da via ('speed').
+    Plota o grafo com a rota destacada.
     """
-    # TODO: comparar o tempo de execução usando heapq vs heapdict
-
-    # para simularmos a heap do jeito que aprendemos, precisamos usar 2 estruturas de dados, uma para o atual custo e outra para saber a ordem minHeap
-    cheapest_path = {node: float('inf') for node in graph.nodes}
-    cheapest_path[start_node] = 0
-    fastest_path_length = 0
-
-    # A gnt pode tentar usar heapdict para a estrutura da minHeap (com a heapq não é possivel apenas atualizar o custo de um nó já existente, ai inserimos o mesmo nó várias vezes com custos diferentes, mas eles são descartados logo quando retirados da heap, então não sei o quanto isso impacta na complexidade)
-    #minHeap = heapdict()
-    minHeap = [(0, start_node)]
-    #minHeap[start_node] = 0
-    heapq.heapify(minHeap)
-
-    predecessors = {node : None for node in graph.nodes}
-
-    while minHeap:
-        #current_cost, node = minHeap.popitem()
-        current_cost, node = heapq.heappop(minHeap)
+    fig, ax = ox.plot_graph(graph, node_size=0, edge_color="gray", edge_linewidth=0.5)
+    plt.show()
 
-        # se chegamos no nó final (ou o nó de destino foi removido), podemos parar
-        if node == end_node:
-            break
+# Legenda das rotas, fica no mapa base (o mesmo em todos os reruns)
+ROUTE_LEGEND_HTML = '''
+    <div style="position: fixed; 
+                top: 10px; right: 10px; width: 220px; height: 145px; 
+                background-color: white; border:2px solid grey; z-index:9999; 
+                font-size:14px; padding: 10px; border-radius: 5px;
+                box-shadow: 2px 2px 5px rgba(0,0,0,0.3);
+                color: black;">
+    <h4 style="margin-top:0; color: #333;">🗺️ Legenda das Rotas</h4>
+    <p style="margin: 5px 0;"><span style="color:blue; font-weight:bold;">━━━</span> Rota mais curta (distância)</p>
+    <p style="margin: 5px 0;"><span style="color:red; font-weight:bold;">━━━</span> Rota mais rápida (tempo)</p>
+    <p style="margin: 5px 0;"><span style="color:gray; font-weight:bold;">┅┅┅</span> Alternativas</p>
+    <p style="margin: 5px 0;">🟢 Início &nbsp;&nbsp;&nbsp; 🟠 Destino</p>
+    </div>
+    '''
 
-        # se o custo atual é maior que o custo mais barato conhecido, pulamos para a próxima iteração do while
-        if current_cost > cheapest_path[node]:
-            continue
+class EncodedPolylineSupport(JSCSSMixin, MacroElement):
+    """
+    Só carrega o plugin Leaflet.encoded (L.Polyline.fromEncoded). Fica no mapa base porque o
+    st_folium só carrega os scripts do mapa na primeira vez; as rotas chegam depois, como camada.
+    """
+    _template = Template("")
+    default_js = PolyLineFromEncoded.default_js
 
-        # iteramos sobre os vizinhos do nó atual
-        for _, neighbour, k, data in graph.edges(node, keys=True, data=True):
-            if weight_type == 'length':
-                weight = data.get('length', 1)
-            elif weight_type == 'speed':
-                # Calcula o tempo de viagem como distância/velocidade
-                length = data.get('length', 1)  # distância em metros
-                speed = data.get('speed', 20)   # velocidade em km/h
-                # Converte velocidade de km/h para m/s: speed_ms = speed * 1000 / 3600
-                speed_ms = speed * (1000 / 3600)
-                weight = length / speed_ms  # tempo em segundos
-            else:
-                weight = data.get(weight_type, 1)
-                
-            new_cost = cheapest_path[node] + weight
-
-            if new_cost < cheapest_path[neighbour]:
-                cheapest_path[neighbour] = new_cost
-                predecessors[neighbour] = node
-                # atualiza o custo na heap e dale siftup
-                #minHeap[neighbour] = new_cost
-                heapq.heappush(minHeap, (new_cost, neighbour))
-
-
-    # "Backtracking" do caminho mais curto
-    path = []
-    node = end_node
-    while node is not None:
-        path.append(node)
-        node = predecessors[node]
-    path.reverse()
-
-    return predecessors, path, cheapest_path[end_node]
-
-def set_edge_speed(graph):
-    """
-    Adiciona um atributo 'speed' às arestas do grafo com base no tipo de via e atribui valores de velocidade.
-    """
-
-    # inicializa todas as velocidades como 10 km/h (padrão)
-    nx.set_edge_attributes(graph, 10, name="speed")
-
-    highway_speeds = {
-        'secondary_link': 60,
-        'primary_link': 70,
-        'path': 5,
-        'pedestrian': 5,
-        'tertiary': 50,
-        'unclassified': 10,
-        'service': 15,
-        'primary': 70,
-        'secondary': 60,
-        'living_street': 10,
-        'residential': 20,
-        'footway': 5,
-        'construction': 5,
-        'track': 15,
-    }
-    
-    # Itera sobre todas as arestas e define a velocidade baseada no tipo de via
-    for u, v, k, data in graph.edges(keys=True, data=True):
-        highway_type = data.get('highway', 'unclassified')
-        if isinstance(highway_type, list):
-            # Se highway for uma lista, pega o primeiro elemento
-            highway_type = highway_type[0]
-        
-        if highway_type in highway_speeds:
-            data['speed'] = highway_speeds[highway_type]
-        else:
-            data['speed'] = 30  # velocidade padrão
+def base_map(location, attrs, zoom_start=14):
+    """
+    Mapa base da cidade: tiles, legenda e o plugin das polylines codificadas, sem nenhuma rota.
+    Como é sempre igual para a mesma cidade, o st_folium não recria o mapa entre os cliques;
+    rotas, marcadores e isócronas vão separados em route_layers (feature_group_to_add).
+    O objeto é montado a cada rerun (é barato) porque o st_folium altera o mapa que recebe.
+    """
+    m = folium.Map(location=location, zoom_start=zoom_start, attr=attrs["attr"], tiles=attrs["tiles"])
+    EncodedPolylineSupport().add_to(m)
+    m.get_root().html.add_child(folium.Element(ROUTE_LEGEND_HTML))
+    return m
 
-def plot_city_graph(graph, route):
+def compact_route(graph, shortest, fastest, alternatives=None):
     """
-    Plota o grafo com a rota destacada.
+    Desenho das duas rotas para o mapa: a geometry das ruas simplificada (Douglas–Peucker)
+    e codificada como polyline, bem menor que uma lista de coordenadas por nó.
+    alternatives ({'length': [...], 'speed': [...]}, sem a melhor de cada métrica) entram
+    como linhas a mais, com distância e tempo de cada uma.
+    Retorna um dict pequeno, que fica no session_state no lugar do mapa inteiro.
     """
-    fig, ax = ox.plot_graph(graph, node_size=0, edge_color="gray", edge_linewidth=0.5)
-    plt.show()
+    shortest_line = route_geometry(graph, shortest, 'length')
+    fastest_line = route_geometry(graph, fastest, 'speed')
+    lines = [shortest_line, fastest_line]
+    alternative_lines = []
+    for weight_type, routes in (alternatives or {}).items():
+        for route in routes:
+            line = route_geometry(graph, route, weight_type)
+            lines.append(line)
+            alternative_lines.append({
+                "line": encode_polyline(line),
+                "weight_type": weight_type,
+                "distance": route["distance"],
+                "time": route["time"],
+            })
+    return {
+        "shortest": encode_polyline(shortest_line),
+        "fastest": encode_polyline(fastest_line),
+        "alternatives": alternative_lines,
+        "start": shortest_line[0].tolist(),
+        "end": shortest_line[-1].tolist(),
+        "bounds": bounds(*lines),
+    }
 
-def plot_route_on_map(graph, shortest_path, fastest_path, attrs):
-    # Pegando as coordenadas do ponto de partida para centralizar o mapa
-    start_node = shortest_path[0]
-    start_location = (graph.nodes[start_node]['y'], graph.nodes[start_node]['x'])
+def route_layers(route):
+    """Camada com as duas rotas (compact_route), as alternativas e os marcadores de início e fim."""
+    layers = folium.FeatureGroup(name="Rotas")
 
-    # Cria um mapa Folium manualmente, centrado no ponto de partida
-    m = folium.Map(location=start_location, zoom_start=16, attr=attrs["attr"], tiles=attrs["tiles"])
+    # Alternativas (tracejadas, por baixo das rotas principais)
+    for number, alternative in enumerate(route.get("alternatives", []), 1):
+        color, label = ('blue', 'mais curta') if alternative["weight_type"] == 'length' else ('red', 'mais rápida')
+        text = (f'Alternativa à rota {label}: {alternative["distance"]/1000:.2f} km, '
+                f'{alternative["time"]/60:.1f} minutos')
+        line = PolyLineFromEncoded(alternative["line"], color=color, weight=5, opacity=0.45, dash_array='8 8')
+        line.add_child(folium.Popup(text, max_width=200))
+        line.add_child(folium.Tooltip(text))
+        line.add_to(layers)
 
     # Rota mais curta (azul)
-    shortest_coords = [(graph.nodes[node]['y'], graph.nodes[node]['x']) for node in shortest_path]
-    folium.PolyLine(
-        locations=shortest_coords, 
-        color='blue', 
-        weight=6, 
-        opacity=0.8,
-        popup=folium.Popup('🔵 Rota mais curta (menor distância)', max_width=200),
-        tooltip='Rota mais curta'
-    ).add_to(m)
+    shortest = PolyLineFromEncoded(route["shortest"], color='blue', weight=6, opacity=0.8)
+    shortest.add_child(folium.Popup('🔵 Rota mais curta (menor distância)', max_width=200))
+    shortest.add_child(folium.Tooltip('Rota mais curta'))
+    shortest.add_to(layers)
 
     # Rota mais rápida (vermelha)
-    fastest_coords = [(graph.nodes[node]['y'], graph.nodes[node]['x']) for node in fastest_path]
-    folium.PolyLine(
-        locations=fastest_coords, 
-        color='red', 
-        weight=6, 
-        opacity=0.8,
-        popup=folium.Popup('🔴 Rota mais rápida (menor tempo)', max_width=200),
-        tooltip='Rota mais rápida'
-    ).add_to(m)
+    fastest = PolyLineFromEncoded(route["fastest"], color='red', weight=6, opacity=0.8)
+    fastest.add_child(folium.Popup('🔴 Rota mais rápida (menor tempo)', max_width=200))
+    fastest.add_child(folium.Tooltip('Rota mais rápida'))
+    fastest.add_to(layers)
 
     # Adicionando marcadores de início e fim 
-    end_node = shortest_path[-1]
-    end_location = (graph.nodes[end_node]['y'], graph.nodes[end_node]['x'])
-    
     folium.Marker(
-        location=start_location, 
+        location=route["start"], 
         popup=folium.Popup('🟢 Ponto de Partida', max_width=150),
         tooltip='Início da rota',
         icon=folium.Icon(color='green', icon='play', prefix='fa')
-    ).add_to(m)
+    ).add_to(layers)
     
     folium.Marker(
-        location=end_location, 
+        location=route["end"], 
         popup=folium.Popup('🟠 Ponto de Destino', max_width=150),
         tooltip='Fim da rota',
         icon=folium.Icon(color='orange', icon='stop', prefix='fa')
-    ).add_to(m)
+    ).add_to(layers)
+    return layers
 
-    # Adiciona uma legenda HTML personalizada
-    legend_html = '''
-    <div style="position: fixed; 
-                top: 10px; right: 10px; width: 220px; height: 120px; 
-                background-color: white; border:2px solid grey; z-index:9999; 
-                font-size:14px; padding: 10px; border-radius: 5px;
-                box-shadow: 2px 2px 5px rgba(0,0,0,0.3);
-                color: black;">
-    <h4 style="margin-top:0; color: #333;">🗺️ Legenda das Rotas</h4>
-    <p style="margin: 5px 0;"><span style="color:blue; font-weight:bold;">━━━</span> Rota mais curta (distância)</p>
-    <p style="margin: 5px 0;"><span style="color:red; font-weight:bold;">━━━</span> Rota mais rápida (tempo)</p>
-    <p style="margin: 5px 0;">🟢 Início &nbsp;&nbsp;&nbsp; 🟠 Destino</p>
-    </div>
-    '''
-    m.get_root().html.add_child(folium.Element(legend_html))
+def plot_route_on_map(graph, shortest_path, fastest_path, attrs, shortest_coords=None, fastest_coords=None,
+                      alternatives=None):
+    """
+    Mapa completo (base + rotas) com as duas rotas, para usar fora do app (o benchmark, por exemplo).
+    Se shortest_coords/fastest_coords forem passados (rota que começa no meio da rua), as pontas
+    deles entram no lugar das dos nós. alternatives (rotas de alternative_routes, sem a melhor
+    de cada métrica) viram camadas a mais, tracejadas.
+    """
+    route = compact_route(
+        graph,
+        {"path": shortest_path, "coords": shortest_coords},
+        {"path": fastest_path, "coords": fastest_coords},
+        alternatives,
+    )
+    m = base_map(route["start"], attrs, zoom_start=16)
+    route_layers(route).add_to(m)
 
     # Ajusta o zoom para que toda a rota apareça na tela
-    all_coords = shortest_coords + fastest_coords
-    m.fit_bounds(all_coords)
+    m.fit_bounds(route["bounds"])
 
     return m
 
-@st.cache_data
+@st.cache_resource
+def get_graph_loader():
+    """
+    Carregador de grafos em segundo plano, um só para o servidor inteiro: a mesma cidade pedida
+    por várias sessões é baixada uma vez. Já começa a carregar as cidades de PREFETCH_PLACES.
+    """
+    # OSM_SERVER: URL de um osm_standin.py, para rodar sem internet com as respostas de ./cache
+    loader = GraphLoader(SPEED_PROFILES[DEFAULT_PROFILE], client=OsmClient(server=os.environ.get("OSM_SERVER")))
+    loader.prefetch(PREFETCH_PLACES)
+    return loader
+
+@st.cache_resource
 def get_graph(place_name):
     """
-    Baixa o grafo da cidade e o armazena em cache para não baixar novamente.
+    Grafo compilado da cidade, do disco (./cache/graphs) ou baixado e compilado pelo GraphLoader.
+    Os arrays são mapeados em memória e o cache_resource devolve o mesmo objeto para todas as
+    sessões, sem copiar o grafo a cada rerun. Espera o carregamento terminar; o main só chama
+    depois que o carregamento em segundo plano acabou.
     """
-    try:
-        graph = ox.graph_from_place(place_name, network_type="drive")
-        set_edge_speed(graph)
-        return graph
-    except Exception as e:
-        st.error(f"Não foi possível baixar o mapa para '{place_name}'. Verifique o nome do lugar.")
-        st.error(f"Erro: {e}")
+    return get_graph_loader().load(place_name)
+
+@st.fragment(run_every=1.0)
+def render_loading(place_name):
+    """
+    Acompanha o carregamento da cidade em segundo plano (só este pedaço da tela roda a cada
+    segundo) e roda o app de novo quando termina. Enquanto isso, o resto continua funcionando.
+    """
+    loader = get_graph_loader()
+    if loader.status(place_name) != 'loading':
+        st.rerun()
+    done, total = loader.progress(place_name)
+    parts = f" ({done} de {total} partes)" if total > 1 else ""
+    st.info(f"Carregando o mapa para {place_name} em segundo plano{parts}...")
+
+def get_profile_graph(place_name, profile_name):
+    """
+    Grafo da cidade com os tempos de viagem do perfil escolhido. Divide todos os arrays com
+    o grafo de get_graph, então trocar de perfil não copia nem recarrega o grafo.
+    """
+    graph = get_graph(place_name)
+    if graph is None:
         return None
+    return profile_graph(graph, profile_name, SPEED_PROFILES)
+
+@st.cache_resource
+def get_live_traffic(place_name):
+    """Interdições e lentidões da cidade, compartilhadas por todas as sessões (ver live_traffic)."""
+    graph = get_graph(place_name)
+    return LiveTraffic(graph) if graph is not None else None
+
+def routing_graph():
+    """Grafo usado nas buscas desta sessão (cidade carregada + perfil de velocidade + trânsito ao vivo)."""
+    place_name = st.session_state.last_loaded_place
+    return get_live_traffic(place_name).apply(get_profile_graph(place_name, st.session_state.speed_profile))
+
+def traffic_version(weight_type):
+    """Quantas vezes o trânsito ao vivo já mudou os pesos da métrica (entra na chave dos caches abaixo)."""
+    return get_live_traffic(st.session_state.last_loaded_place).versions[weight_type]
+
+@st.cache_data
+def get_street_names(place_name):
+    """Nomes de rua do grafo, em ordem alfabética, para escolher onde aplicar o trânsito ao vivo."""
+    graph = get_graph(place_name)
+    return sorted(graph.strings[code] for code in np.unique(graph.name).tolist() if code >= 0)
+
+def update_traffic(update):
+    """
+    Aplica uma mudança no trânsito ao vivo (update recebe o LiveTraffic) e mantém no cache
+    de rotas, para todos os perfis, só as rotas que a mudança não afeta.
+    """
+    place_name = st.session_state.last_loaded_place
+    live = get_live_traffic(place_name)
+    graphs = {name: get_profile_graph(place_name, name) for name in SPEED_PROFILES}
+    before = {name: speed_profile_hash(live.apply(graph)) for name, graph in graphs.items()}
+
+    change = update(live)
+    if change is None:
+        return
+
+    route_cache = get_route_cache()
+    for name, graph in graphs.items():
+        live_graph = live.apply(graph)
+        route_cache.rekey(graph_version(live_graph), before[name], speed_profile_hash(live_graph), change.keeps)
+
+@st.cache_resource
+def get_spatial_index(place_name):
+    """
+    KD-trees de nós e de trechos de rua do grafo carregado, montadas uma vez por cidade. São da
+    cidade inteira mesmo com o motor multinível: a partição só poupa memória nos processos de rota.
+    """
+    return SpatialIndex(get_graph(place_name))
+
+@st.cache_data
+def get_isochrones(place_name, profile_name, version, start_lat, start_lng, minutes):
+    """
+    Isócronas (GeoJSON) a partir do nó mais próximo do ponto, todas de uma árvore de Dijkstra só,
+    calculada no serviço de rotas. version é a versão de 'speed' no trânsito ao vivo.
+    """
+    (start_node,), _ = get_spatial_index(place_name).nearest_nodes([start_lat], [start_lng])
+    return get_routing_service().run(
+        isochrones_job, get_graph(place_name).store_path, profile_name,
+        get_live_traffic(place_name).snapshot(), int(start_node), minutes
+    )
+
+def add_isochrones(m):
+    """Desenha as isócronas do ponto de partida no mapa, da maior para a menor."""
+    if not (st.session_state.show_isochrones and st.session_state.start_point and st.session_state.isochrone_minutes):
+        return
+    try:
+        features = get_isochrones(
+            st.session_state.last_loaded_place,
+            st.session_state.speed_profile,
+            traffic_version('speed'),
+            st.session_state.start_point['lat'],
+            st.session_state.start_point['lng'],
+            tuple(sorted(st.session_state.isochrone_minutes))
+        )
+    except ServiceBusy:
+        st.warning("Servidor ocupado: as isócronas aparecem no próximo clique.")
+        return
+    for i, feature in reversed(list(enumerate(features))):
+        color = ISOCHRONE_COLORS[i % len(ISOCHRONE_COLORS)]
+        folium.GeoJson(
+            feature,
+            style_function=lambda _, color=color: {"fillColor": color, "color": color, "weight": 1, "fillOpacity": 0.25},
+            tooltip=f"{feature['properties']['minutes']:g} minutos"
+        ).add_to(m)
+
+@st.cache_resource
+def get_route_cache():
+    """
+    Cache de rotas compartilhado por todas as sessões (LRU em memória + SQLite em ./cache),
+    então a mesma rota pedida de novo, por qualquer usuário, não é recalculada.
+    """
+    return RouteCache(max_entries=2048, disk_path="./cache/routes.sqlite")
+
+@st.cache_resource
+def get_routing_service():
+    """
+    Serviço de rotas único para o servidor: as buscas de todas as sessões vão para o mesmo pool
+    (ROUTING_WORKERS processos), que abre cada cidade uma vez por processo, com fila limitada.
+    """
+    if ROUTING_WORKERS > 0:
+        return RoutingService(workers=ROUTING_WORKERS)
+    return RoutingService(processes=False)
+
+def route_request(start, end):
+    """Pedido ao serviço de rotas com a cidade, o perfil, o trânsito ao vivo, o motor e o horário desta sessão."""
+    place_name = st.session_state.last_loaded_place
+    return RouteRequest(
+        store_path=get_graph(place_name).store_path,
+        profile=st.session_state.speed_profile,
+        traffic=get_live_traffic(place_name).snapshot(),
+        engine=st.session_state.engine,
+        start=start,
+        end=end,
+        departure=departure_seconds() if st.session_state.use_departure else None,
+    )
 
 def initialize_session_state():
     """Inicializa o estado da sessão com valores padrão."""
     if "place_name" not in st.session_state:
         st.session_state.place_name = "Tamandaré, Pernambuco, Brazil"
+    if "engine" not in st.session_state:
+        st.session_state.engine = "Dijkstra"
+        st.session_state.speed_profile = DEFAULT_PROFILE
+        st.session_state.use_departure = False
+        st.session_state.departure_time = datetime.time(8, 0)
+        st.session_state.show_pareto = False
+        st.session_state.alternatives = 0
+        st.session_state.snap_to_edge = True
+        st.session_state.show_isochrones = False
+        st.session_state.isochrone_minutes = [5, 10, 15]
+        st.session_state.show_timings = False
     if "start_point" not in st.session_state:
         st.session_state.start_point = None
         st.session_state.end_point = None
-        st.session_state.route_map = None
-        st.session_state.shortest_path = None
-        st.session_state.fastest_path = None
+        st.session_state.route_geometry = None
+        st.session_state.route_summaries = None
         st.session_state.last_click = None
         st.session_state.zoom_level = None
         st.session_state.graph = None
         st.session_state.last_loaded_place = None
 
 def render_sidebar():
-    """Cria e gerencia o painel lateral da aplicação."""
+    """
+    Cria e gerencia o painel lateral da aplicação. Retorna o espaço do painel de tempos
+    (ou None se ele estiver desligado).
+    """
     with st.sidebar:
         st.header("Configurações")
         
@@ -247,6 +393,63 @@ def render_sidebar():
             key="place_input"
         )
         
+        st.session_state.engine = st.radio(
+            "Algoritmo de busca",
+            ["Dijkstra", "A* bidirecional", "Contraction Hierarchies", "Multinível (células)"],
+            index=["Dijkstra", "A* bidirecional", "Contraction Hierarchies", "Multinível (células)"].index(st.session_state.engine),
+            help="A* usa a distância em linha reta para visitar menos nós. Contraction Hierarchies pré-processa o grafo na primeira rota e depois responde bem mais rápido. Multinível divide o mapa em células e só abre as células por onde a rota passa, para regiões grandes."
+        )
+
+        st.session_state.speed_profile = st.selectbox(
+            "Perfil de velocidade",
+            list(SPEED_PROFILES),
+            index=list(SPEED_PROFILES).index(st.session_state.speed_profile),
+            format_func=lambda name: SPEED_PROFILES[name]['label'],
+            help="Velocidade de cada tipo de via usada na rota mais rápida (arquivo speed_profiles.json)."
+        )
+
+        st.session_state.use_departure = st.checkbox(
+            "Considerar horário de saída",
+            st.session_state.use_departure,
+            help="A rota mais rápida usa a velocidade de cada tipo de via na hora do dia (time_factors do perfil)."
+        )
+        if st.session_state.use_departure:
+            st.session_state.departure_time = st.time_input("Horário de saída", st.session_state.departure_time)
+
+        st.session_state.snap_to_edge = st.checkbox(
+            "Começar no ponto exato da rua",
+            st.session_state.snap_to_edge,
+            disabled=st.session_state.use_departure,
+            help="Projeta o clique na rua mais próxima em vez de usar o cruzamento mais próximo."
+        )
+        if st.session_state.use_departure and st.session_state.snap_to_edge:
+            st.caption("Com horário de saída, a rota começa e termina no cruzamento mais próximo.")
+
+        st.session_state.show_pareto = st.checkbox(
+            "Mostrar rotas intermediárias (Pareto)",
+            st.session_state.show_pareto,
+            help="Lista também as rotas que ficam entre a mais curta e a mais rápida."
+        )
+
+        st.session_state.alternatives = st.slider(
+            "Rotas alternativas por métrica",
+            0, 3,
+            st.session_state.alternatives,
+            help="Rotas até 25% mais longas (ou mais lentas) que a melhor, que dividem pouco caminho com ela. Não consideram o horário de saída."
+        )
+
+        st.session_state.show_isochrones = st.checkbox(
+            "Mostrar isócronas a partir da partida",
+            st.session_state.show_isochrones,
+            help="Área que dá para alcançar a partir do ponto de partida em cada tempo, com o perfil de velocidade escolhido."
+        )
+        if st.session_state.show_isochrones:
+            st.session_state.isochrone_minutes = st.multiselect(
+                "Minutos",
+                [2, 5, 10, 15, 20, 30],
+                st.session_state.isochrone_minutes
+            )
+
         st.info("Clique no mapa para definir os pontos de partida e chegada.")
 
         st.write(f"📍 **Partida:** {'Selecionada' if st.session_state.start_point else 'Não selecionada'}")
@@ -264,94 +467,111 @@ def render_sidebar():
         )
 
         if calculate_button:
-            calculate_route()
+            with span("calculate_route"):
+                calculate_route()
 
         if st.button("Limpar Pontos"):
             clear_points()
             st.rerun()
 
-def get_route_names(graph, route):
+        cache_stats = get_route_cache().stats()
+        st.caption(f"Cache de rotas: {cache_stats['hits']} acertos, {cache_stats['misses']} erros")
+
+        if st.session_state.graph is not None:
+            render_traffic_controls()
+
+        st.session_state.show_timings = st.toggle(
+            "Mostrar tempos de execução",
+            st.session_state.show_timings,
+            help="Tempo de cada etapa (carregar o grafo, buscar as rotas, desenhar o mapa...) e contadores das buscas."
+        )
+        # preenchido no fim do main, quando todas as etapas já foram medidas
+        return st.empty() if st.session_state.show_timings else None
+
+def render_traffic_controls():
+    """Interdições e lentidões por rua, aplicadas sem recarregar o grafo."""
+    with st.expander("Trânsito ao vivo"):
+        street = st.selectbox("Rua", get_street_names(st.session_state.last_loaded_place))
+        level = st.selectbox("Situação", list(TRAFFIC_LEVELS))
+        apply_column, clear_column = st.columns(2)
+        if apply_column.button("Aplicar") and street:
+            graph = st.session_state.graph
+            edges = np.flatnonzero(np.asarray(graph.name) == graph.string_id(street))
+            update_traffic(lambda live: live.update(edges, TRAFFIC_LEVELS[level]))
+        if clear_column.button("Liberar todas"):
+            update_traffic(LiveTraffic.clear)
+
+        multipliers = get_live_traffic(st.session_state.last_loaded_place).multipliers
+        st.caption(f"{int(np.count_nonzero(multipliers != 1))} trechos com trânsito alterado")
+
+def render_timings(panel, trace):
+    """Preenche o painel da barra lateral com o tempo de cada etapa e os contadores das buscas desta execução."""
+    with panel.container():
+        st.write("**Tempos desta execução**")
+        st.dataframe(
+            [{"etapa": "\u2003" * depth + name, "ms": round(seconds * 1000, 2)} for name, seconds, depth in trace.spans],
+            hide_index=True
+        )
+        if trace.counters:
+            st.write("**Buscas**")
+            st.dataframe(
+                [{"motor": engine, **counters} for engine, counters in trace.counters.items()],
+                hide_index=True
+            )
+        stats = get_routing_service().stats()
+        st.caption(
+            f"Serviço de rotas: {stats['pending']} pedidos em andamento (máx. {stats['max_pending']}), "
+            f"{stats['served']} atendidos, {stats['rejected']} recusados, {stats['timed_out']} sem resposta a tempo."
+        )
+        st.caption(f"Também em {METRICS.log_path} (JSON) e {METRICS.prometheus_path} (Prometheus).")
+
+def summarize_routes(graph, shortest, fastest):
     """
-    Retorna uma string com o nome das ruas da rota, tratando casos onde
-    o nome é uma lista de strings.
+    Resumo (ruas, totais, tipos de via) das duas rotas, das arestas que a busca usou.
+    Rotas que vieram só com os nós (cache antigo) recuperam as arestas pelo caminho.
     """
-    route_names = []
-    for i in range(len(route) - 1):
-        u = route[i]
-        v = route[i+1]
-        
-        # Acessa os dados da aresta entre os nós u e v
-        # O argumento keys=True é necessário para grafos multi-aresta
-        edge_data = graph.get_edge_data(u, v, key=0)
-
-        if edge_data:
-            # Pega o valor do atributo 'name', com um fallback se não existir
-            edge_name = edge_data.get('name')
-
-            # Trata o caso onde o 'name' é uma lista ou uma string
-            if isinstance(edge_name, list):
-                # Se for uma lista, pegue o primeiro nome
-                current_name = edge_name[0]
-            elif isinstance(edge_name, str):
-                # Se for uma string, use-a diretamente
-                current_name = edge_name
-            else:
-                # Se não houver nome, use um fallback
-                current_name = 'Sem nome'
-
-            # Adiciona o nome à lista, evitando duplicatas consecutivas
-            if not route_names or route_names[-1] != current_name:
-                route_names.append(current_name)
-    
-    # Junta os nomes das ruas em uma única string
-    return "  ➡️  ".join(route_names)
+    summaries = {}
+    for weight_type, route in (('length', shortest), ('speed', fastest)):
+        edges = route["edges"] if "edges" in route else graph.path_edges(route["path"], weight_type)
+        summaries[weight_type] = route_summary(graph, edges, route.get("edge_share", (1.0, 1.0)))
+    return summaries
 
 def compare_routes(shortest, fastest):
-    # Calcular e exibir a distância da rota mais curta (já está no 'cost' de dijkstra)
+    # distância e tempo das duas rotas já vêm da busca, não precisa percorrer os caminhos de novo
     st.success(f"Rota mais ***curta*** encontrada com {len(shortest['path'])} nós!")
-    st.metric(label="Distância Total", value=f"{shortest['cost']/1000:.2f} km")
-
-    # Calcular o tempo total de viagem da rota mais curta
-    total_time_shortest_route = 0
-    graph = st.session_state.graph
-
-    for i in range(len(shortest['path']) - 1):
-        u = shortest['path'][i]
-        v = shortest['path'][i+1]
-        
-        edge_data = graph.get_edge_data(u, v, key=0)
-
-        if edge_data and 'length' in edge_data and 'speed' in edge_data:
-            length = edge_data['length']
-            speed = edge_data['speed']
-            
-            # Converter a velocidade de km/h para m/s
-            speed_ms = speed * (1000 / 3600)
-            
-            # Calcular o tempo de viagem e somar ao total
-            if speed_ms > 0:
-                total_time_shortest_route += length / speed_ms
-
-    st.metric(label="Tempo Total de Viagem", value=f"{total_time_shortest_route/60:.2f} minutos")
+    st.metric(label="Distância Total", value=f"{shortest['distance']/1000:.2f} km")
+    st.metric(label="Tempo Total de Viagem", value=f"{shortest['time']/60:.2f} minutos")
 
     st.write("---") # Linha divisória para melhor visualização
 
-    # Calcular a distância total da rota mais rápida (implementação já feita)
-    total_length_fastest_route = 0
-    
-    for i in range(len(fastest['path']) - 1):
-        u = fastest['path'][i]
-        v = fastest['path'][i+1]
-        
-        edge_data = graph.get_edge_data(u, v, key=0)
-        
-        if edge_data and 'length' in edge_data:
-            total_length_fastest_route += edge_data['length']
-
     # Exibir a distância e o tempo da rota mais rápida
     st.success(f"Rota mais ***rápida*** encontrada com {len(fastest['path'])} nós!")
-    st.metric(label="Distância Total", value=f"{total_length_fastest_route/1000:.2f} km")
-    st.metric(label="Tempo Total de Viagem", value=f"{fastest['cost']/60:.2f} minutos")
+    st.metric(label="Distância Total", value=f"{fastest['distance']/1000:.2f} km")
+    st.metric(label="Tempo Total de Viagem", value=f"{fastest['time']/60:.2f} minutos")
+
+def show_pareto_routes(routes):
+    """Lista as rotas de Pareto (nenhuma é ao mesmo tempo mais curta e mais rápida que outra)."""
+    st.write("---")
+    st.write(f"**{len(routes)} rotas não dominadas** entre a mais curta e a mais rápida:")
+    for route in routes:
+        st.write(f"- {route['distance']/1000:.2f} km em {route['time']/60:.2f} minutos")
+
+def show_alternatives(alternatives):
+    """Lista as rotas alternativas de cada métrica (a primeira de cada lista é a melhor, já mostrada)."""
+    st.write("---")
+    for weight_type, label in (('length', 'mais curta'), ('speed', 'mais rápida')):
+        routes = alternatives[weight_type][1:]
+        if not routes:
+            st.write(f"Nenhuma alternativa à rota {label} com pouco caminho em comum.")
+            continue
+        st.write(f"**Alternativas à rota {label}:**")
+        for route in routes:
+            st.write(f"- {route['distance']/1000:.2f} km em {route['time']/60:.2f} minutos")
+
+def departure_seconds():
+    """Horário de saída escolhido, em segundos desde a meia-noite."""
+    departure = st.session_state.departure_time
+    return departure.hour * 3600 + departure.minute * 60
 
 def calculate_route():
     """Lógica para calcular e plotar a rota."""
@@ -360,94 +580,179 @@ def calculate_route():
             start_coords = (st.session_state.start_point['lat'], st.session_state.start_point['lng'])
             end_coords = (st.session_state.end_point['lat'], st.session_state.end_point['lng'])
 
-            start_node = ox.distance.nearest_nodes(st.session_state.graph, X=start_coords[1], Y=start_coords[0])
-            end_node = ox.distance.nearest_nodes(st.session_state.graph, X=end_coords[1], Y=end_coords[0])
-
-            shortest = {
-                "predecessors": None,
-                "path": None,
-                "cost": None
-            }
-            shortest["predecessors"], shortest["path"], shortest["cost"] = dijkstra(st.session_state.graph, start_node, end_node, 'length')
-
-            fastest = {
-                "predecessors": None,
-                "path": None,
-                "cost": None
+            # os dois pontos vão juntos para o índice espacial (consulta vetorizada)
+            spatial_index = get_spatial_index(st.session_state.last_loaded_place)
+            lats = np.array([start_coords[0], end_coords[0]])
+            lngs = np.array([start_coords[1], end_coords[1]])
+            with span("nearest_nodes"):
+                (start_node, end_node), _ = spatial_index.nearest_nodes(lats, lngs)
+
+            snap_to_edge = st.session_state.snap_to_edge and not st.session_state.use_departure
+            if snap_to_edge:
+                with span("nearest_edges"):
+                    start_snap, end_snap = spatial_index.nearest_edges(lats, lngs)
+                # no meio da rua a rota depende da aresta e da posição, não só do nó
+                start_key = ("edge", start_snap.edge, round(start_snap.fraction, 4))
+                end_key = ("edge", end_snap.edge, round(end_snap.fraction, 4))
+            else:
+                start_key, end_key = int(start_node), int(end_node)
+
+            # o hash das velocidades na chave separa as rotas de cada perfil
+            graph = routing_graph()
+            route_cache = get_route_cache()
+            keys = {
+                # com horário de saída a rota (e os totais) dependem também do horário
+                weight_type: RouteCache.make_key(
+                    graph, start_key, end_key,
+                    (weight_type, departure_seconds()) if st.session_state.use_departure else weight_type
+                )
+                for weight_type in ('length', 'speed')
             }
-            fastest["predecessors"], fastest["path"], fastest["cost"] = dijkstra(st.session_state.graph, start_node, end_node, 'speed')
-
-            if shortest["path"] and fastest["path"]:
+            with span("route_cache_get"):
+                shortest = route_cache.get(keys['length'])
+                fastest = route_cache.get(keys['speed'])
 
-                compare_routes(shortest, fastest)
-
-
-                st.session_state.route_map = plot_route_on_map(
-                    st.session_state.graph, 
-                    shortest["path"], 
-                    fastest["path"],
-                    {"attr": st.session_state.attr, "tiles": st.session_state.tiles}
-                )
-                st.session_state.shortest_path = shortest["path"]
-                st.session_state.fastest_path = fastest["path"]
+            # o mesmo pedido (pontas no meio da rua ou nos nós) vale para as rotas de Pareto e as alternativas
+            if snap_to_edge:
+                request = route_request(start_snap, end_snap)
+            else:
+                request = route_request(int(start_node), int(end_node))
+
+            if shortest is None or fastest is None:
+                # a busca roda no serviço de rotas, dividido com as outras sessões
+                # hierarquias e células são montadas uma vez por cidade, sem o prazo dos pedidos
+                prepared = get_routing_service().prepare(request.store_path, request.profile, request.engine)
+                if not prepared.done():
+                    with st.spinner("Preparando o motor de rotas para esta cidade (só na primeira vez)..."):
+                        with span("prepare_engine"):
+                            prepared.result()
+                with span("search"):
+                    try:
+                        shortest, fastest = get_routing_service().run(route_job, request)
+                    except ServiceBusy:
+                        st.warning("Muitas rotas sendo calculadas agora. Tente de novo em alguns segundos.")
+                        return
+                with span("route_cache_put"):
+                    route_cache.put(keys['length'], shortest)
+                    route_cache.put(keys['speed'], fastest)
+
+            if math.isfinite(shortest["cost"]) and math.isfinite(fastest["cost"]):
+
+                with span("compare_routes"):
+                    compare_routes(shortest, fastest)
+
+                if st.session_state.show_pareto:
+                    with span("pareto_routes"):
+                        try:
+                            show_pareto_routes(get_routing_service().run(pareto_job, request))
+                        except ServiceBusy:
+                            st.warning("Servidor ocupado: as rotas intermediárias ficaram de fora desta vez.")
+
+                alternatives = None
+                if st.session_state.alternatives:
+                    with span("alternative_routes"):
+                        try:
+                            alternatives = get_routing_service().run(
+                                alternatives_job, request, st.session_state.alternatives + 1
+                            )
+                        except ServiceBusy:
+                            st.warning("Servidor ocupado: as rotas alternativas ficaram de fora desta vez.")
+                    if alternatives is not None:
+                        show_alternatives(alternatives)
+                        alternatives = {weight_type: routes[1:] for weight_type, routes in alternatives.items()}
+
+                # só o desenho compacto das rotas fica na sessão; o mapa é montado em render_map
+                with span("route_geometry"):
+                    st.session_state.route_geometry = compact_route(graph, shortest, fastest, alternatives)
+                with span("route_summary"):
+                    st.session_state.route_summaries = summarize_routes(graph, shortest, fastest)
             else:
                 st.error("Não foi possível encontrar um caminho.")
-                st.session_state.route_map = None
+                st.session_state.route_geometry = None
 
 def clear_points():
     """Limpa os pontos de início e fim do estado da sessão."""
     st.session_state.start_point = None
     st.session_state.end_point = None
-    st.session_state.route_map = None
+    st.session_state.route_geometry = None
     st.session_state.last_click = None
-    st.session_state.shortest_path = None
+    st.session_state.route_summaries = None
 
 def render_map():
-    """Renderiza o mapa principal e gerencia a lógica de cliques."""
+    """
+    Renderiza o mapa principal e gerencia a lógica de cliques.
+    O mapa base é sempre o mesmo para a cidade; só a camada com rotas, marcadores e isócronas
+    muda entre os cliques, e é só ela que o st_folium atualiza no navegador.
+    """
     if st.session_state.graph:
-        if st.session_state.route_map:
-            # Exibe o mapa com a rota calculada
-            st_folium(st.session_state.route_map, width='100%', height=500, returned_objects=[])
+        attrs = {"attr": st.session_state.attr, "tiles": st.session_state.tiles}
+        m = base_map(list(st.session_state.graph.centroid()), attrs)
+
+        route = st.session_state.route_geometry
+        if route:
+            layers = route_layers(route)
+            # enquadra as rotas (o fit_bounds do mapa base só valeria na primeira vez)
+            center, zoom = view_for_bounds(route["bounds"])
         else:
-            # Exibe o mapa para seleção de pontos
-            avg_y = sum(d['y'] for n, d in st.session_state.graph.nodes(data=True)) / len(st.session_state.graph.nodes)
-            avg_x = sum(d['x'] for n, d in st.session_state.graph.nodes(data=True)) / len(st.session_state.graph.nodes)
-
-            m = folium.Map(location=[avg_y, avg_x], zoom_start=14, tiles=st.session_state.tiles, attr=st.session_state.attr)
-
+            # Camada para seleção de pontos
+            layers = folium.FeatureGroup(name="Pontos")
+            center, zoom = None, None
             if st.session_state.start_point:
                 folium.Marker(
                     location=[st.session_state.start_point['lat'], st.session_state.start_point['lng']],
                     popup='Ponto de Partida', icon=folium.Icon(color='green')
-                ).add_to(m)
+                ).add_to(layers)
             if st.session_state.end_point:
                 folium.Marker(
                     location=[st.session_state.end_point['lat'], st.session_state.end_point['lng']],
                     popup='Ponto de Chegada', icon=folium.Icon(color='red')
-                ).add_to(m)
-
-            map_data = st_folium(m, width='100%', height=500, returned_objects=['last_clicked', 'zoom'])
-
-            if map_data and map_data["last_clicked"] and map_data["last_clicked"] != st.session_state.last_click:
-                st.session_state.last_click = map_data["last_clicked"]
-                if st.session_state.start_point is None:
-                    st.session_state.start_point = map_data["last_clicked"]
-                elif st.session_state.end_point is None:
-                    st.session_state.end_point = map_data["last_clicked"]
-                st.session_state.zoom_level = map_data['zoom']
-                st.rerun()
+                ).add_to(layers)
+
+        with span("isochrones"):
+            add_isochrones(layers)
+
+        with span("st_folium"):
+            map_data = st_folium(
+                m, key="route_map", width='100%', height=500,
+                feature_group_to_add=layers, center=center, zoom=zoom,
+                # com a rota na tela os cliques não fazem nada
+                returned_objects=[] if route else ['last_clicked', 'zoom']
+            )
+
+        if not route and map_data and map_data["last_clicked"] and map_data["last_clicked"] != st.session_state.last_click:
+            st.session_state.last_click = map_data["last_clicked"]
+            if st.session_state.start_point is None:
+                st.session_state.start_point = map_data["last_clicked"]
+            elif st.session_state.end_point is None:
+                st.session_state.end_point = map_data["last_clicked"]
+            st.session_state.zoom_level = map_data['zoom']
+            st.rerun()
 
 def render_route_path():
     """Exibe o caminho da rota na interface."""
-    shortest_path = st.session_state.get("shortest_path")
-    fastest_path = st.session_state.get("fastest_path")
-    if fastest_path and shortest_path and st.session_state.graph:
-        route_names = get_route_names(st.session_state.graph, shortest_path)
+    summaries = st.session_state.get("route_summaries")
+    if summaries and st.session_state.graph:
+        route_names = "  ➡️  ".join(street_names(summaries['length']))
         st.info(f"📏 **Caminho da Rota mais curta:**\n\n{route_names}")
 
-        route_names = get_route_names(st.session_state.graph, fastest_path)
+        route_names = "  ➡️  ".join(street_names(summaries['speed']))
         st.info(f"🚀 **Caminho da Rota mais rápida:**\n\n{route_names}")
 
+        with st.expander("Distância por tipo de via"):
+            for label, summary in (("Rota mais curta", summaries['length']), ("Rota mais rápida", summaries['speed'])):
+                st.write(f"**{label}**")
+                st.dataframe(
+                    [
+                        {
+                            "tipo de via": highway["highway"] or "-",
+                            "km": round(highway["distance"] / 1000, 2),
+                            "% da rota": round(100 * highway["distance"] / max(summary["distance"], 1e-9), 1),
+                        }
+                        for highway in summary["highways"]
+                    ],
+                    hide_index=True
+                )
+
 def main():
     """Função principal que orquestra a aplicação Streamlit."""
     st.set_page_config(page_title="Calculadora de Rotas", layout="wide")
@@ -465,21 +770,50 @@ def main():
 
     initialize_session_state()
 
-    # Centralize o carregamento do grafo aqui
-    # Se o nome da cidade no input mudou, recarregue o grafo
-    if st.session_state.place_name != st.session_state.last_loaded_place:
-        with st.spinner(f"Carregando o mapa para {st.session_state.place_name}..."):
-            st.session_state.graph = get_graph(st.session_state.place_name)
-            st.session_state.last_loaded_place = st.session_state.place_name
-            clear_points() # Limpa os pontos antigos para a nova cidade
-            st.rerun()
-
-    st.session_state.tiles = "https://{s}.tile-cyclosm.openstreetmap.fr/cyclosm/{z}/{x}/{y}.png"
-    st.session_state.attr = '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors, Tiles courtesy of <a href="http://www.openstreetmap.bzh/" target="_blank">Breton OpenStreetMap Team</a>'
-
-    render_sidebar()
-    render_route_path()
-    render_map()
+    # cada execução do script vira um trace: etapas e contadores vão para o painel e para ./logs
+    trace = start_trace("main")
+    try:
+        with span("main"):
+            # Centralize o carregamento do grafo aqui
+            # Se o nome da cidade no input mudou, carrega o grafo novo em segundo plano;
+            # até ele ficar pronto, a cidade anterior continua na tela e pode ser usada
+            if st.session_state.place_name != st.session_state.last_loaded_place:
+                place_name = st.session_state.place_name
+                future = get_graph_loader().submit(place_name)
+                if not future.done():
+                    render_loading(place_name)
+                elif future.exception() is not None:
+                    st.error(f"Não foi possível baixar o mapa para '{place_name}'. Verifique o nome do lugar.")
+                    st.error(f"Erro: {future.exception()}")
+                    if st.button("Tentar de novo"):
+                        get_graph_loader().submit(place_name, retry=True)
+                        st.rerun()
+                else:
+                    with span("get_graph"):
+                        st.session_state.graph = get_graph(place_name)
+                    # o motor escolhido já começa a ser preparado no serviço de rotas, em segundo plano
+                    get_routing_service().prepare(
+                        st.session_state.graph.store_path, st.session_state.speed_profile, st.session_state.engine
+                    )
+                    st.session_state.last_loaded_place = place_name
+                    clear_points() # Limpa os pontos antigos para a nova cidade
+                    st.rerun()
+
+            st.session_state.tiles = "https://{s}.tile-cyclosm.openstreetmap.fr/cyclosm/{z}/{x}/{y}.png"
+            st.session_state.attr = '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors, Tiles courtesy of <a href="http://www.openstreetmap.bzh/" target="_blank">Breton OpenStreetMap Team</a>'
+
+            with span("render_sidebar"):
+                timings_panel = render_sidebar()
+            with span("render_route_path"):
+                render_route_path()
+            with span("render_map"):
+                render_map()
+    finally:
+        # também no st.rerun(), que interrompe o script com uma exceção
+        finish_trace(trace)
+
+    if timings_panel is not None:
+        render_timings(timings_panel, trace)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
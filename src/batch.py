@@ -0,0 +1,182 @@
+"""
+Roteamento em lote, sem o Streamlit: matrizes de distância e tempo entre muitos pontos.
+
+O arquivo de entrada (CSV ou Parquet) precisa das colunas 'lat' e 'lng'. Sem --destinations,
+todos os pontos são origem e destino (matriz quadrada).
+
+Uso (dentro da pasta src):
+    python batch.py pontos.csv --place "Tamandaré, Pernambuco, Brazil" --output matrizes.npz
+    python batch.py origens.parquet --destinations destinos.parquet --workers 8 --paths
+    python batch.py pontos.csv --profile bike
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from compiled_graph import dijkstra_tree, tree_path
+from graph_store import load_graph_store
+from spatial_index import SpatialIndex
+from speed_profiles import DEFAULT_PROFILE, apply_speed_profile, load_speed_profiles
+
+METRICS = ('length', 'speed')
+
+# grafo de cada processo do pool, aberto uma vez no initializer
+_worker_graph = None
+
+
+def _init_worker(store_path, cgraph, profile=None):
+    """
+    Abre o grafo no processo filho. Pelo arquivo mapeado, todos dividem a mesma memória;
+    só os tempos de viagem do perfil (se houver) são calculados em cada processo.
+    """
+    global _worker_graph
+    _worker_graph = load_graph_store(store_path) if store_path else cgraph
+    if profile is not None:
+        _worker_graph = apply_speed_profile(_worker_graph, profile)
+
+
+def _route_origins(origins, destinations, with_paths):
+    """
+    Linhas da matriz para um pedaço das origens (índices dos nós).
+    Uma árvore de Dijkstra por origem e métrica, que para quando todos os destinos foram fechados.
+    """
+    cgraph = _worker_graph
+    targets = set(destinations)
+    rows = {
+        weight_type: {
+            "distance": np.empty((len(origins), len(destinations)), dtype=np.float32),
+            "time": np.empty((len(origins), len(destinations)), dtype=np.float32),
+            "paths": [] if with_paths else None,
+        }
+        for weight_type in METRICS
+    }
+    for i, origin in enumerate(origins):
+        for weight_type in METRICS:
+            cost, other, predecessors = dijkstra_tree(cgraph, origin, weight_type, targets)
+            costs = np.array([cost[d] for d in destinations])
+            others = np.array([other[d] for d in destinations])
+            row = rows[weight_type]
+            row["distance"][i], row["time"][i] = (costs, others) if weight_type == 'length' else (others, costs)
+            if with_paths:
+                row["paths"].append([tree_path(cgraph, cost, predecessors, d) for d in destinations])
+    return rows
+
+
+def route_matrix(cgraph, origin_lats, origin_lngs, dest_lats=None, dest_lngs=None,
+                 workers=None, with_paths=False, chunk_size=64, profile=None):
+    """
+    Matrizes origem x destino para a rota mais curta ('length') e a mais rápida ('speed').
+
+    Os pontos são levados ao nó mais próximo pelo SpatialIndex (consulta vetorizada) e as
+    origens são divididas em pedaços entre os processos do pool. Se o grafo veio do
+    graph_store, cada processo abre o mesmo arquivo mapeado em memória em vez de receber
+    uma cópia. workers=1 roda tudo no processo atual. profile (um perfil de speed_profiles)
+    troca os tempos de viagem usados na rota mais rápida.
+
+    Retorna {'length': {...}, 'speed': {...}}, cada um com as matrizes 'distance' (metros) e
+    'time' (segundos) em float32 (inf quando não há caminho) e, se with_paths, 'paths'
+    (lista de listas de caminhos em ids do OSM).
+    """
+    index = SpatialIndex(cgraph)
+    origin_nodes, _ = index.nearest_nodes(origin_lats, origin_lngs)
+    origins = cgraph.index.positions(origin_nodes).tolist()
+    if dest_lats is None:
+        destinations = list(origins)
+    else:
+        dest_nodes, _ = index.nearest_nodes(dest_lats, dest_lngs)
+        destinations = cgraph.index.positions(dest_nodes).tolist()
+
+    chunks = [origins[i:i + chunk_size] for i in range(0, len(origins), chunk_size)]
+    store_path = getattr(cgraph, "store_path", None)
+
+    if workers == 1:
+        _init_worker(None, cgraph, profile)
+        parts = [_route_origins(chunk, destinations, with_paths) for chunk in chunks]
+    else:
+        # sem arquivo salvo, o grafo vai por pickle para cada processo
+        initargs = (store_path, None, profile) if store_path else (None, cgraph, profile)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+            parts = list(pool.map(_route_origins, chunks, [destinations] * len(chunks), [with_paths] * len(chunks)))
+
+    result = {}
+    for weight_type in METRICS:
+        result[weight_type] = {
+            "distance": np.concatenate([part[weight_type]["distance"] for part in parts]),
+            "time": np.concatenate([part[weight_type]["time"] for part in parts]),
+        }
+        if with_paths:
+            result[weight_type]["paths"] = [row for part in parts for row in part[weight_type]["paths"]]
+    return result
+
+
+def read_points(path):
+    """Lê lat/lng de um CSV ou Parquet."""
+    import pandas as pd
+
+    if path.endswith(".parquet"):
+        frame = pd.read_parquet(path, columns=["lat", "lng"])
+    else:
+        frame = pd.read_csv(path, usecols=["lat", "lng"])
+    return frame["lat"].to_numpy(dtype=np.float64), frame["lng"].to_numpy(dtype=np.float64)
+
+
+def load_graph(place_name, graph_store):
+    """Abre o grafo salvo; com --place usa a mesma chave do app (e baixa se ainda não existir)."""
+    if graph_store:
+        cgraph = load_graph_store(graph_store)
+        if cgraph is None:
+            raise SystemExit(f"Nenhum grafo salvo em {graph_store}")
+        return cgraph
+
+    from graph_loader import GraphLoader
+
+    return GraphLoader(load_speed_profiles()[DEFAULT_PROFILE]).load(place_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("points", help="CSV/Parquet com as colunas lat e lng (origens)")
+    parser.add_argument("--destinations", help="CSV/Parquet com os destinos (padrão: os mesmos pontos)")
+    parser.add_argument("--place", default="Tamandaré, Pernambuco, Brazil")
+    parser.add_argument("--graph-store", help="pasta de um grafo salvo pelo graph_store (ignora --place)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--profile", default=DEFAULT_PROFILE, help="perfil de velocidade de speed_profiles.json")
+    parser.add_argument("--paths", action="store_true", help="salva também os caminhos (JSON ao lado do .npz)")
+    parser.add_argument("--output", default="matrizes.npz")
+    args = parser.parse_args()
+
+    profiles = load_speed_profiles()
+    if args.profile not in profiles:
+        raise SystemExit(f"Perfil desconhecido: {args.profile} (opções: {', '.join(profiles)})")
+
+    cgraph = load_graph(args.place, args.graph_store)
+    origin_lats, origin_lngs = read_points(args.points)
+    dest_lats = dest_lngs = None
+    if args.destinations:
+        dest_lats, dest_lngs = read_points(args.destinations)
+
+    result = route_matrix(
+        cgraph, origin_lats, origin_lngs, dest_lats, dest_lngs,
+        workers=args.workers, with_paths=args.paths, profile=profiles[args.profile],
+    )
+
+    np.savez(
+        args.output,
+        shortest_distance=result['length']['distance'],
+        shortest_time=result['length']['time'],
+        fastest_distance=result['speed']['distance'],
+        fastest_time=result['speed']['time'],
+    )
+    if args.paths:
+        with open(os.path.splitext(args.output)[0] + "_paths.json", "w", encoding="utf-8") as f:
+            json.dump({"shortest": result['length']['paths'], "fastest": result['speed']['paths']}, f)
+
+    shape = result['length']['distance'].shape
+    print(f"Matrizes {shape[0]}x{shape[1]} salvas em {args.output}")
+
+
+if __name__ == "__main__":
+    main()
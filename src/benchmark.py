@@ -0,0 +1,323 @@
+"""
+Mede o desempenho do roteamento nas cidades salvas em ./cache (respostas do Overpass, sem internet).
+
+Para cada cidade: tempo e pico de memória de cada etapa (ler o JSON, set_edge_speed, compilar,
+índice espacial, Contraction Hierarchies), latência (média, p50, p95, p99) das consultas de
+ponto mais próximo, de cada motor de rota (dijkstra com heapq e com heapdict, CSR, as duas
+rotas numa chamada, A*, CH, multinível por células, dependente do tempo, rotas alternativas) e do
+desenho do mapa, e os nós fechados por busca.
+
+As consultas são sorteadas com --seed e podem ser salvas com --save-queries e repetidas
+depois com --replay (mesmos pares origem/destino, para comparar antes e depois de uma mudança).
+
+Uso (dentro da pasta src):
+    python benchmark.py --queries 200 --seed 42 --output benchmark.json
+    python benchmark.py --replay consultas.json --skip nx_heapq,nx_heapdict
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from app import SPEED_PROFILES, plot_route_on_map
+from alternative_routes import alternatives
+from bidirectional_astar import bidirectional_astar
+from compiled_graph import compile_graph, csr_dijkstra
+from contraction_hierarchies import build_contraction_hierarchy
+from instrumentation import Trace, use_trace
+from multi_criteria import shortest_and_fastest
+from partitioned_graph import PartitionedGraph, customize as customize_overlay, save_partitioned_store
+from reference_dijkstra import dijkstra, dijkstra_heapdict, set_edge_speed
+from overpass import graph_from_overpass_json, list_cached_responses
+from spatial_index import SpatialIndex
+from speed_profiles import DEFAULT_PROFILE, profile_max_speed
+from time_dependent import TimeDependentWeights, td_route
+
+# horário de saída das consultas dependentes do tempo (pico da tarde)
+TD_DEPARTURE = 18 * 3600
+
+# quantas rotas desenhar no mapa (o folium é bem mais lento que as buscas)
+MAX_RENDERED = 20
+
+# mapas para o desenho das rotas, os mesmos do app
+MAP_ATTRS = {
+    "tiles": "https://{s}.tile-cyclosm.openstreetmap.fr/cyclosm/{z}/{x}/{y}.png",
+    "attr": "&copy; OpenStreetMap contributors",
+}
+
+
+def latency_stats(samples):
+    """Resumo de uma lista de tempos em segundos, em milissegundos."""
+    ms = np.asarray(samples) * 1000
+    return {
+        "count": len(ms),
+        "mean": float(ms.mean()),
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "p99": float(np.percentile(ms, 99)),
+        "max": float(ms.max()),
+    }
+
+
+def timed(run, *args):
+    """(resultado, segundos) de run(*args)."""
+    start = time.perf_counter()
+    result = run(*args)
+    return result, time.perf_counter() - start
+
+
+def peak_memory(run, *args):
+    """Pico de memória alocada (bytes) durante run(*args), medido com o tracemalloc numa execução à parte."""
+    tracemalloc.start()
+    try:
+        run(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def same_cost(expected, found):
+    return expected == found or abs(expected - found) <= 1e-6 * max(1.0, expected)
+
+
+def make_queries(nodes, num_queries, seed):
+    """Pares (origem, destino) sorteados entre os nós, sempre os mesmos para a mesma seed."""
+    rng = random.Random(seed)
+    return [(rng.choice(nodes), rng.choice(nodes)) for _ in range(num_queries)]
+
+
+def build_partitioned(cgraph, folder):
+    """Particiona o grafo numa pasta e abre a partição (as células ficam no disco)."""
+    save_partitioned_store(cgraph, folder)
+    return PartitionedGraph(folder)
+
+
+def counted(run):
+    """
+    Motor que só retorna o custo -> (custo, nós fechados), com os nós fechados somados dos
+    contadores das buscas (record_search: pops - stale_pops) num trace só da consulta.
+    """
+    def run_counted(s, t, weight_type):
+        trace = Trace("benchmark")
+        with use_trace(trace):
+            cost = run(s, t, weight_type)
+        return cost, sum(counters["pops"] - counters["stale_pops"] for counters in trace.counters.values())
+    return run_counted
+
+
+def make_engines(graph, cgraph, hierarchies, overlays, tdw, max_speed):
+    """
+    Motores de rota: nome -> (métricas, função(origem, destino, métrica) -> (custo, nós fechados)).
+    """
+    def astar(s, t, weight_type):
+        _, cost, settled = bidirectional_astar(cgraph, s, t, weight_type, max_speed=max_speed)
+        return cost, settled
+
+    def alternative(s, t, weight_type):
+        # a primeira das alternativas é a melhor rota, o custo tem que bater com os outros motores
+        routes = alternatives(cgraph, s, t, weight_type, 3, max_speed=max_speed)
+        return routes[0]["cost"] if routes else float('inf')
+
+    def td(use_astar):
+        def run(s, t, weight_type):
+            route, settled = td_route(tdw, s, t, TD_DEPARTURE, max_speed=max_speed, use_astar=use_astar)
+            return route["cost"], settled
+        return run
+
+    return {
+        "nx_heapq": (('length', 'speed'), counted(lambda s, t, w: dijkstra(graph, s, t, w)[2])),
+        "nx_heapdict": (('length', 'speed'), counted(lambda s, t, w: dijkstra_heapdict(graph, s, t, w)[2])),
+        "csr": (('length', 'speed'), counted(lambda s, t, w: csr_dijkstra(cgraph, s, t, w)[2])),
+        # os nós fechados somam as duas métricas: são dois Dijkstras intercalados
+        "shared": (('length', 'speed'), counted(lambda s, t, w: shortest_and_fastest(cgraph, s, t)[w]["cost"])),
+        "astar": (('length', 'speed'), astar),
+        "ch": (('length', 'speed'), counted(lambda s, t, w: hierarchies[w].query(s, t)[1])),
+        # inclui as buscas dentro das células para desempacotar a rota
+        "mld": (('length', 'speed'), counted(lambda s, t, w: overlays[w].query(s, t)["cost"])),
+        # soma as buscas das árvores de ida e de volta
+        "alternatives": (('length', 'speed'), counted(alternative)),
+        # custo diferente dos outros (depende do horário), comparado só entre as duas versões
+        "td_dijkstra": (('speed',), td(False)),
+        "td_astar": (('speed',), td(True)),
+    }
+
+
+def run_engine(run, queries, weight_type):
+    """Latências, custos e nós fechados de um motor em todas as consultas."""
+    latencies = []
+    costs = []
+    settled = []
+    for s, t in queries:
+        (cost, num_settled), elapsed = timed(run, s, t, weight_type)
+        latencies.append(elapsed)
+        costs.append(cost)
+        if num_settled is not None:
+            settled.append(num_settled)
+    return latencies, costs, settled
+
+
+def benchmark_city(path, num_queries, seed, queries=None, skip=(), memory=True):
+    """
+    Roda tudo para uma cidade e retorna o resultado como dict (pronto para JSON).
+    Sem queries, sorteia num_queries pares com a seed.
+    """
+    result = {"file": os.path.basename(path), "stages": {}, "snapping": {}, "engines": {}}
+    stages = result["stages"]
+
+    def stage(name, run, *args):
+        value, elapsed = timed(run, *args)
+        stages[name] = {"seconds": elapsed, "peak_bytes": peak_memory(run, *args) if memory else None}
+        return value
+
+    graph = stage("load", graph_from_overpass_json, path)
+    stage("set_edge_speed", set_edge_speed, graph)
+    cgraph = stage("compile", compile_graph, graph)
+    index = stage("spatial_index", SpatialIndex, cgraph)
+    hierarchies = {
+        weight_type: stage(f"ch_{weight_type}", build_contraction_hierarchy, cgraph, weight_type)
+        for weight_type in ('length', 'speed')
+    }
+    partition_folder = tempfile.mkdtemp(prefix="partitioned-")
+    pgraph = stage("partition", build_partitioned, cgraph, os.path.join(partition_folder, "store"))
+    overlays = {
+        weight_type: stage(f"customize_{weight_type}", customize_overlay, pgraph, weight_type)
+        for weight_type in ('length', 'speed')
+    }
+    profile = SPEED_PROFILES[DEFAULT_PROFILE]
+    tdw = stage("time_dependent_weights", TimeDependentWeights, cgraph, profile)
+    result["nodes"] = cgraph.num_nodes
+    result["edges"] = cgraph.num_edges
+
+    if queries is None:
+        queries = make_queries(list(graph.nodes), num_queries, seed)
+    result["queries"] = queries
+
+    # pontos de clique: os nós das consultas deslocados alguns metros (~30 m), como um clique no mapa
+    rng = np.random.default_rng(seed)
+    origins = np.array(cgraph.coords([s for s, _ in queries]))
+    lats = origins[:, 0] + rng.normal(0, 0.0003, len(queries))
+    lngs = origins[:, 1] + rng.normal(0, 0.0003, len(queries))
+    result["snapping"]["nearest_nodes_batch"] = latency_stats([timed(index.nearest_nodes, lats, lngs)[1]])
+    result["snapping"]["nearest_nodes"] = latency_stats(
+        [timed(index.nearest_nodes, lats[i:i + 1], lngs[i:i + 1])[1] for i in range(len(queries))]
+    )
+    result["snapping"]["nearest_edges"] = latency_stats(
+        [timed(index.nearest_edges, lats[i:i + 1], lngs[i:i + 1])[1] for i in range(len(queries))]
+    )
+
+    max_speed = profile_max_speed(profile, cgraph)
+    engines = make_engines(graph, cgraph, hierarchies, overlays, tdw, max_speed)
+    reference = {}
+    for name, (metrics, run) in engines.items():
+        if name in skip:
+            continue
+        for weight_type in metrics:
+            latencies, costs, settled = run_engine(run, queries, weight_type)
+            # a referência é o primeiro motor que rodou na métrica (td_* só se compara entre si)
+            group = (weight_type, name.startswith("td_"))
+            expected = reference.setdefault(group, costs)
+            entry = result["engines"].setdefault(weight_type, {})[name] = {
+                "latency_ms": latency_stats(latencies),
+                "settled": None,
+                "peak_bytes": peak_memory(run_engine, run, queries[:20], weight_type) if memory else None,
+                "matches": all(same_cost(a, b) for a, b in zip(expected, costs)),
+            }
+            if settled:
+                entry["settled"] = {
+                    "mean": float(np.mean(settled)),
+                    "p50": float(np.percentile(settled, 50)),
+                    "p95": float(np.percentile(settled, 95)),
+                }
+    shutil.rmtree(partition_folder, ignore_errors=True)
+
+    # desenho: as duas rotas no folium e o HTML que o st_folium manda para o navegador
+    def render(s, t):
+        routes = shortest_and_fastest(cgraph, s, t)
+        if not routes['length']['path']:
+            return None
+        m = plot_route_on_map(cgraph, routes['length']['path'], routes['speed']['path'], MAP_ATTRS)
+        return m.get_root().render()
+
+    render_times = []
+    html_sizes = []
+    for s, t in queries[:MAX_RENDERED]:
+        html, elapsed = timed(render, s, t)
+        if html is not None:
+            render_times.append(elapsed)
+            html_sizes.append(len(html))
+    if render_times:
+        result["rendering"] = {
+            "latency_ms": latency_stats(render_times),
+            "html_bytes": float(np.mean(html_sizes)),
+        }
+    return result
+
+
+def print_city(result):
+    """Tabela resumida de uma cidade no terminal."""
+    print(f"\n{result['file'][:12]}: {result['nodes']} nós, {result['edges']} arestas")
+    for name, value in result["stages"].items():
+        memory = f"{value['peak_bytes'] / 2**20:8.1f} MiB" if value["peak_bytes"] is not None else ""
+        print(f"  {name:<24} {value['seconds'] * 1000:10.1f} ms {memory}")
+    for name, value in result["snapping"].items():
+        print(f"  {name:<24} p50 {value['p50']:8.3f} ms  p99 {value['p99']:8.3f} ms")
+    print(f"  {'motor':<24} {'média':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'nós':>9}  custos")
+    for weight_type, engines in result["engines"].items():
+        for name, value in engines.items():
+            latency = value["latency_ms"]
+            settled = f"{value['settled']['mean']:9.0f}" if value["settled"] else f"{'-':>9}"
+            print(
+                f"  {name + ' ' + weight_type:<24} {latency['mean']:9.3f} {latency['p50']:9.3f} "
+                f"{latency['p95']:9.3f} {latency['p99']:9.3f} {settled}  {'ok' if value['matches'] else 'DIFERENTE'}"
+            )
+    if "rendering" in result:
+        latency = result["rendering"]["latency_ms"]
+        print(f"  {'mapa (folium)':<24} {latency['mean']:9.3f} {latency['p50']:9.3f} {latency['p95']:9.3f} {latency['p99']:9.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cache-folder", default="./cache")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--cities", type=int, help="usa só as primeiras N cidades do cache")
+    parser.add_argument("--skip", default="", help="motores que não devem rodar, separados por vírgula")
+    parser.add_argument("--no-memory", action="store_true", help="não mede o pico de memória (roda mais rápido)")
+    parser.add_argument("--save-queries", help="salva as consultas sorteadas neste JSON")
+    parser.add_argument("--replay", help="repete as consultas de um JSON salvo com --save-queries")
+    parser.add_argument("--output", help="salva todos os resultados neste JSON")
+    args = parser.parse_args()
+
+    corpus = {}
+    if args.replay:
+        with open(args.replay, encoding="utf-8") as f:
+            corpus = json.load(f)["cities"]
+
+    paths = list_cached_responses(args.cache_folder)[:args.cities]
+    results = []
+    for path in paths:
+        name = os.path.basename(path)
+        if args.replay and name not in corpus:
+            continue
+        queries = [tuple(pair) for pair in corpus[name]] if args.replay else None
+        result = benchmark_city(path, args.queries, args.seed, queries=queries,
+                                skip=set(filter(None, args.skip.split(","))), memory=not args.no_memory)
+        print_city(result)
+        results.append(result)
+
+    if args.save_queries:
+        with open(args.save_queries, "w", encoding="utf-8") as f:
+            json.dump({"seed": args.seed, "cities": {r["file"]: r["queries"] for r in results}}, f)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"seed": args.seed, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import heapq
+
+from instrumentation import record_search
+from overpass import haversine
+
+# folga para erros de arredondamento: a heurística nunca pode passar do custo real
+HEURISTIC_SLACK = 0.999999
+
+
+def heuristic_scale(cgraph, weight_type, max_speed=None):
+    """
+    Fator que converte o haversine (metros) num limite inferior do custo em weight_type:
+    a própria distância para 'length', o tempo na maior velocidade (max_speed em km/h, por
+    padrão a maior do grafo) para 'speed'.
+    """
+    if weight_type == 'length':
+        return HEURISTIC_SLACK
+    if weight_type == 'speed':
+        if max_speed is None:
+            max_speed = cgraph.max_speed()
+        # metros -> segundos na velocidade máxima
+        return HEURISTIC_SLACK / (max_speed * (1000 / 3600))
+    raise ValueError(f"weight_type desconhecido: {weight_type!r}")
+
+
+def bidirectional_astar(cgraph, start_node, end_node, weight_type, max_speed=None):
+    """
+    A* bidirecional sobre o CompiledGraph, usando as coordenadas x/y dos nós.
+
+    A estimativa de distância até um nó é o haversine (linha reta na esfera), que nunca
+    é maior que o 'length' das ruas. Para 'speed' a estimativa é o haversine dividido
+    pela maior velocidade possível (max_speed em km/h, por padrão a maior do grafo).
+
+    As duas buscas usam a média das heurísticas (p_f = (h_t - h_s) / 2 e p_r = -p_f),
+    que continua consistente, então cada lado se comporta como um Dijkstra e o custo
+    encontrado é exatamente o mesmo do dijkstra comum.
+
+    Retorna (path, cost, settled), onde settled é o total de nós fechados nas duas buscas.
+    """
+    scale = heuristic_scale(cgraph, weight_type, max_speed)
+
+    index = cgraph.index
+    source = index[start_node]
+    target = index[end_node]
+    inf = float('inf')
+
+    if source == target:
+        return [start_node], 0.0, 1
+
+    x = cgraph.x
+    y = cgraph.y
+    source_lat, source_lng = float(y[source]), float(x[source])
+    target_lat, target_lng = float(y[target]), float(x[target])
+
+    potentials = {}
+
+    def forward_potential(node):
+        p = potentials.get(node)
+        if p is None:
+            lat, lng = float(y[node]), float(x[node])
+            to_target = haversine(lat, lng, target_lat, target_lng)
+            from_source = haversine(lat, lng, source_lat, source_lng)
+            p = (to_target - from_source) * scale / 2
+            potentials[node] = p
+        return p
+
+    graphs = (cgraph.adjacency(weight_type), cgraph.reverse_adjacency(weight_type))
+    dist = ({source: 0.0}, {target: 0.0})
+    pred = ({source: -1}, {target: -1})
+    # a chave na heap é custo + potencial; o potencial da busca reversa é -forward_potential
+    heaps = ([(forward_potential(source), source)], [(-forward_potential(target), target)])
+    sign = (1, -1)
+
+    best = inf
+    meeting_node = -1
+    settled = 0
+    pops = relaxed_edges = 0
+    heappop = heapq.heappop
+    heappush = heapq.heappush
+
+    while heaps[0] and heaps[1]:
+        # como p_f + p_r = 0, nenhum caminho ainda não visto pode ser menor que a soma dos topos
+        if heaps[0][0][0] + heaps[1][0][0] >= best:
+            break
+
+        # expande o lado com a menor heap
+        side = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+        key, node = heappop(heaps[side])
+        pops += 1
+        side_dist = dist[side]
+        current_cost = side_dist[node]
+        if key > current_cost + sign[side] * forward_potential(node):
+            continue
+        settled += 1
+
+        offsets, neighbours, weights = graphs[side]
+        side_pred = pred[side]
+        other_dist = dist[1 - side]
+        first, last = offsets[node], offsets[node + 1]
+        relaxed_edges += last - first
+        for e in range(first, last):
+            neighbour = neighbours[e]
+            new_cost = current_cost + weights[e]
+            if new_cost < side_dist.get(neighbour, inf):
+                side_dist[neighbour] = new_cost
+                side_pred[neighbour] = node
+                heappush(heaps[side], (new_cost + sign[side] * forward_potential(neighbour), neighbour))
+
+                other_cost = other_dist.get(neighbour)
+                if other_cost is not None and new_cost + other_cost < best:
+                    best = new_cost + other_cost
+                    meeting_node = neighbour
+
+    record_search('bidirectional_astar', pushes=pops + len(heaps[0]) + len(heaps[1]), pops=pops,
+                  stale_pops=pops - settled, relaxed_edges=relaxed_edges)
+
+    if meeting_node == -1:
+        return [], inf, settled
+
+    node_ids = cgraph.node_ids
+    path = []
+    node = meeting_node
+    while node != -1:
+        path.append(int(node_ids[node]))
+        node = pred[0][node]
+    path.reverse()
+    node = pred[1][meeting_node]
+    while node != -1:
+        path.append(int(node_ids[node]))
+        node = pred[1][node]
+
+    return path, best, settled
@@ -1,37 +1,41 @@
 import requests
 
+from osm_stream import OverpassStream, TagStats
+
 def main():
     place = input("Digite apenas o nome do lugar (ex: 'lugar=Tamandaré, UF=Pernambuco, País=Brazil'): ")
 
+    # "out body" traz os nós de cada via (só os ids), para contar os trechos
     query = f"""
         [out:json][timeout:25];
         area["name"="{place}"]["admin_level"="8"]->.a;
         (
         way["highway"](area.a);
         );
-        out tags;
+        out body;
     """
 
     url = "http://overpass-api.de/api/interpreter"
-    response = requests.get(url, params={"data": query})
-    data = response.json()
 
-    # extrai tipos de highway
-    highways = set()
+    # a resposta é lida em fluxo: só os contadores ficam na memória, não as vias
+    stats = TagStats()
+    with requests.get(url, params={"data": query}, stream=True) as response:
+        response.raise_for_status()
+        stream = OverpassStream(response)
+        for element in stream:
+            stats.add(element)
+    if stream.remark:
+        print(f"Aviso do Overpass (resposta incompleta): {stream.remark}")
 
-    for element in data['elements']:
-        hw = element['tags'].get('highway')
-        if hw:
-            highways.add(hw)
+    highways = sorted(stats.ways)
 
     with open("./logs/highway_types.txt", "w") as f:
-        for hw in sorted(highways):
+        for hw in highways:
             f.write(f"{hw}\n")
 
     print(f"Tipos de highways salvos em ./logs/highway_types.txt")
     print("Tipos de highways encontrados:")
-    for hw in sorted(highways):
-        print(hw)
+    stats.report()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,474 @@
+import copy
+import heapq
+
+import numpy as np
+
+from instrumentation import record_search
+from overpass import parse_maxspeed
+
+
+class NodeIndex:
+    """
+    id do OSM -> índice contíguo, por busca binária em node_ids na ordem de order (argsort
+    dos ids). Ao contrário de um dict, não cria um objeto python por nó: com o order salvo
+    no graph_store, os dois arrays vêm mapeados do disco e são divididos entre os processos.
+    """
+
+    def __init__(self, node_ids, order=None):
+        self.node_ids = node_ids
+        self.order = np.argsort(node_ids, kind='stable') if order is None else order
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __getitem__(self, osmid):
+        i = int(np.searchsorted(self.node_ids, osmid, sorter=self.order))
+        if i < len(self.order):
+            node = int(self.order[i])
+            if self.node_ids[node] == osmid:
+                return node
+        raise KeyError(osmid)
+
+    def __contains__(self, osmid):
+        return self.get(osmid) is not None
+
+    def get(self, osmid, default=None):
+        try:
+            return self[osmid]
+        except KeyError:
+            return default
+
+    def positions(self, osmids):
+        """Índices de vários ids de uma vez (array); KeyError se algum não estiver no grafo."""
+        osmids = np.asarray(osmids, dtype=np.int64)
+        i = np.minimum(np.searchsorted(self.node_ids, osmids, sorter=self.order), max(len(self.order) - 1, 0))
+        nodes = np.asarray(self.order)[i]
+        missing = np.asarray(self.node_ids)[nodes] != osmids
+        if missing.any():
+            raise KeyError(int(osmids[np.argmax(missing)]))
+        return nodes
+
+
+class CompiledGraph:
+    """
+    Versão "compilada" do MultiDiGraph do osmnx, montada uma vez por cidade carregada.
+
+    Os nós viram índices contíguos (0..n-1) e as arestas ficam no formato CSR:
+    as arestas que saem do nó i estão em targets[offsets[i]:offsets[i+1]].
+    Os pesos de cada métrica ficam em arrays de float já calculados, então o
+    Dijkstra não precisa mais abrir o dicionário de dados de cada aresta.
+    """
+
+    def __init__(self, node_ids, x, y, offsets, targets, length, speed, travel_time, maxspeed, highway, name,
+                 strings, geometry_offsets, geometry_x, geometry_y, node_order=None):
+        self.node_ids = node_ids        # índice -> id do nó no OSM
+        self.x = x                      # longitude de cada nó
+        self.y = y                      # latitude de cada nó
+        self.offsets = offsets          # int64, tamanho n + 1
+        self.targets = targets          # int32, tamanho m
+        self.length = length            # metros
+        self.speed = speed              # km/h, de set_edge_speed
+        self.travel_time = travel_time  # segundos, calculado com a 'speed' de set_edge_speed
+        self.maxspeed = maxspeed        # km/h da tag maxspeed do OSM (nan = sem tag), ver speed_profiles
+        self.highway = highway          # int32, posição do tipo de via em strings
+        self.name = name                # int32, posição do nome da rua em strings (-1 = sem nome)
+        self.strings = strings          # tabela de textos (tipos de via e nomes de rua)
+        # desenho de cada aresta (inclui os dois nós das pontas):
+        # pontos geometry_x/y[geometry_offsets[e]:geometry_offsets[e+1]]
+        self.geometry_offsets = geometry_offsets
+        self.geometry_x = geometry_x
+        self.geometry_y = geometry_y
+
+        # id do OSM -> índice contíguo (node_order = argsort de node_ids, salvo pelo graph_store)
+        self.index = NodeIndex(node_ids, node_order)
+
+        # cópias em lista python para o laço do Dijkstra (indexar lista é bem mais rápido que indexar
+        # np.ndarray). Não são divididas entre processos: cada um monta as suas na primeira busca de
+        # cada métrica, cerca de 50 bytes por aresta para a topologia e mais 32 por métrica.
+        self._adjacency_cache = {}
+
+    def with_speeds(self, speed, travel_time, length=None, changed_edges=None):
+        """
+        Cópia rasa do grafo com outras velocidades (ver speed_profiles). Todos os outros
+        arrays, o índice e as listas que não dependem do tempo são divididos com este grafo.
+
+        length troca também as distâncias (interdições, ver live_traffic). Se changed_edges
+        for passado, só essas arestas mudaram: as listas do Dijkstra já montadas são copiadas
+        e corrigidas nessas posições, em vez de convertidas de novo do array inteiro.
+        """
+        view = copy.copy(self)
+        view.speed = speed
+        view.travel_time = travel_time
+        shared = ('topology', 'reverse_edges')
+        if length is None:
+            shared += ('length', ('reverse', 'length'))
+        view._adjacency_cache = {key: value for key, value in self._adjacency_cache.items() if key in shared}
+        if length is not None:
+            view.length = length
+
+        if changed_edges is not None:
+            changed = np.asarray(changed_edges).tolist()
+            for weight_type in ('speed', 'length'):
+                if weight_type in self._adjacency_cache and weight_type not in view._adjacency_cache:
+                    offsets, targets, weights = self._adjacency_cache[weight_type]
+                    weights = list(weights)
+                    new_weights = view.weights(weight_type)
+                    for e in changed:
+                        weights[e] = float(new_weights[e])
+                    view._adjacency_cache[weight_type] = (offsets, targets, weights)
+        return view
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self):
+        return len(self.targets)
+
+    def weights(self, weight_type):
+        """Retorna o array de pesos das arestas para 'length' ou 'speed'."""
+        if weight_type == 'length':
+            return self.length
+        if weight_type == 'speed':
+            return self.travel_time
+        raise ValueError(f"weight_type desconhecido: {weight_type!r}")
+
+    def adjacency(self, weight_type):
+        """
+        Retorna (offsets, targets, weights) como listas python, montadas uma única vez por métrica.
+        """
+        if weight_type not in self._adjacency_cache:
+            if 'topology' not in self._adjacency_cache:
+                self._adjacency_cache['topology'] = (self.offsets.tolist(), self.targets.tolist())
+            offsets, targets = self._adjacency_cache['topology']
+            self._adjacency_cache[weight_type] = (offsets, targets, self.weights(weight_type).tolist())
+        return self._adjacency_cache[weight_type]
+
+    def reverse_adjacency(self, weight_type):
+        """
+        Mesmo formato de adjacency(), mas com as arestas invertidas (quem chega em cada nó),
+        usado pelas buscas que andam a partir do destino.
+        """
+        key = ('reverse', weight_type)
+        if key not in self._adjacency_cache:
+            # origem de cada aresta, depois ordena as arestas pelo nó de destino
+            sources = self.edge_sources()
+            order = np.asarray(self.reverse_edges(), dtype=np.int64)
+            offsets = np.zeros(self.num_nodes + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.targets, minlength=self.num_nodes), out=offsets[1:])
+            self._adjacency_cache[key] = (
+                offsets.tolist(),
+                sources[order].tolist(),
+                self.weights(weight_type)[order].tolist(),
+            )
+        return self._adjacency_cache[key]
+
+    def coords(self, nodes):
+        """Lista de (lat, lng) para uma lista de ids do OSM, no formato que o folium usa."""
+        positions = self.index.positions(nodes)
+        return list(zip(np.asarray(self.y)[positions].tolist(), np.asarray(self.x)[positions].tolist()))
+
+    def centroid(self):
+        """(lat, lng) médio dos nós, usado para centralizar o mapa. Calculado uma vez por grafo."""
+        if '_centroid' not in self.__dict__:
+            self._centroid = (float(np.mean(self.y)), float(np.mean(self.x)))
+        return self._centroid
+
+    def string_id(self, value):
+        """Posição de um texto (tipo de via ou nome de rua) em strings, ou None."""
+        if '_string_ids' not in self.__dict__:
+            self._string_ids = {s: i for i, s in enumerate(self.strings)}
+        return self._string_ids.get(value)
+
+    def edge_sources(self):
+        """Nó de origem (índice) de cada aresta, o inverso de offsets. Calculado uma vez por grafo."""
+        if '_edge_sources' not in self.__dict__:
+            self._edge_sources = np.repeat(np.arange(self.num_nodes, dtype=np.int32), np.diff(self.offsets))
+        return self._edge_sources
+
+    def reverse_edges(self):
+        """
+        Posição original de cada aresta na ordem de reverse_adjacency() (arestas ordenadas pelo
+        nó de destino), como lista python, para as buscas reversas devolverem as arestas do grafo.
+        """
+        if 'reverse_edges' not in self._adjacency_cache:
+            self._adjacency_cache['reverse_edges'] = np.argsort(self.targets, kind='stable').tolist()
+        return self._adjacency_cache['reverse_edges']
+
+    def path_edges(self, path, weight_type):
+        """
+        Arestas (posições) de um caminho em ids do OSM, para os motores que só devolvem os nós
+        (Contraction Hierarchies, A*). Entre arestas paralelas fica a mais barata na métrica do
+        caminho e, no empate, a mais barata na outra, o mesmo critério de shared_search.
+        """
+        positions = self.index.positions(path).tolist()
+        offsets, targets, primary = self.adjacency(weight_type)
+        secondary = self.adjacency('speed' if weight_type == 'length' else 'length')[2]
+        edges = []
+        for i, j in zip(positions, positions[1:]):
+            parallel = [e for e in range(offsets[i], offsets[i + 1]) if targets[e] == j]
+            edges.append(min(parallel, key=lambda e: (primary[e], secondary[e])))
+        return edges
+
+    def max_speed(self):
+        """Maior velocidade (km/h) entre as arestas, recuperada de length / travel_time."""
+        return float(np.max(self.length / self.travel_time)) * 3.6
+
+
+def edge_travel_time(length, speed):
+    """Tempo de viagem em segundos, mesma conta do dijkstra de referência (speed em km/h)."""
+    # Converte velocidade de km/h para m/s: speed_ms = speed * 1000 / 3600
+    return length / (speed * (1000 / 3600))
+
+
+def compile_graph(graph):
+    """
+    Monta um CompiledGraph a partir do MultiDiGraph (já com as velocidades de set_edge_speed).
+    Arestas paralelas são mantidas, o próprio Dijkstra escolhe a mais barata.
+    """
+    node_ids = list(graph.nodes)
+    index = {osmid: i for i, osmid in enumerate(node_ids)}
+
+    n = len(node_ids)
+    m = graph.number_of_edges()
+
+    x = np.empty(n, dtype=np.float64)
+    y = np.empty(n, dtype=np.float64)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    targets = np.empty(m, dtype=np.int32)
+    length = np.empty(m, dtype=np.float64)
+    speed = np.empty(m, dtype=np.float64)
+    maxspeed = np.empty(m, dtype=np.float64)
+    highway = np.empty(m, dtype=np.int32)
+    name = np.empty(m, dtype=np.int32)
+    geometry_offsets = np.zeros(m + 1, dtype=np.int64)
+    geometry_x = []
+    geometry_y = []
+
+    # cada texto (tipo de via ou nome de rua) é guardado uma vez só
+    strings = []
+    string_ids = {}
+
+    def intern(value):
+        if isinstance(value, list):
+            # igual ao set_edge_speed: se for lista, pega o primeiro
+            value = value[0]
+        if not isinstance(value, str):
+            return -1
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    e = 0
+    for i, u in enumerate(node_ids):
+        node_data = graph.nodes[u]
+        x[i] = node_data['x']
+        y[i] = node_data['y']
+
+        # graph._adj[u] = {vizinho: {key: dados_da_aresta}}
+        for v, edges in graph._adj[u].items():
+            for data in edges.values():
+                targets[e] = index[v]
+                # mesmos valores padrão usados pelo dijkstra
+                length[e] = data.get('length', 1)
+                speed[e] = data.get('speed', 20)
+                maxspeed[e] = parse_maxspeed(data.get('maxspeed'))
+                highway[e] = intern(data.get('highway', 'unclassified'))
+                name[e] = intern(data.get('name'))
+
+                # arestas simplificadas pelo osmnx têm 'geometry'; as retas vão de um nó ao outro
+                if 'geometry' in data:
+                    xs, ys = data['geometry'].xy
+                    geometry_x.extend(xs)
+                    geometry_y.extend(ys)
+                else:
+                    geometry_x.extend((node_data['x'], graph.nodes[v]['x']))
+                    geometry_y.extend((node_data['y'], graph.nodes[v]['y']))
+                geometry_offsets[e + 1] = len(geometry_x)
+                e += 1
+        offsets[i + 1] = e
+
+    return CompiledGraph(
+        node_ids=np.asarray(node_ids, dtype=np.int64),
+        x=x,
+        y=y,
+        offsets=offsets,
+        targets=targets,
+        length=length,
+        speed=speed,
+        travel_time=edge_travel_time(length, speed),
+        maxspeed=maxspeed,
+        highway=highway,
+        name=name,
+        strings=strings,
+        geometry_offsets=geometry_offsets,
+        geometry_x=np.asarray(geometry_x, dtype=np.float64),
+        geometry_y=np.asarray(geometry_y, dtype=np.float64),
+    )
+
+
+def csr_dijkstra(cgraph, start_node, end_node, weight_type):
+    """
+    Mesmo Dijkstra do reference_dijkstra.py (heapq com entradas repetidas), mas rodando sobre os arrays CSR.
+
+    Recebe e devolve ids do OSM, então pode substituir a chamada de dijkstra(graph, ...)
+    diretamente. O custo de cada nó fica num dict esparso, então só os nós alcançados
+    pela busca ocupam memória (antes eram dois dicts com todos os nós do grafo por consulta).
+    Se não houver caminho, retorna path vazio e custo infinito.
+    """
+    offsets, targets, weights = cgraph.adjacency(weight_type)
+    source = cgraph.index[start_node]
+    target = cgraph.index[end_node]
+
+    inf = float('inf')
+    cheapest_path = {source: 0.0}
+    predecessors = {source: -1}
+    minHeap = [(0.0, source)]
+
+    heappop = heapq.heappop
+    heappush = heapq.heappush
+    # contadores para a instrumentação (somados por nó, não por aresta, para pesar pouco no laço)
+    pops = stale_pops = relaxed_edges = 0
+
+    while minHeap:
+        current_cost, node = heappop(minHeap)
+        pops += 1
+
+        if node == target:
+            break
+
+        # entrada velha na heap (o nó já foi inserido de novo com custo menor)
+        if current_cost > cheapest_path[node]:
+            stale_pops += 1
+            continue
+
+        first, last = offsets[node], offsets[node + 1]
+        relaxed_edges += last - first
+        for e in range(first, last):
+            neighbour = targets[e]
+            new_cost = current_cost + weights[e]
+            if new_cost < cheapest_path.get(neighbour, inf):
+                cheapest_path[neighbour] = new_cost
+                predecessors[neighbour] = node
+                heappush(minHeap, (new_cost, neighbour))
+
+    # cada nó alcançado entrou na heap uma vez a cada melhora: pushes = pops + o que sobrou na heap
+    record_search('csr_dijkstra', pushes=pops + len(minHeap), pops=pops, stale_pops=stale_pops,
+                  relaxed_edges=relaxed_edges)
+
+    if target not in cheapest_path:
+        return {}, [], inf
+
+    # "Backtracking" do caminho, já convertendo os índices para os ids do OSM
+    node_ids = cgraph.node_ids
+    path = []
+    node = target
+    while node != -1:
+        path.append(int(node_ids[node]))
+        node = predecessors[node]
+    path.reverse()
+
+    osm_predecessors = {
+        int(node_ids[v]): (int(node_ids[u]) if u != -1 else None)
+        for v, u in predecessors.items()
+    }
+
+    return osm_predecessors, path, cheapest_path[target]
+
+
+def dijkstra_tree(cgraph, source, weight_type, targets=None, cutoff=None):
+    """
+    Dijkstra de um nó (índice contíguo) para todos os outros, sem parar num destino.
+
+    Retorna (cost, other, predecessors), listas do tamanho do grafo: custo na métrica
+    weight_type, total da outra métrica no mesmo caminho (tempo para 'length', distância
+    para 'speed') e o nó anterior na árvore (-1 para a origem e para os não alcançados).
+    Se targets (conjunto de índices) for passado, a busca para quando todos forem fechados.
+    Com cutoff, para ao passar desse custo: só os nós com cost <= cutoff estão fechados,
+    os outros podem ter ficado com um custo provisório.
+    """
+    other_type = 'speed' if weight_type == 'length' else 'length'
+    offsets, adjacency, weights = cgraph.adjacency(weight_type)
+    _, _, other_weights = cgraph.adjacency(other_type)
+
+    inf = float('inf')
+    n = cgraph.num_nodes
+    cost = [inf] * n
+    other = [inf] * n
+    predecessors = [-1] * n
+    cost[source] = 0.0
+    other[source] = 0.0
+    remaining = set(targets) if targets is not None else None
+
+    minHeap = [(0.0, source)]
+    heappop = heapq.heappop
+    heappush = heapq.heappush
+    pops = stale_pops = relaxed_edges = 0
+
+    while minHeap:
+        current_cost, node = heappop(minHeap)
+        pops += 1
+        if current_cost > cost[node]:
+            stale_pops += 1
+            continue
+        if cutoff is not None and current_cost > cutoff:
+            break
+
+        if remaining is not None:
+            remaining.discard(node)
+            if not remaining:
+                break
+
+        current_other = other[node]
+        first, last = offsets[node], offsets[node + 1]
+        relaxed_edges += last - first
+        for e in range(first, last):
+            neighbour = adjacency[e]
+            new_cost = current_cost + weights[e]
+            if new_cost < cost[neighbour]:
+                cost[neighbour] = new_cost
+                other[neighbour] = current_other + other_weights[e]
+                predecessors[neighbour] = node
+                heappush(minHeap, (new_cost, neighbour))
+
+    record_search('dijkstra_tree', pushes=pops + len(minHeap), pops=pops, stale_pops=stale_pops,
+                  relaxed_edges=relaxed_edges)
+    return cost, other, predecessors
+
+
+def shortest_path_tree(cgraph, start_node, weight_type, cutoff=None):
+    """
+    Árvore de caminhos mínimos a partir de start_node (id do OSM), até o custo cutoff
+    (metros para 'length', segundos para 'speed'; None = grafo inteiro).
+
+    Retorna um dict de arrays numpy, um elemento por nó fechado, em ordem de custo:
+    'index' (índice contíguo), 'node' (id do OSM), 'cost', 'other' (a outra métrica)
+    e 'predecessor' (índice do nó anterior, -1 na origem).
+    """
+    cost, other, predecessors = dijkstra_tree(cgraph, cgraph.index[start_node], weight_type, cutoff=cutoff)
+    cost = np.asarray(cost)
+    settled = np.flatnonzero(cost <= cutoff) if cutoff is not None else np.flatnonzero(np.isfinite(cost))
+    settled = settled[np.argsort(cost[settled], kind='stable')]
+    return {
+        "index": settled,
+        "node": np.asarray(cgraph.node_ids)[settled],
+        "cost": cost[settled],
+        "other": np.asarray(other)[settled],
+        "predecessor": np.asarray(predecessors)[settled],
+    }
+
+
+def tree_path(cgraph, cost, predecessors, target):
+    """Caminho (ids do OSM) da origem da árvore até target, ou [] se target não foi alcançado."""
+    if cost[target] == float('inf'):
+        return []
+    node_ids = cgraph.node_ids
+    path = []
+    node = target
+    while node != -1:
+        path.append(int(node_ids[node]))
+        node = predecessors[node]
+    path.reverse()
+    return path
@@ -0,0 +1,312 @@
+import hashlib
+import heapq
+import os
+
+import numpy as np
+
+from graph_store import save_npz
+from instrumentation import record_search
+
+# limite de nós visitados na busca de testemunha; se estourar, o atalho é criado (nunca quebra a corretude)
+WITNESS_SETTLE_LIMIT = 500
+
+
+class ContractionHierarchy:
+    """
+    Contraction Hierarchies para uma métrica ('length' ou 'speed') de um CompiledGraph.
+
+    Depois do pré-processamento cada nó tem um rank (ordem de contração) e o grafo
+    vira dois grafos "para cima": as arestas u -> v com rank[v] > rank[u] (busca a
+    partir da origem) e as arestas u -> v com rank[u] > rank[v], guardadas invertidas
+    (busca a partir do destino). A consulta é um Dijkstra bidirecional que só sobe
+    na hierarquia, então visita poucas centenas de nós mesmo em grafos grandes.
+    """
+
+    def __init__(self, cgraph, weight_type, rank, edge_tail, edge_head, edge_weight, edge_middle):
+        self.cgraph = cgraph
+        self.weight_type = weight_type
+        self.rank = rank
+        # todas as arestas do grafo final (originais + atalhos), no máximo uma por par (u, v)
+        # edge_middle = -1 para aresta original, ou o nó contraído que o atalho pula
+        self.edge_tail = edge_tail
+        self.edge_head = edge_head
+        self.edge_weight = edge_weight
+        self.edge_middle = edge_middle
+
+        self._middle = dict(zip(zip(edge_tail.tolist(), edge_head.tolist()), edge_middle.tolist()))
+        self._up = self._build_search_graph(upward=True)
+        self._down = self._build_search_graph(upward=False)
+
+    def _build_search_graph(self, upward):
+        """Lista de adjacência (por nó) com as arestas usadas pela busca de cada lado."""
+        n = self.cgraph.num_nodes
+        adjacency = [[] for _ in range(n)]
+        rank = self.rank.tolist()
+        for u, v, w in zip(self.edge_tail.tolist(), self.edge_head.tolist(), self.edge_weight.tolist()):
+            if upward and rank[v] > rank[u]:
+                adjacency[u].append((v, w))
+            elif not upward and rank[u] > rank[v]:
+                # busca reversa: sai de v e chega em u
+                adjacency[v].append((u, w))
+        return adjacency
+
+    def query(self, start_node, end_node):
+        """
+        Rota entre dois nós (ids do OSM). Retorna (path, cost), com o caminho já
+        desempacotado para os nós do grafo original. Sem caminho: ([], inf).
+        """
+        index = self.cgraph.index
+        source = index[start_node]
+        target = index[end_node]
+        inf = float('inf')
+
+        if source == target:
+            return [start_node], 0.0
+
+        dist = ({source: 0.0}, {target: 0.0})
+        pred = ({source: -1}, {target: -1})
+        heaps = ([(0.0, source)], [(0.0, target)])
+        graphs = (self._up, self._down)
+
+        best = inf
+        meeting_node = -1
+        heappop = heapq.heappop
+        heappush = heapq.heappush
+        pops = stale_pops = relaxed_edges = 0
+
+        while True:
+            # cada lado para quando o menor custo da sua heap já não pode melhorar a melhor rota
+            active = [side for side in (0, 1) if heaps[side] and heaps[side][0][0] < best]
+            if not active:
+                break
+            for side in active:
+                if not heaps[side] or heaps[side][0][0] >= best:
+                    continue
+                current_cost, node = heappop(heaps[side])
+                pops += 1
+                if current_cost > dist[side][node]:
+                    stale_pops += 1
+                    continue
+
+                other_cost = dist[1 - side].get(node)
+                if other_cost is not None and current_cost + other_cost < best:
+                    best = current_cost + other_cost
+                    meeting_node = node
+
+                side_dist = dist[side]
+                side_pred = pred[side]
+                edges = graphs[side][node]
+                relaxed_edges += len(edges)
+                for neighbour, weight in edges:
+                    new_cost = current_cost + weight
+                    if new_cost < side_dist.get(neighbour, inf):
+                        side_dist[neighbour] = new_cost
+                        side_pred[neighbour] = node
+                        heappush(heaps[side], (new_cost, neighbour))
+
+        record_search('contraction_hierarchy', pushes=pops + len(heaps[0]) + len(heaps[1]), pops=pops,
+                      stale_pops=stale_pops, relaxed_edges=relaxed_edges)
+
+        if meeting_node == -1:
+            return [], inf
+
+        # caminho na hierarquia: origem -> nó de encontro -> destino
+        up_path = []
+        node = meeting_node
+        while node != -1:
+            up_path.append(node)
+            node = pred[0][node]
+        up_path.reverse()
+        node = pred[1][meeting_node]
+        while node != -1:
+            up_path.append(node)
+            node = pred[1][node]
+
+        node_ids = self.cgraph.node_ids
+        path = [int(node_ids[node]) for node in self._unpack(up_path)]
+        return path, best
+
+    def _unpack(self, ch_path):
+        """Troca cada atalho u -> v pelos nós que ele pula (recursivamente, usando uma pilha)."""
+        path = [ch_path[0]]
+        for u, v in zip(ch_path, ch_path[1:]):
+            stack = [(u, v)]
+            while stack:
+                a, b = stack.pop()
+                middle = self._middle[(a, b)]
+                if middle == -1:
+                    path.append(b)
+                else:
+                    # empilha o segundo pedaço primeiro para desempacotar na ordem certa
+                    stack.append((middle, b))
+                    stack.append((a, middle))
+        return path
+
+    def save(self, path):
+        save_npz(
+            path,
+            rank=self.rank,
+            edge_tail=self.edge_tail,
+            edge_head=self.edge_head,
+            edge_weight=self.edge_weight,
+            edge_middle=self.edge_middle,
+        )
+
+    @classmethod
+    def load(cls, path, cgraph, weight_type):
+        with np.load(path) as data:
+            return cls(
+                cgraph,
+                weight_type,
+                rank=data['rank'],
+                edge_tail=data['edge_tail'],
+                edge_head=data['edge_head'],
+                edge_weight=data['edge_weight'],
+                edge_middle=data['edge_middle'],
+            )
+
+
+def _witness_search(out_edges, contracted, source, skipped, max_cost):
+    """Dijkstra limitado a partir de source, ignorando o nó que está sendo contraído."""
+    inf = float('inf')
+    dist = {source: 0.0}
+    heap = [(0.0, source)]
+    settled = 0
+    while heap and settled < WITNESS_SETTLE_LIMIT:
+        current_cost, node = heapq.heappop(heap)
+        if current_cost > max_cost:
+            break
+        if current_cost > dist[node]:
+            continue
+        settled += 1
+        for neighbour, (weight, _) in out_edges[node].items():
+            if neighbour == skipped or contracted[neighbour]:
+                continue
+            new_cost = current_cost + weight
+            if new_cost < dist.get(neighbour, inf):
+                dist[neighbour] = new_cost
+                heapq.heappush(heap, (new_cost, neighbour))
+    return dist
+
+
+def _shortcuts_for(node, out_edges, in_edges, contracted):
+    """Atalhos (u, w, peso) necessários para contrair node sem perder nenhum menor caminho."""
+    shortcuts = []
+    out_neighbours = [(w, weight) for w, (weight, _) in out_edges[node].items() if not contracted[w]]
+    if not out_neighbours:
+        return shortcuts
+    for u, (in_weight, _) in in_edges[node].items():
+        if contracted[u]:
+            continue
+        max_cost = in_weight + max(weight for _, weight in out_neighbours)
+        dist = _witness_search(out_edges, contracted, u, node, max_cost)
+        for w, out_weight in out_neighbours:
+            if w == u:
+                continue
+            via_node = in_weight + out_weight
+            if dist.get(w, float('inf')) > via_node:
+                shortcuts.append((u, w, via_node))
+    return shortcuts
+
+
+def build_contraction_hierarchy(cgraph, weight_type):
+    """
+    Pré-processamento: contrai os nós em ordem de "edge difference"
+    (atalhos criados - arestas removidas + vizinhos já contraídos), com atualização preguiçosa.
+    """
+    n = cgraph.num_nodes
+    offsets = cgraph.offsets.tolist()
+    targets = cgraph.targets.tolist()
+    weights = cgraph.weights(weight_type).tolist()
+
+    # grafo simples: para arestas paralelas fica só a mais barata; laços são descartados
+    out_edges = [{} for _ in range(n)]
+    in_edges = [{} for _ in range(n)]
+    for u in range(n):
+        for e in range(offsets[u], offsets[u + 1]):
+            v = targets[e]
+            if v == u:
+                continue
+            if v not in out_edges[u] or weights[e] < out_edges[u][v][0]:
+                out_edges[u][v] = (weights[e], -1)
+                in_edges[v][u] = (weights[e], -1)
+
+    contracted = [False] * n
+    deleted_neighbours = [0] * n
+
+    def priority(node):
+        shortcuts = _shortcuts_for(node, out_edges, in_edges, contracted)
+        removed = len(out_edges[node]) + len(in_edges[node])
+        return len(shortcuts) - removed + deleted_neighbours[node]
+
+    heap = [(priority(node), node) for node in range(n)]
+    heapq.heapify(heap)
+
+    rank = np.empty(n, dtype=np.int32)
+    current_rank = 0
+    while heap:
+        _, node = heapq.heappop(heap)
+        if contracted[node]:
+            continue
+
+        # atualização preguiçosa: se a prioridade piorou, devolve para a heap
+        new_priority = priority(node)
+        if heap and new_priority > heap[0][0]:
+            heapq.heappush(heap, (new_priority, node))
+            continue
+
+        for u, w, weight in _shortcuts_for(node, out_edges, in_edges, contracted):
+            if w not in out_edges[u] or weight < out_edges[u][w][0]:
+                out_edges[u][w] = (weight, node)
+                in_edges[w][u] = (weight, node)
+
+        contracted[node] = True
+        rank[node] = current_rank
+        current_rank += 1
+        for neighbour in set(out_edges[node]) | set(in_edges[node]):
+            deleted_neighbours[neighbour] += 1
+
+    edge_tail, edge_head, edge_weight, edge_middle = [], [], [], []
+    for u in range(n):
+        for v, (weight, middle) in out_edges[u].items():
+            edge_tail.append(u)
+            edge_head.append(v)
+            edge_weight.append(weight)
+            edge_middle.append(middle)
+
+    return ContractionHierarchy(
+        cgraph,
+        weight_type,
+        rank=rank,
+        edge_tail=np.asarray(edge_tail, dtype=np.int32),
+        edge_head=np.asarray(edge_head, dtype=np.int32),
+        edge_weight=np.asarray(edge_weight, dtype=np.float64),
+        edge_middle=np.asarray(edge_middle, dtype=np.int32),
+    )
+
+
+def graph_fingerprint(cgraph, weight_type):
+    """Hash do grafo + pesos; se qualquer velocidade mudar, o arquivo salvo deixa de valer."""
+    h = hashlib.sha1()
+    for array in (cgraph.node_ids, cgraph.offsets, cgraph.targets, cgraph.weights(weight_type)):
+        h.update(np.ascontiguousarray(array).tobytes())
+    return h.hexdigest()
+
+
+def load_or_build(cgraph, weight_type, folder="./cache/ch"):
+    """
+    Carrega a hierarquia salva em disco ou faz o pré-processamento e salva o resultado.
+    """
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{graph_fingerprint(cgraph, weight_type)}_{weight_type}.npz")
+    if os.path.exists(path):
+        return ContractionHierarchy.load(path, cgraph, weight_type)
+
+    ch = build_contraction_hierarchy(cgraph, weight_type)
+    ch.save(path)
+    return ch
+
+
+def load_or_build_all(cgraph, folder="./cache/ch"):
+    """Hierarquias das duas métricas usadas pelo app."""
+    return {weight_type: load_or_build(cgraph, weight_type, folder) for weight_type in ('length', 'speed')}
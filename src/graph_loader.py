@@ -0,0 +1,586 @@
+"""
+Carregamento dos grafos das cidades em segundo plano, sem passar pelo networkx.
+
+Para cada cidade: geocodifica o nome no Nominatim, divide a área nas mesmas partes que o
+osmnx usaria e baixa as partes do Overpass em paralelo. Cada resposta é reduzida assim que
+chega (só os nós e as vias que interessam ficam na memória) e, no fim, o grafo é montado
+direto nos arrays do CompiledGraph: recorte pela área, maior componente e simplificação com
+as mesmas regras do osmnx. O resultado vai para o graph_store, como o get_graph do app fazia.
+
+As respostas usam o mesmo cache do osmnx (./cache, arquivo = sha1 da URL), então uma cidade
+já baixada pelo osmnx não é baixada de novo. Para testar sem internet, osm_standin.py serve
+esse cache como se fosse o Nominatim e o Overpass:
+
+    python osm_standin.py --port 8765
+    python graph_loader.py "Tamandaré, Pernambuco, Brazil" --server http://127.0.0.1:8765 --cache-folder /tmp/osm
+
+Sem --server, usa os servidores configurados no osmnx (ox.settings).
+
+Regiões grandes demais para o Overpass (um estado, um país) podem vir de um extrato .osm.pbf
+(ou de uma resposta do Overpass salva), lido em fluxo numa passada só (ver osm_stream.py). O
+grafo é salvo com o nome dado, que é o que se digita no app para abri-lo:
+
+    python graph_loader.py "Pernambuco, Brazil" --file pernambuco-latest.osm.pbf
+    python graph_loader.py "Brazil" --file brazil-latest.osm.pbf --node-index dense_file_array,/tmp/nodes.idx
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import osmnx as ox
+import requests
+import shapely
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from compiled_graph import CompiledGraph
+from graph_store import load_or_build
+from osm_stream import CHUNK_SIZE, NODE_INDEX, OverpassStream, TagStats, iter_osm_elements, network_way_filter
+from overpass import haversine_array, is_oneway, parse_maxspeed
+from speed_profiles import DEFAULT_PROFILE, apply_speed_profile, load_speed_profiles
+
+# mesma margem do osmnx.graph_from_polygon: baixa 500 m além da área para não cortar ruas na borda
+BUFFER_M = 500
+
+
+class OsmClient:
+    """
+    Pedidos ao Nominatim e ao Overpass com o cache de respostas do osmnx.
+    Pode ser usado de várias threads ao mesmo tempo (cada pedido abre sua própria conexão).
+    server: URL de um osm_standin.py, no lugar dos dois servidores.
+    """
+
+    def __init__(self, nominatim_url=None, overpass_url=None, cache_folder=None, timeout=None, server=None):
+        if server:
+            nominatim_url = server
+            overpass_url = server.rstrip("/") + "/api"
+        self.nominatim_url = (nominatim_url or ox.settings.nominatim_url).rstrip("/")
+        self.overpass_url = (overpass_url or ox.settings.overpass_url).rstrip("/")
+        self.cache_folder = cache_folder or ox.settings.cache_folder
+        self.timeout = timeout or ox.settings.requests_timeout
+        self.headers = {"User-Agent": ox.settings.http_user_agent}
+
+    def _cache_path(self, url):
+        # mesmo nome de arquivo do osmnx: sha1 da URL do pedido (GET, mesmo quando é enviado por POST)
+        return os.path.join(self.cache_folder, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+    def _request(self, method, url, params):
+        key = str(requests.Request("GET", url, params=params).prepare().url)
+        path = self._cache_path(key)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+
+        if method == "POST":
+            response = requests.post(url, data=params, timeout=self.timeout, headers=self.headers)
+        else:
+            response = requests.get(url, params=params, timeout=self.timeout, headers=self.headers)
+        response.raise_for_status()
+        data = response.json()
+        # respostas com "remark" são erros do Overpass (tempo esgotado, memória...), não vão para o cache
+        if not (isinstance(data, dict) and "remark" in data):
+            os.makedirs(self.cache_folder, exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(temp_path, path)
+        return data
+
+    def geocode(self, place_name):
+        """Polígono (shapely, lng/lat) do lugar: o resultado mais importante que for uma área, como no osmnx."""
+        params = OrderedDict(format="json", polygon_geojson=1, dedupe=0, limit=50, q=place_name)
+        results = self._request("GET", self.nominatim_url + "/search", params)
+        for result in sorted(results, key=lambda r: r["importance"], reverse=True):
+            if result.get("geojson", {}).get("type") in ("Polygon", "MultiPolygon"):
+                return shapely.geometry.shape(result["geojson"])
+        raise ValueError(f"O Nominatim não encontrou uma área para '{place_name}'")
+
+    def overpass_file(self, query):
+        """
+        Caminho da resposta do Overpass no cache. Se ainda não estiver lá, é baixada em fluxo,
+        pedaço por pedaço direto para o arquivo, e lida em fluxo (OverpassStream) só para achar
+        um "remark": a resposta nunca fica inteira na memória. Com remark (erro do Overpass,
+        como tempo esgotado), a resposta não vai para o cache e levanta RuntimeError.
+        """
+        url = self.overpass_url + "/interpreter"
+        params = OrderedDict(data=query)
+        path = self._cache_path(str(requests.Request("GET", url, params=params).prepare().url))
+        if os.path.exists(path):
+            return path
+
+        os.makedirs(self.cache_folder, exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with requests.post(url, data=params, timeout=self.timeout, headers=self.headers, stream=True) as response:
+                response.raise_for_status()
+                with open(temp_path, "wb") as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+            stream = OverpassStream(temp_path)
+            for _ in stream:
+                pass
+            if stream.remark is not None:
+                raise RuntimeError(f"O Overpass não completou a resposta: {stream.remark}")
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return path
+
+
+def network_queries(polygon):
+    """
+    Consultas do Overpass para as ruas de carro dentro do polígono, uma por parte da área.
+    Usa as funções do osmnx que dividem a área e montam o filtro de 'drive', para as consultas
+    (e os nomes no cache) serem exatamente as do ox.graph_from_place.
+    """
+    from osmnx import _overpass
+
+    settings = _overpass._make_overpass_settings()
+    way_filter = _overpass._get_network_filter("drive")
+    return [
+        f"{settings};(way{way_filter}(poly:{coords!r});>;);out;"
+        for coords in _overpass._make_overpass_polygon_coord_strs(polygon)
+    ]
+
+
+def buffered_polygon(polygon, meters=BUFFER_M):
+    """O polígono aumentado em metros (projetado em UTM, como no osmnx)."""
+    projected, crs = ox.projection.project_geometry(polygon)
+    buffered, _ = ox.projection.project_geometry(projected.buffer(meters), crs=crs, to_latlong=True)
+    return buffered
+
+
+def _largest_component(num_nodes, sources, targets):
+    """Máscara das arestas que ficam na maior componente fracamente conexa."""
+    if len(sources) == 0:
+        return np.zeros(0, dtype=bool)
+    matrix = coo_matrix((np.ones(len(sources)), (sources, targets)), shape=(num_nodes, num_nodes))
+    _, labels = connected_components(matrix, directed=True, connection='weak')
+    # conta só os nós que têm aresta (os outros são componentes de um nó só)
+    used = np.unique(np.concatenate((sources, targets)))
+    largest = np.argmax(np.bincount(labels[used]))
+    return labels[sources] == largest
+
+
+def _first_and_last(ids):
+    """
+    Ids sem repetição na ordem da primeira aparição e, para cada um, a posição da última
+    aparição (como um dict em que a chave repetida fica no lugar e o valor é trocado).
+    """
+    unique, first = np.unique(ids, return_index=True)
+    _, last = np.unique(ids[::-1], return_index=True)
+    order = np.argsort(first, kind='stable')
+    return unique[order], (len(ids) - 1 - last)[order]
+
+
+class NetworkBuilder:
+    """
+    Junta os elementos do OSM (respostas do Overpass na ordem em que chegarem, ou um arquivo
+    lido em fluxo) e monta o CompiledGraph. Dos elementos ficam só as coordenadas dos nós e,
+    de cada via, os nós, o tipo de via, o nome, o sentido e a maxspeed; o resto é descartado
+    assim que o elemento é lido.
+
+    Tudo fica em arrays planos (array do python, sem um objeto por nó ou por via): 24 bytes
+    por coordenada recebida, 8 por nó de cada via e 25 por via. Nós e vias repetidos (nas
+    bordas das partes, ou as coordenadas que vêm junto com cada via) ficam todos nos arrays e
+    só são resolvidos em build, valendo a última cópia de cada id.
+    """
+
+    def __init__(self):
+        self._node_ids = array('q')
+        self._lat = array('d')
+        self._lng = array('d')
+        # nós das vias num array só: a via w usa _way_nodes[_way_offsets[w]:_way_offsets[w + 1]]
+        self._way_ids = array('q')
+        self._way_nodes = array('q')
+        self._way_offsets = array('q', [0])
+        self._highway = array('i')
+        self._name = array('i')
+        self._direction = array('b')
+        self._maxspeed = array('d')
+        # tipos de via e nomes de rua, guardados uma vez só
+        self.strings = []
+        self._string_ids = {}
+
+    def _intern(self, value):
+        if not isinstance(value, str):
+            return -1
+        code = self._string_ids.get(value)
+        if code is None:
+            code = self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def _text(self, code):
+        return self.strings[code] if code >= 0 else None
+
+    def add_element(self, element):
+        if element["type"] == "node":
+            self._node_ids.append(element["id"])
+            self._lat.append(element["lat"])
+            self._lng.append(element["lon"])
+        elif element["type"] == "way" and "highway" in element.get("tags", {}):
+            tags = element["tags"]
+            self._way_ids.append(element["id"])
+            self._way_nodes.extend(element["nodes"])
+            self._way_offsets.append(len(self._way_nodes))
+            self._highway.append(self._intern(tags["highway"]))
+            self._name.append(self._intern(tags.get("name")))
+            self._direction.append(is_oneway(tags))
+            self._maxspeed.append(parse_maxspeed(tags.get("maxspeed")))
+            # vias com "out geom" (e as dos .osm.pbf) trazem as coordenadas dos próprios nós
+            for node, point in zip(element["nodes"], element.get("geometry", ())):
+                if point is not None:
+                    self._node_ids.append(node)
+                    self._lat.append(point["lat"])
+                    self._lng.append(point["lon"])
+
+    def add_elements(self, elements):
+        for element in elements:
+            self.add_element(element)
+
+    def _nodes(self):
+        """(ids, lat, lng) dos nós sem repetição, na ordem da primeira aparição."""
+        node_ids, last = _first_and_last(np.frombuffer(self._node_ids, dtype=np.int64))
+        return node_ids, np.frombuffer(self._lat, dtype=np.float64)[last], np.frombuffer(self._lng, dtype=np.float64)[last]
+
+    def _segments(self, node_ids):
+        """
+        Trechos dirigidos entre nós consecutivos das vias: (origem, destino, via, vias), já nos
+        dois sentidos, na ordem das vias e, dentro de cada via, na ordem dos nós (ao contrário
+        nas mãos únicas invertidas, e a volta depois da ida nas mãos duplas). vias são as
+        posições (nos arrays do builder) das vias sem repetição; via indexa vias.
+        """
+        _, ways = _first_and_last(np.frombuffer(self._way_ids, dtype=np.int64))
+        offsets = np.frombuffer(self._way_offsets, dtype=np.int64)
+        starts = offsets[ways]
+        counts = offsets[ways + 1] - starts
+        refs_start = np.zeros(len(ways) + 1, dtype=np.int64)
+        np.cumsum(counts, out=refs_start[1:])
+        gathered = np.repeat(starts - refs_start[:-1], counts) + np.arange(refs_start[-1])
+        refs = np.frombuffer(self._way_nodes, dtype=np.int64)[gathered]
+        way_of = np.repeat(np.arange(len(ways)), counts)
+
+        # nós das vias que não vieram na resposta ficam de fora (a via liga o anterior ao seguinte)
+        order = np.argsort(node_ids, kind='stable')
+        found = np.minimum(np.searchsorted(node_ids, refs, sorter=order), len(node_ids) - 1)
+        present = node_ids[order[found]] == refs if len(node_ids) else np.zeros(len(refs), dtype=bool)
+        positions = order[found[present]]
+        way_of = way_of[present]
+
+        step = np.flatnonzero(way_of[:-1] == way_of[1:])
+        u, v, w = positions[step], positions[step + 1], way_of[step]
+        direction = np.frombuffer(self._direction, dtype=np.int8)[ways][w]
+        reverse = direction == -1
+        both = direction == 0
+        sources = np.concatenate((np.where(reverse, v, u), v[both]))
+        targets = np.concatenate((np.where(reverse, u, v), u[both]))
+        way_ids = np.concatenate((w, w[both]))
+        part = np.concatenate((np.zeros(len(w), dtype=np.int64), np.ones(int(both.sum()), dtype=np.int64)))
+        within = np.concatenate((np.where(reverse, -step, step), step[both]))
+        arranged = np.lexsort((within, part, way_ids))
+        return sources[arranged], targets[arranged], way_ids[arranged], ways
+
+    def build(self, polygon, buffered, profile):
+        """
+        CompiledGraph das ruas dentro de polygon, na mesma sequência do osmnx.graph_from_polygon:
+        recorta pela área com margem, fica com a maior componente, simplifica, recorta pela
+        área exata e fica de novo com a maior componente. Sem polygon (e buffered), não recorta.
+        """
+        node_ids, lat, lng = self._nodes()
+        n = len(node_ids)
+
+        sources, targets, way_ids, ways = self._segments(node_ids)
+        keep = shapely.intersects_xy(buffered, lng, lat) if buffered is not None else np.ones(n, dtype=bool)
+        mask = keep[sources] & keep[targets]
+        sources, targets, way_ids = sources[mask], targets[mask], way_ids[mask]
+        mask = _largest_component(n, sources, targets)
+        sources, targets, way_ids = sources[mask], targets[mask], way_ids[mask]
+        lengths = haversine_array(lat[sources], lng[sources], lat[targets], lng[targets])
+
+        edges = _simplify(n, sources, targets)
+
+        # recorte pela área exata: só os nós que sobraram depois de simplificar contam
+        inside = shapely.intersects_xy(polygon, lng, lat) if polygon is not None else np.ones(n, dtype=bool)
+        edges = [edge for edge in edges if inside[sources[edge[0]]] and inside[targets[edge[-1]]]]
+        edge_sources = np.array([sources[edge[0]] for edge in edges], dtype=np.int64)
+        edge_targets = np.array([targets[edge[-1]] for edge in edges], dtype=np.int64)
+        mask = _largest_component(n, edge_sources, edge_targets)
+        edges = [edge for edge, keep_edge in zip(edges, mask.tolist()) if keep_edge]
+        if not edges:
+            raise ValueError("Nenhuma rua encontrada dentro da área")
+        return self._compile(edges, node_ids, lat, lng, sources, targets, way_ids, ways, lengths, profile)
+
+    def _compile(self, edges, node_ids, lat, lng, sources, targets, way_ids, ways, lengths, profile):
+        way_highway = np.frombuffer(self._highway, dtype=np.int32)[ways].tolist()
+        way_name = np.frombuffer(self._name, dtype=np.int32)[ways].tolist()
+        way_maxspeed = np.frombuffer(self._maxspeed, dtype=np.float64)[ways].tolist()
+        edge_sources = np.array([sources[edge[0]] for edge in edges], dtype=np.int64)
+        edge_targets = np.array([targets[edge[-1]] for edge in edges], dtype=np.int64)
+
+        # nós do grafo final, em ordem de id do OSM; arestas agrupadas pela origem (CSR)
+        used = np.unique(np.concatenate((edge_sources, edge_targets)))
+        position = np.full(len(node_ids), -1, dtype=np.int64)
+        order = np.argsort(node_ids[used], kind='stable')
+        used = used[order]
+        position[used] = np.arange(len(used))
+        edge_order = np.argsort(position[edge_sources], kind='stable')
+
+        # cada texto (tipo de via ou nome de rua) é guardado uma vez só
+        strings = []
+        string_ids = {}
+
+        def intern(value):
+            if not isinstance(value, str):
+                return -1
+            if value not in string_ids:
+                string_ids[value] = len(strings)
+                strings.append(value)
+            return string_ids[value]
+
+        m = len(edges)
+        length = np.empty(m, dtype=np.float64)
+        maxspeed = np.empty(m, dtype=np.float64)
+        highway = np.empty(m, dtype=np.int32)
+        name = np.empty(m, dtype=np.int32)
+        geometry_offsets = np.zeros(m + 1, dtype=np.int64)
+        geometry_nodes = []
+        for e, k in enumerate(edge_order.tolist()):
+            segments = edges[k]
+            length[e] = lengths[segments].sum()
+            w = way_ids[segments[0]]
+            highway[e] = intern(self._text(way_highway[w]) or 'unclassified')
+            maxspeed[e] = way_maxspeed[w]
+            name[e] = intern(self._text(way_name[w]))
+            geometry_nodes.append(sources[segments[0]])
+            geometry_nodes.extend(targets[segments].tolist())
+            geometry_offsets[e + 1] = len(geometry_nodes)
+        geometry_nodes = np.asarray(geometry_nodes, dtype=np.int64)
+
+        offsets = np.zeros(len(used) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(position[edge_sources], minlength=len(used)), out=offsets[1:])
+
+        cgraph = CompiledGraph(
+            node_ids=node_ids[used],
+            x=lng[used],
+            y=lat[used],
+            offsets=offsets,
+            targets=position[edge_targets[edge_order]].astype(np.int32),
+            length=length,
+            speed=np.ones(m),
+            travel_time=np.ones(m),
+            maxspeed=maxspeed,
+            highway=highway,
+            name=name,
+            strings=strings,
+            geometry_offsets=geometry_offsets,
+            geometry_x=lng[geometry_nodes],
+            geometry_y=lat[geometry_nodes],
+        )
+        # velocidades do perfil pela coluna highway, como no set_edge_speed
+        return apply_speed_profile(cgraph, profile)
+
+
+def _simplify(num_nodes, sources, targets):
+    """
+    Junta os trechos que passam por nós que não são cruzamentos, com as regras do
+    osmnx.simplify_graph: um nó é ponta se tem laço, se não tem entrada ou saída, se não
+    tem exatamente dois vizinhos ou se o grau não é 2 (mão única) nem 4 (mão dupla).
+    Retorna a lista das arestas simplificadas, cada uma como a lista dos trechos (posições
+    em sources/targets) que percorre, na ordem.
+
+    Um anel sem nenhuma ponta (uma rotatória solta, sem ruas chegando) não é percorrido a
+    partir de ponta nenhuma; como no osmnx.simplify_graph(remove_rings=False), os trechos
+    dele ficam como estão, uma aresta por trecho.
+    """
+    out_degree = np.bincount(sources, minlength=num_nodes)
+    in_degree = np.bincount(targets, minlength=num_nodes)
+    self_loop = np.zeros(num_nodes, dtype=bool)
+    self_loop[sources[sources == targets]] = True
+    # vizinhos distintos (entrando ou saindo) de cada nó
+    pairs = np.unique(np.concatenate((sources * num_nodes + targets, targets * num_nodes + sources)))
+    neighbours = np.bincount(pairs // num_nodes, minlength=num_nodes)
+    degree = in_degree + out_degree
+    endpoint = (
+        self_loop | (in_degree == 0) | (out_degree == 0) | (neighbours != 2)
+        | ((degree != 2) & (degree != 4))
+    )
+
+    order = np.argsort(sources, kind='stable')
+    out_offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(out_degree, out=out_offsets[1:])
+    out_segments = order.tolist()
+    out_offsets = out_offsets.tolist()
+    sources_list = sources.tolist()
+    targets_list = targets.tolist()
+    endpoint = endpoint.tolist()
+
+    edges = []
+    visited = [False] * len(sources_list)
+    for u in np.flatnonzero(out_degree > 0).tolist():
+        if not endpoint[u]:
+            continue
+        for s in out_segments[out_offsets[u]:out_offsets[u + 1]]:
+            path = [s]
+            node = targets_list[s]
+            previous = u
+            while not endpoint[node]:
+                following = [t for t in out_segments[out_offsets[node]:out_offsets[node + 1]] if targets_list[t] != previous]
+                if not following:
+                    break
+                previous = node
+                path.append(following[0])
+                node = targets_list[following[0]]
+            for s in path:
+                visited[s] = True
+            edges.append(path)
+    edges.extend([s] for s, seen in enumerate(visited) if not seen)
+    return edges
+
+
+def build_compiled_graph(place_name, profile, client, tile_pool, progress=None):
+    """
+    Baixa e monta o CompiledGraph de um lugar. As partes da área são baixadas em paralelo
+    em tile_pool, direto para o cache, e são lidas em fluxo pelo NetworkBuilder na ordem em
+    que chegam.
+    progress, se passado, é uma lista [partes prontas, total] atualizada durante o download.
+    """
+    polygon = client.geocode(place_name)
+    buffered = buffered_polygon(polygon)
+    queries = network_queries(buffered)
+    if progress is not None:
+        progress[:] = [0, len(queries)]
+
+    builder = NetworkBuilder()
+    for future in as_completed([tile_pool.submit(client.overpass_file, query) for query in queries]):
+        builder.add_elements(OverpassStream(future.result()))
+        if progress is not None:
+            progress[0] += 1
+    return builder.build(polygon, buffered, profile)
+
+
+def build_from_file(path, profile, stats=None, node_index=NODE_INDEX, network_type="drive"):
+    """
+    CompiledGraph de um arquivo do OSM (resposta JSON do Overpass ou extrato .osm.pbf), sem
+    recorte por área, lido numa passada só: cada elemento vai para stats (TagStats, todas as
+    vias) e, se a via passar no filtro do osmnx para network_type, para o NetworkBuilder, e é
+    descartado em seguida. Na memória ficam só as ruas do grafo, não o arquivo.
+    """
+    keep = network_way_filter(network_type)
+    builder = NetworkBuilder()
+    for element in iter_osm_elements(path, node_index):
+        if stats is not None:
+            stats.add(element)
+        if element["type"] != "way" or keep(element.get("tags", {})):
+            builder.add_element(element)
+    return builder.build(None, None, profile)
+
+
+class GraphLoader:
+    """
+    Carrega grafos de cidades em segundo plano, sem travar quem pediu.
+
+    submit(lugar) devolve um Future na hora; o grafo sai do graph_store se já estiver em disco,
+    senão é baixado e montado por build_compiled_graph. Pedidos repetidos do mesmo lugar
+    (de qualquer sessão) recebem o mesmo Future. Até max_places cidades carregam ao mesmo
+    tempo, e as partes de todas dividem max_tiles conexões com o Overpass.
+    """
+
+    def __init__(self, profile, folder="./cache/graphs", client=None, max_places=2, max_tiles=4):
+        self.profile = profile
+        self.folder = folder
+        self.client = client or OsmClient()
+        self._places = ThreadPoolExecutor(max_places, thread_name_prefix="graph-loader")
+        self._tiles = ThreadPoolExecutor(max_tiles, thread_name_prefix="overpass")
+        self._futures = {}
+        self._progress = {}
+        self._lock = threading.Lock()
+
+    def _load(self, place_name):
+        progress = self._progress[place_name]
+        return load_or_build(
+            place_name, self.profile["speeds"],
+            lambda: build_compiled_graph(place_name, self.profile, self.client, self._tiles, progress),
+            folder=self.folder,
+        )
+
+    def submit(self, place_name, retry=False):
+        """Future do grafo do lugar. Um carregamento que falhou só é refeito com retry=True."""
+        with self._lock:
+            future = self._futures.get(place_name)
+            if future is None or (retry and future.done() and future.exception() is not None):
+                self._progress[place_name] = [0, 0]
+                future = self._places.submit(self._load, place_name)
+                self._futures[place_name] = future
+            return future
+
+    def load(self, place_name):
+        """Espera o grafo do lugar (levanta a exceção se o carregamento falhou)."""
+        return self.submit(place_name).result()
+
+    def prefetch(self, place_names):
+        """Começa a carregar os lugares (por exemplo, as cidades mais usadas, ao subir o servidor)."""
+        return [self.submit(place_name) for place_name in place_names]
+
+    def status(self, place_name):
+        """'loading', 'ready', 'failed' ou None (lugar nunca pedido)."""
+        future = self._futures.get(place_name)
+        if future is None:
+            return None
+        if not future.done():
+            return 'loading'
+        return 'failed' if future.exception() is not None else 'ready'
+
+    def progress(self, place_name):
+        """(partes da área já baixadas, total de partes); (0, 0) antes de saber quantas são."""
+        done, total = self._progress.get(place_name, (0, 0))
+        return done, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("places", nargs="+", help="nomes dos lugares, como no app")
+    parser.add_argument("--server", help="URL do osm_standin.py (Nominatim em /search e Overpass em /api)")
+    parser.add_argument("--cache-folder", help="pasta do cache de respostas (padrão: a do osmnx, ./cache)")
+    parser.add_argument("--folder", default="./cache/graphs", help="pasta do graph_store")
+    parser.add_argument("--tiles", type=int, default=4, help="partes baixadas ao mesmo tempo")
+    parser.add_argument("--file", help="monta o grafo do primeiro lugar deste arquivo (.osm.pbf ou JSON do Overpass)")
+    parser.add_argument("--node-index", default=NODE_INDEX, help="índice de nós do osmium, para .osm.pbf")
+    args = parser.parse_args()
+
+    if args.file:
+        profile = load_speed_profiles()[DEFAULT_PROFILE]
+        stats = TagStats()
+        start = time.perf_counter()
+        cgraph = load_or_build(
+            args.places[0], profile["speeds"],
+            lambda: build_from_file(args.file, profile, stats, args.node_index), args.folder
+        )
+        if stats.ways:
+            stats.report()
+        print(f"{args.places[0]}: {cgraph.num_nodes} nós, {cgraph.num_edges} arestas ({cgraph.store_path})")
+        print(f"{time.perf_counter() - start:.1f} s")
+        return
+
+    client = OsmClient(cache_folder=args.cache_folder, server=args.server)
+    profile = load_speed_profiles()[DEFAULT_PROFILE]
+    loader = GraphLoader(profile, folder=args.folder, client=client, max_places=len(args.places), max_tiles=args.tiles)
+
+    start = time.perf_counter()
+    futures = dict(zip(args.places, loader.prefetch(args.places)))
+    for place_name, future in futures.items():
+        cgraph = future.result()
+        print(f"{place_name}: {cgraph.num_nodes} nós, {cgraph.num_edges} arestas ({cgraph.store_path})")
+    print(f"{time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from compiled_graph import CompiledGraph
+
+# muda sempre que o formato dos arquivos mudar, para não abrir um grafo salvo no formato antigo
+STORE_VERSION = 3
+
+# colunas salvas, cada uma num arquivo .npy
+NODE_COLUMNS = ('node_ids', 'x', 'y', 'offsets')
+EDGE_COLUMNS = ('targets', 'length', 'speed', 'travel_time', 'maxspeed', 'highway', 'name')
+GEOMETRY_COLUMNS = ('geometry_offsets', 'geometry_x', 'geometry_y')
+COLUMNS = NODE_COLUMNS + EDGE_COLUMNS + GEOMETRY_COLUMNS
+
+# colunas que os grafos salvos antes delas não têm; sem o arquivo, o CompiledGraph as calcula
+OPTIONAL_COLUMNS = ('node_order',)
+
+
+def store_key(place_name, speed_profile):
+    """Chave do grafo salvo: nome do lugar + tabela de velocidades (mudou a tabela, é outro arquivo)."""
+    payload = json.dumps([STORE_VERSION, place_name, speed_profile], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def store_path(place_name, speed_profile, folder="./cache/graphs"):
+    return os.path.join(folder, store_key(place_name, speed_profile))
+
+
+def save_graph_store(cgraph, path, metadata=None):
+    """
+    Salva o CompiledGraph como uma pasta de arquivos .npy (um por coluna) + strings.json.
+    Escreve numa pasta temporária e renomeia no final, então outro processo nunca lê um grafo pela metade.
+    Um grafo que já estava em path vai para path + ".old" e só é apagado depois da troca, então quem
+    abre path nunca encontra uma pasta pela metade (no máximo não encontra nenhuma, por um instante).
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    try:
+        for column in COLUMNS:
+            np.save(os.path.join(tmp, f"{column}.npy"), np.ascontiguousarray(getattr(cgraph, column)))
+        np.save(os.path.join(tmp, "node_order.npy"), np.ascontiguousarray(cgraph.index.order))
+        with open(os.path.join(tmp, "strings.json"), "w", encoding="utf-8") as f:
+            json.dump(cgraph.strings, f, ensure_ascii=False)
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": STORE_VERSION, **(metadata or {})}, f, ensure_ascii=False)
+        old = path + ".old"
+        if os.path.exists(old):
+            shutil.rmtree(old)
+        if os.path.exists(path):
+            os.replace(path, old)
+        os.replace(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def save_npz(path, **arrays):
+    """
+    np.savez num arquivo temporário da mesma pasta, renomeado para path no final: um processo que
+    abrir path (os workers do serviço de rotas, por exemplo) nunca lê um .npz pela metade.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".tmp-", suffix=".npz")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def load_graph_store(path):
+    """
+    Abre o grafo salvo com np.load(mmap_mode='r'): os arrays não são copiados para a memória
+    do processo, o sistema operacional carrega as páginas sob demanda e divide a mesma cópia
+    entre todos os processos que abrirem o mesmo arquivo. O índice de nós (NodeIndex) também
+    vem do disco; só as listas das buscas (CompiledGraph.adjacency) são montadas em cada processo.
+    Retorna None se não existir grafo salvo (ou se for de outra versão do formato).
+    """
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding="utf-8") as f:
+        if json.load(f).get("version") != STORE_VERSION:
+            return None
+
+    columns = {
+        column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode='r')
+        for column in COLUMNS
+    }
+    for column in OPTIONAL_COLUMNS:
+        column_path = os.path.join(path, f"{column}.npy")
+        if os.path.exists(column_path):
+            columns[column] = np.load(column_path, mmap_mode='r')
+    with open(os.path.join(path, "strings.json"), encoding="utf-8") as f:
+        strings = json.load(f)
+
+    cgraph = CompiledGraph(strings=strings, **columns)
+    cgraph.store_path = path
+    return cgraph
+
+
+def load_or_build(place_name, speed_profile, build_graph, folder="./cache/graphs"):
+    """
+    Carrega o grafo compilado do disco; se ainda não existir, chama build_graph()
+    (que deve retornar um CompiledGraph), salva e reabre o arquivo mapeado.
+    """
+    path = store_path(place_name, speed_profile, folder)
+    cgraph = load_graph_store(path)
+    if cgraph is None:
+        save_graph_store(build_graph(), path, metadata={"place_name": place_name})
+        cgraph = load_graph_store(path)
+    return cgraph
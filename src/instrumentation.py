@@ -0,0 +1,247 @@
+"""
+Medição do tempo de cada etapa de uma execução do app e dos contadores das buscas.
+
+Uso:
+    trace = start_trace("main")
+    with span("calculate_route"):
+        with span("search"):
+            ...                       # as buscas chamam record_search(...) no fim
+    finish_trace(trace)
+
+Sem trace ativo, span e record_search não fazem nada (o benchmark e o batch não pagam nada).
+Cada trace terminado vai para o registro do processo (METRICS), que escreve um log JSON
+(uma linha por execução, com rotação por tamanho) e, no máximo a cada PROMETHEUS_INTERVAL
+segundos, um arquivo de texto no formato do Prometheus.
+"""
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# limites (segundos) dos baldes do histograma de cada etapa
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# tamanho do log JSON antes de girar (metrics.jsonl -> metrics.jsonl.1 -> ...) e quantos arquivos velhos guardar
+MAX_LOG_BYTES = 10 * 2**20
+LOG_BACKUPS = 3
+
+# segundos entre duas escritas do arquivo do Prometheus (o scrape do textfile collector não precisa de mais)
+PROMETHEUS_INTERVAL = 15.0
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """
+    Etapas (nome, segundos, profundidade) em ordem de início e contadores das buscas
+    ({motor: {contador: total}}) de uma execução.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.spans = []
+        self.counters = {}
+        self._depth = 0
+
+    @contextmanager
+    def span(self, name):
+        entry = [name, 0.0, self._depth]
+        self.spans.append(entry)
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry[1] = time.perf_counter() - start
+            self._depth -= 1
+
+    def count(self, engine, **counters):
+        totals = self.counters.setdefault(engine, {"searches": 0})
+        totals["searches"] += 1
+        for name, value in counters.items():
+            totals[name] = totals.get(name, 0) + value
+
+    def has_span(self, name):
+        return any(span[0] == name for span in self.spans)
+
+    def to_dict(self):
+        return {
+            "trace": self.name,
+            "time": self.started,
+            "spans": [{"name": name, "ms": seconds * 1000, "depth": depth} for name, seconds, depth in self.spans],
+            "counters": self.counters,
+        }
+
+
+def start_trace(name):
+    """Começa um trace e o deixa ativo nesta thread (cada rerun do Streamlit roda numa thread)."""
+    trace = Trace(name)
+    trace._token = _current.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def use_trace(trace):
+    """Deixa trace ativo só dentro do bloco, sem mandar para o registro (ver routing_service)."""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name):
+    """Mede o bloco como uma etapa do trace ativo (não faz nada sem trace)."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+def record_search(engine, **counters):
+    """
+    Soma os contadores de uma busca (pushes, pops, stale_pops, relaxed_edges...) no trace ativo.
+    As buscas contam em variáveis locais e chamam isto uma vez só, no fim.
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.count(engine, **counters)
+
+
+def merge_counters(counters):
+    """Soma no trace ativo os contadores ({motor: {contador: total}}) de buscas feitas em outro processo."""
+    trace = _current.get()
+    if trace is None:
+        return
+    for engine, values in counters.items():
+        totals = trace.counters.setdefault(engine, {"searches": 0})
+        for name, value in values.items():
+            totals[name] = totals.get(name, 0) + value
+
+
+def finish_trace(trace, registry=None):
+    """Fecha o trace (ele deixa de ser o ativo) e manda para o registro de métricas."""
+    _current.reset(trace._token)
+    (registry or METRICS).observe(trace)
+    return trace
+
+
+class MetricsRegistry:
+    """
+    Totais do processo (todas as sessões): histograma do tempo de cada etapa e soma dos
+    contadores das buscas. A cada trace, acrescenta uma linha em log_path (JSON); passando de
+    max_log_bytes, o log gira e ficam no máximo log_backups arquivos antigos (log_path.1 é o
+    mais novo). prometheus_path é reescrito inteiro no máximo a cada prometheus_interval
+    segundos, por uma thread que só acorda quando algo mudou (o arquivo pode ser lido pelo
+    textfile collector do node_exporter ou por qualquer coisa que entenda o formato de texto
+    do Prometheus); flush() escreve na hora.
+    """
+
+    def __init__(self, log_path="./logs/metrics.jsonl", prometheus_path="./logs/metrics.prom",
+                 max_log_bytes=MAX_LOG_BYTES, log_backups=LOG_BACKUPS, prometheus_interval=PROMETHEUS_INTERVAL):
+        self.log_path = log_path
+        self.prometheus_path = prometheus_path
+        self.max_log_bytes = max_log_bytes
+        self.log_backups = log_backups
+        self.prometheus_interval = prometheus_interval
+        self.stages = {}
+        self.searches = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def observe(self, trace):
+        with self._lock:
+            for name, seconds, _ in trace.spans:
+                stage = self.stages.setdefault(name, {"count": 0, "sum": 0.0, "buckets": [0] * len(BUCKETS)})
+                stage["count"] += 1
+                stage["sum"] += seconds
+                for i, limit in enumerate(BUCKETS):
+                    if seconds <= limit:
+                        stage["buckets"][i] += 1
+            for engine, counters in trace.counters.items():
+                totals = self.searches.setdefault(engine, {})
+                for name, value in counters.items():
+                    totals[name] = totals.get(name, 0) + value
+
+            if self.log_path:
+                self._append_log(json.dumps(trace.to_dict()) + "\n")
+            if self.prometheus_path and self._timer is None:
+                self._timer = threading.Timer(self.prometheus_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Escreve agora o que a thread do intervalo ia escrever (nada, se não houve trace novo)."""
+        with self._lock:
+            if self._timer is None:
+                return
+            self._timer.cancel()
+            self._timer = None
+            self._write_prometheus()
+
+    def _append_log(self, line):
+        os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok=True)
+        data = line.encode("utf-8")
+        try:
+            size = os.path.getsize(self.log_path)
+        except OSError:
+            size = 0
+        if size and size + len(data) > self.max_log_bytes:
+            self._rotate_log()
+        with open(self.log_path, "ab") as f:
+            f.write(data)
+
+    def _rotate_log(self):
+        # como o RotatingFileHandler do logging: log.2 -> log.3, log.1 -> log.2, log -> log.1
+        for i in range(self.log_backups - 1, 0, -1):
+            older = f"{self.log_path}.{i}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.log_path}.{i + 1}")
+        if self.log_backups > 0:
+            os.replace(self.log_path, f"{self.log_path}.1")
+        else:
+            os.remove(self.log_path)
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP rotas_stage_seconds Tempo gasto em cada etapa do app.",
+            "# TYPE rotas_stage_seconds histogram",
+        ]
+        for name, stage in sorted(self.stages.items()):
+            for limit, count in zip(BUCKETS, stage["buckets"]):
+                lines.append(f'rotas_stage_seconds_bucket{{stage="{name}",le="{limit}"}} {count}')
+            lines.append(f'rotas_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {stage["count"]}')
+            lines.append(f'rotas_stage_seconds_sum{{stage="{name}"}} {stage["sum"]}')
+            lines.append(f'rotas_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+        lines += [
+            "# HELP rotas_search_events_total Contadores das buscas de rota (pushes, pops, arestas relaxadas...).",
+            "# TYPE rotas_search_events_total counter",
+        ]
+        for engine, counters in sorted(self.searches.items()):
+            for name, value in sorted(counters.items()):
+                lines.append(f'rotas_search_events_total{{engine="{engine}",event="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def _write_prometheus(self):
+        # escreve num arquivo temporário e troca, para quem lê nunca pegar o arquivo pela metade
+        os.makedirs(os.path.dirname(os.path.abspath(self.prometheus_path)), exist_ok=True)
+        temp_path = self.prometheus_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_path, self.prometheus_path)
+
+
+METRICS = MetricsRegistry()
+# o que ainda não foi escrito pela thread do intervalo vai para o arquivo quando o processo sai
+atexit.register(METRICS.flush)
@@ -0,0 +1,78 @@
+import numpy as np
+import shapely
+from shapely.ops import substring
+
+from compiled_graph import shortest_path_tree
+from overpass import EARTH_RADIUS_M
+
+# cores das isócronas, da menor para a maior
+ISOCHRONE_COLORS = ('#1a9850', '#fee08b', '#d73027', '#762a83', '#2166ac')
+
+
+def isochrones(cgraph, start_node, limits, weight_type='speed', buffer_m=40.0):
+    """
+    Áreas alcançáveis a partir de start_node para cada limite (segundos para 'speed',
+    metros para 'length'), todas tiradas de uma única árvore de Dijkstra.
+
+    Para cada limite pega as arestas alcançadas (inteiras, ou só o pedaço que dá tempo
+    de percorrer), engrossa as ruas em buffer_m metros e junta tudo num polígono.
+    Retorna [(limite, polígono shapely em lng/lat)] em ordem crescente de limite.
+    """
+    limits = sorted(limits)
+    tree = shortest_path_tree(cgraph, start_node, weight_type, cutoff=limits[-1])
+
+    cost = np.full(cgraph.num_nodes, np.inf)
+    cost[tree["index"]] = tree["cost"]
+    sources = np.repeat(np.arange(cgraph.num_nodes), np.diff(cgraph.offsets))
+    weights = np.asarray(cgraph.weights(weight_type))
+
+    # projeção local em metros, para o buffer ter o mesmo tamanho em todas as direções
+    lat0, lng0 = cgraph.centroid()
+    scale_x = np.radians(1.0) * np.cos(np.radians(lat0)) * EARTH_RADIUS_M
+    scale_y = np.radians(1.0) * EARTH_RADIUS_M
+
+    def to_meters(coords):
+        return np.column_stack(((coords[:, 0] - lng0) * scale_x, (coords[:, 1] - lat0) * scale_y))
+
+    def to_degrees(coords):
+        return np.column_stack((coords[:, 0] / scale_x + lng0, coords[:, 1] / scale_y + lat0))
+
+    # desenho de todas as arestas de uma vez (vetorizado), em metros
+    geometry_offsets = np.asarray(cgraph.geometry_offsets)
+    points = to_meters(np.column_stack((cgraph.geometry_x, cgraph.geometry_y)))
+    edge_of_point = np.repeat(np.arange(cgraph.num_edges), np.diff(geometry_offsets))
+    edge_lines = shapely.linestrings(points, indices=edge_of_point)
+    origin = cgraph.index[start_node]
+    origin_point = shapely.Point(to_meters(np.array([[cgraph.x[origin], cgraph.y[origin]]]))[0])
+
+    polygons = []
+    for limit in limits:
+        reached = np.flatnonzero(cost[sources] < limit)
+        # fração de cada aresta que dá para percorrer antes de estourar o limite
+        fraction = np.clip((limit - cost[sources[reached]]) / np.maximum(weights[reached], 1e-9), 0.0, 1.0)
+
+        # arestas inteiras direto do array; só as da borda precisam ser cortadas uma a uma
+        lines = list(edge_lines[reached[fraction >= 1.0]])
+        for e, f in zip(reached[fraction < 1.0].tolist(), fraction[fraction < 1.0].tolist()):
+            lines.append(substring(edge_lines[e], 0.0, f, normalized=True))
+
+        # a origem sempre entra, mesmo que nenhuma rua tenha sido alcançada
+        lines.append(origin_point)
+
+        # quad_segs baixo deixa os cantos menos redondos, mas a união fica bem mais rápida
+        area = shapely.union_all(shapely.buffer(np.array(lines, dtype=object), buffer_m, quad_segs=2))
+        polygons.append((limit, shapely.transform(area, to_degrees)))
+    return polygons
+
+
+def isochrones_geojson(cgraph, start_node, minutes, buffer_m=40.0):
+    """Isócronas de tempo (em minutos) como GeoJSON, pronto para o folium.GeoJson."""
+    polygons = isochrones(cgraph, start_node, [m * 60 for m in minutes], 'speed', buffer_m)
+    return [
+        {
+            "type": "Feature",
+            "properties": {"minutes": limit / 60},
+            "geometry": shapely.geometry.mapping(polygon),
+        }
+        for limit, polygon in polygons
+    ]
@@ -0,0 +1,151 @@
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+CLOSED = float('inf')
+
+
+class TrafficChange(namedtuple("TrafficChange", ["edges", "pairs", "metrics", "times_decreased", "lengths_decreased"])):
+    """
+    O que mudou numa atualização de LiveTraffic.update.
+
+    edges: arestas alteradas; pairs: os mesmos trechos como (u, v) em ids do OSM;
+    metrics: métricas cujos pesos mudaram ('speed' sempre, 'length' quando alguma rua
+    foi interditada ou liberada); times_decreased/lengths_decreased: se algum peso diminuiu.
+    """
+
+    def touches(self, key, value):
+        """Se a rota salva no cache (chave de RouteCache.make_key e valor) passa por alguma aresta alterada."""
+        edges = self.edges
+        for end in (key[1], key[2]):
+            # rotas que começam no meio de uma rua: ("edge", aresta, fração)
+            if isinstance(end, tuple) and end[0] == "edge" and end[1] in edges:
+                return True
+        used = value.get("edges")
+        if used is not None:
+            return any(e in edges for e in used)
+        # rotas salvas só com os nós
+        path = value.get("path") or []
+        pairs = self.pairs
+        return any(pair in pairs for pair in zip(path, path[1:]))
+
+    def keeps(self, key, value):
+        """
+        Se a rota continua valendo depois da mudança. Se só aumentaram pesos, uma rota que não
+        passa pelas arestas alteradas continua ótima e com os mesmos totais. Se algum peso
+        diminuiu, qualquer rota pode ter ficado pior que uma nova, então só sobram as da
+        métrica que não mudou.
+        """
+        if self.touches(key, value):
+            return False
+        metric = key[3] if isinstance(key[3], str) else key[3][0]
+        if metric == 'speed':
+            return not self.times_decreased
+        return not self.lengths_decreased
+
+
+# estado do trânsito para mandar a outro processo: versões ('length', 'speed'), arestas alteradas e multiplicadores
+TrafficSnapshot = namedtuple("TrafficSnapshot", ["versions", "edges", "multipliers"])
+
+
+class LiveTraffic:
+    """
+    Interdições e lentidões ao vivo num grafo carregado, sem recarregar nem copiar o grafo.
+
+    Cada aresta tem um multiplicador do tempo de viagem: 1 = normal, 2 = leva o dobro do tempo,
+    CLOSED = interditada (a distância também vira infinita, para a rota mais curta desviar).
+    apply(cgraph) devolve uma visão do grafo (de qualquer perfil de velocidade da mesma cidade)
+    com os multiplicadores aplicados. Os multiplicadores nunca ficam abaixo de 1, então a
+    maior velocidade do perfil continua valendo como limite para a heurística do A*.
+
+    versions conta as mudanças de cada métrica: o que foi pré-processado para uma métrica
+    (Contraction Hierarchies, por exemplo) só precisa ser refeito quando a versão dela muda.
+    """
+
+    def __init__(self, cgraph):
+        self.multipliers = np.ones(cgraph.num_edges)
+        self.versions = {'length': 0, 'speed': 0}
+        self._node_ids = cgraph.node_ids
+        self._sources = np.repeat(np.arange(cgraph.num_nodes), np.diff(cgraph.offsets))
+        self._targets = cgraph.targets
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def update(self, edges, multiplier):
+        """
+        Aplica o multiplicador (>= 1, ou CLOSED) às arestas. multiplier=1 volta ao normal.
+        Retorna um TrafficChange, ou None se nada mudou.
+        """
+        if not multiplier >= 1:
+            raise ValueError("O multiplicador precisa ser >= 1 (ou CLOSED)")
+        edges = np.unique(np.asarray(edges, dtype=np.int64))
+        with self._lock:
+            old = self.multipliers[edges]
+            edges = edges[old != multiplier]
+            old = old[old != multiplier]
+            if len(edges) == 0:
+                return None
+
+            # troca o array inteiro em vez de alterar no lugar: quem já pegou uma visão continua consistente
+            multipliers = self.multipliers.copy()
+            multipliers[edges] = multiplier
+            self.multipliers = multipliers
+            self._views = {}
+
+            closures_changed = bool(np.any(np.isinf(old) != np.isinf(multiplier)))
+            metrics = ('length', 'speed') if closures_changed else ('speed',)
+            for metric in metrics:
+                self.versions[metric] += 1
+
+        node_ids = self._node_ids
+        return TrafficChange(
+            edges=set(edges.tolist()),
+            pairs={(int(node_ids[u]), int(node_ids[v])) for u, v in zip(self._sources[edges], self._targets[edges])},
+            metrics=metrics,
+            times_decreased=bool(np.any(multiplier < old)),
+            lengths_decreased=bool(np.any(np.isinf(old))) and not np.isinf(multiplier),
+        )
+
+    def snapshot(self):
+        """Estado atual como TrafficSnapshot (só as arestas fora do normal, para ir por pickle)."""
+        with self._lock:
+            multipliers = self.multipliers
+            versions = (self.versions['length'], self.versions['speed'])
+        changed = np.flatnonzero(multipliers != 1)
+        return TrafficSnapshot(versions, changed, multipliers[changed])
+
+    @classmethod
+    def from_snapshot(cls, cgraph, snapshot):
+        """LiveTraffic de cgraph no estado de um snapshot (por exemplo, num processo do RoutingService)."""
+        live = cls(cgraph)
+        live.multipliers[snapshot.edges] = snapshot.multipliers
+        live.versions = {'length': snapshot.versions[0], 'speed': snapshot.versions[1]}
+        return live
+
+    def clear(self):
+        """Volta todas as arestas ao normal."""
+        return self.update(np.flatnonzero(self.multipliers != 1), 1.0)
+
+    def apply(self, cgraph):
+        """Visão de cgraph com o trânsito atual (o próprio cgraph se não houver nenhuma alteração)."""
+        with self._lock:
+            multipliers = self.multipliers
+            views = self._views
+        changed = np.flatnonzero(multipliers != 1)
+        if len(changed) == 0:
+            return cgraph
+
+        cached = views.get(id(cgraph))
+        if cached is not None and cached[0] is cgraph:
+            return cached[1]
+
+        closed = np.isinf(multipliers)
+        # 0 * inf dá nan, então as interditadas são tratadas à parte
+        travel_time = np.where(closed, np.inf, np.asarray(cgraph.travel_time) * np.where(closed, 1.0, multipliers))
+        speed = np.where(closed, 0.0, np.asarray(cgraph.speed) / np.where(closed, 1.0, multipliers))
+        length = np.where(closed, np.inf, cgraph.length) if closed.any() else None
+        view = cgraph.with_speeds(speed, travel_time, length=length, changed_edges=changed)
+        # guarda o grafo junto para o id não ser reaproveitado por outro objeto
+        views[id(cgraph)] = (cgraph, view)
+        return view
@@ -0,0 +1,276 @@
+import heapq
+
+from instrumentation import record_search
+
+METRICS = ('length', 'speed')
+
+
+def _backtrack(cgraph, predecessors, target):
+    """Caminho (ids do OSM) e arestas usadas, a partir da aresta que chegou em cada nó (-1 na origem)."""
+    node_ids = cgraph.node_ids
+    sources = cgraph.edge_sources()
+    path = [int(node_ids[target])]
+    edges = []
+    e = predecessors[target]
+    while e != -1:
+        edges.append(e)
+        node = sources[e]
+        path.append(int(node_ids[node]))
+        e = predecessors[node]
+    path.reverse()
+    edges.reverse()
+    return path, edges
+
+
+def shortest_and_fastest(cgraph, start_node, end_node):
+    """
+    Calcula a rota mais curta e a mais rápida com uma chamada.
+
+    São dois Dijkstras intercalados numa heap só (entradas (custo, métrica, nó)): cada nó
+    é fechado uma vez por métrica e cada fechamento lê a adjacência de novo, então o
+    trabalho é o mesmo de duas chamadas de csr_dijkstra (não é mais rápido). O que se
+    ganha é que cada rótulo carrega também o total da outra métrica, então o resultado
+    já sai com distância e tempo das duas rotas, sem precisar percorrer os caminhos de
+    novo depois. Em caso de empate na métrica principal, fica o caminho com o menor
+    valor na outra.
+
+    Retorna {'length': {...}, 'speed': {...}}, cada um com 'path', 'edges' (posições das
+    arestas usadas, na ordem), 'cost', 'distance' (metros) e 'time' (segundos).
+    Sem caminho: path e edges vazios e totais infinitos.
+    """
+    source = cgraph.index[start_node]
+    target = cgraph.index[end_node]
+    return shared_search(cgraph, [(source, 0.0, 0.0)], {target: (0.0, 0.0)})
+
+
+def shared_search(cgraph, sources, targets):
+    """
+    Núcleo de shortest_and_fastest, aceitando várias origens e destinos com custo inicial/final.
+    É o que permite começar a rota no meio de uma rua (ver spatial_index.route_between_snaps).
+
+    As duas métricas não dividem os fechamentos: a ordem em que os nós ficam definitivos
+    é diferente em cada uma, então um nó sai da heap (e tem as arestas relaxadas) uma vez
+    por métrica, como em duas buscas separadas.
+
+    sources: lista de (índice do nó, distância inicial, tempo inicial)
+    targets: {índice do nó: (distância que falta, tempo que falta)}
+    """
+    offsets, adjacency, lengths = cgraph.adjacency('length')
+    _, _, times = cgraph.adjacency('speed')
+    weights = (lengths, times)
+    inf = float('inf')
+
+    # para cada métrica: custo principal, total da outra métrica no mesmo caminho
+    # e a aresta por onde se chegou ao nó
+    cost = ({}, {})
+    other = ({}, {})
+    predecessors = ({}, {})
+    minHeap = []
+    for node, distance, time in sources:
+        for metric, (primary, secondary) in enumerate(((distance, time), (time, distance))):
+            if primary < cost[metric].get(node, inf):
+                cost[metric][node] = primary
+                other[metric][node] = secondary
+                predecessors[metric][node] = -1
+                minHeap.append((primary, metric, node))
+    heapq.heapify(minHeap)
+
+    # melhor chegada de cada métrica: (custo, outra métrica, nó de destino)
+    best = [(inf, inf, -1), (inf, inf, -1)]
+    done = [False, False]
+    heappop = heapq.heappop
+    heappush = heapq.heappush
+    pops = stale_pops = relaxed_edges = 0
+
+    while minHeap and not (done[0] and done[1]):
+        current_cost, metric, node = heappop(minHeap)
+        pops += 1
+        if done[metric]:
+            stale_pops += 1
+            continue
+        if current_cost >= best[metric][0]:
+            # nenhum caminho ainda aberto pode melhorar a chegada dessa métrica
+            done[metric] = True
+            continue
+
+        metric_cost = cost[metric]
+        metric_other = other[metric]
+        if current_cost > metric_cost[node]:
+            stale_pops += 1
+            continue
+
+        current_other = metric_other[node]
+        remaining = targets.get(node)
+        if remaining is not None:
+            arrival = (current_cost + remaining[metric], current_other + remaining[1 - metric], node)
+            if arrival < best[metric]:
+                best[metric] = arrival
+
+        metric_weights = weights[metric]
+        other_weights = weights[1 - metric]
+        metric_pred = predecessors[metric]
+        first, last = offsets[node], offsets[node + 1]
+        relaxed_edges += last - first
+        for e in range(first, last):
+            neighbour = adjacency[e]
+            new_cost = current_cost + metric_weights[e]
+            new_other = current_other + other_weights[e]
+            old_cost = metric_cost.get(neighbour, inf)
+            # (aresta interditada tem peso infinito e nunca empata com um nó ainda não alcançado)
+            if new_cost < old_cost or (new_cost == old_cost < inf and new_other < metric_other[neighbour]):
+                metric_cost[neighbour] = new_cost
+                metric_other[neighbour] = new_other
+                metric_pred[neighbour] = e
+                heappush(minHeap, (new_cost, metric, neighbour))
+
+    # tudo que entrou na heap ou saiu ou ainda está lá
+    record_search('shared_search', pushes=pops + len(minHeap), pops=pops, stale_pops=stale_pops,
+                  relaxed_edges=relaxed_edges)
+
+    routes = {}
+    for metric, weight_type in enumerate(METRICS):
+        primary, secondary, target = best[metric]
+        if target == -1:
+            routes[weight_type] = {"path": [], "edges": [], "cost": inf, "distance": inf, "time": inf}
+            continue
+        distance, time = (primary, secondary) if weight_type == 'length' else (secondary, primary)
+        path, edges = _backtrack(cgraph, predecessors[metric], target)
+        routes[weight_type] = {
+            "path": path,
+            "edges": edges,
+            "cost": primary,
+            "distance": distance,
+            "time": time,
+        }
+    return routes
+
+
+def _reverse_costs(cgraph, weight_type, target):
+    """Custo exato de cada nó até o destino (Dijkstra completo no grafo invertido)."""
+    offsets, sources, weights = cgraph.reverse_adjacency(weight_type)
+    inf = float('inf')
+    cost = [inf] * cgraph.num_nodes
+    cost[target] = 0.0
+    minHeap = [(0.0, target)]
+    while minHeap:
+        current_cost, node = heapq.heappop(minHeap)
+        if current_cost > cost[node]:
+            continue
+        for e in range(offsets[node], offsets[node + 1]):
+            neighbour = sources[e]
+            new_cost = current_cost + weights[e]
+            if new_cost < cost[neighbour]:
+                cost[neighbour] = new_cost
+                heapq.heappush(minHeap, (new_cost, neighbour))
+    return cost
+
+
+def pareto_routes(cgraph, start_node, end_node, max_labels=200_000):
+    """
+    Conjunto de Pareto (distância x tempo) entre dois nós: todas as rotas em que não dá
+    para diminuir uma métrica sem aumentar a outra. A mais curta e a mais rápida são os
+    dois extremos.
+
+    Busca por rótulos (cada nó guarda os pares (distância, tempo) não dominados), em ordem
+    lexicográfica. Os custos exatos até o destino (uma busca reversa por métrica) servem
+    de limite inferior: um rótulo que já não consegue chegar com distância menor que a da
+    rota mais rápida, ou com tempo menor que o da rota mais curta, é descartado.
+
+    Retorna a lista de rotas (mesmo formato de shortest_and_fastest) ordenada por distância.
+    max_labels limita o trabalho em grafos grandes; se for atingido, a lista pode ficar incompleta.
+    """
+    source = cgraph.index[start_node]
+    target = cgraph.index[end_node]
+    inf = float('inf')
+
+    remaining_length = _reverse_costs(cgraph, 'length', target)
+    remaining_time = _reverse_costs(cgraph, 'speed', target)
+    if remaining_length[source] == inf:
+        return []
+
+    extremes = shortest_and_fastest(cgraph, start_node, end_node)
+    max_distance = extremes['speed']['distance']
+    max_time = extremes['length']['time']
+
+    offsets, targets, lengths = cgraph.adjacency('length')
+    _, _, times = cgraph.adjacency('speed')
+
+    # rótulos: (distância, tempo, nó, rótulo anterior, aresta usada para chegar)
+    labels = [(0.0, 0.0, source, -1, -1)]
+    node_labels = {source: [(0.0, 0.0)]}
+    minHeap = [(0.0, 0.0, 0)]
+    target_labels = []
+    target_ids = []
+    # tolerância para arredondamento de float ao comparar com os extremos
+    eps = 1e-9
+
+    def dominated(front, distance, time):
+        return any(d <= distance and t <= time for d, t in front)
+
+    while minHeap and len(labels) < max_labels:
+        distance, time, label_id = heapq.heappop(minHeap)
+        node = labels[label_id][2]
+
+        # rótulo que já foi dominado por outro depois de entrar na heap
+        if node != source and (distance, time) not in node_labels[node]:
+            continue
+        if dominated(target_labels, distance + remaining_length[node], time + remaining_time[node]):
+            continue
+        if node == target:
+            target_labels.append((distance, time))
+            target_ids.append(label_id)
+            continue
+
+        for e in range(offsets[node], offsets[node + 1]):
+            neighbour = targets[e]
+            new_distance = distance + lengths[e]
+            new_time = time + times[e]
+
+            # só vale a pena se ainda puder ficar entre as duas rotas extremas
+            if new_distance + remaining_length[neighbour] > max_distance * (1 + eps):
+                continue
+            if new_time + remaining_time[neighbour] > max_time * (1 + eps):
+                continue
+
+            front = node_labels.setdefault(neighbour, [])
+            if dominated(front, new_distance, new_time):
+                continue
+            front[:] = [(d, t) for d, t in front if not (new_distance <= d and new_time <= t)]
+            front.append((new_distance, new_time))
+
+            labels.append((new_distance, new_time, neighbour, label_id, e))
+            heapq.heappush(minHeap, (new_distance, new_time, len(labels) - 1))
+
+    # refaz os caminhos a partir dos rótulos que chegaram ao destino
+    routes = []
+    node_ids = cgraph.node_ids
+    for label_id in target_ids:
+        distance, time = labels[label_id][:2]
+        path = []
+        edges = []
+        current = label_id
+        while current != -1:
+            _, _, node, previous, e = labels[current]
+            path.append(int(node_ids[node]))
+            if e != -1:
+                edges.append(e)
+            current = previous
+        path.reverse()
+        edges.reverse()
+        routes.append({"path": path, "edges": edges, "cost": distance, "distance": distance, "time": time})
+
+    routes.sort(key=lambda route: route["distance"])
+    return routes
+
+
+def pareto_front(routes):
+    """
+    Só as rotas não dominadas (mesmo formato de pareto_routes, ordenadas por distância) de uma
+    lista que junta os conjuntos de Pareto de vários pares de nós; cada par (distância, tempo)
+    aparece uma vez.
+    """
+    front = []
+    for route in sorted(routes, key=lambda route: (route["distance"], route["time"])):
+        if not front or route["time"] < front[-1]["time"]:
+            front.append(route)
+    return front
@@ -0,0 +1,97 @@
+"""
+Servidor local que responde como o Nominatim e o Overpass usando as respostas salvas no cache
+do osmnx (./cache), para carregar cidades sem internet (graph_loader.py, testes, demonstrações).
+
+    python osm_standin.py --port 8765 [--delay 0.5]
+
+    Nominatim: http://127.0.0.1:8765/search?...
+    Overpass:  http://127.0.0.1:8765/api/interpreter (GET ou POST)
+
+Cada pedido é convertido de volta na URL que o osmnx teria usado no servidor de verdade e
+a resposta é o arquivo com o sha1 dessa URL, o mesmo nome que o osmnx dá no cache.
+Pedido sem resposta salva recebe 404. --delay segura cada resposta por alguns segundos,
+para simular a latência do Overpass e ver as partes de uma cidade chegando em paralelo.
+"""
+import argparse
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+# de onde vieram as respostas do cache
+NOMINATIM_URL = "https://nominatim.openstreetmap.org"
+OVERPASS_URL = "https://overpass-api.de/api"
+ROUTES = {
+    "/search": NOMINATIM_URL + "/search",
+    "/api/interpreter": OVERPASS_URL + "/interpreter",
+}
+
+
+def cache_file(cache_folder, path, query):
+    """Arquivo do cache com a resposta do pedido (caminho e parâmetros), ou None."""
+    url = ROUTES.get(path)
+    if url is None:
+        return None
+    # mesma URL que o osmnx monta (requests.Request(...).prepare()), com os parâmetros na mesma ordem
+    params = OrderedDict(parse_qsl(query, keep_blank_values=True))
+    key = str(requests.Request("GET", url, params=params).prepare().url)
+    filename = os.path.join(cache_folder, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+    return filename if os.path.exists(filename) else None
+
+
+def make_handler(cache_folder, delay):
+    class Handler(BaseHTTPRequestHandler):
+        def _respond(self, query):
+            parts = urlsplit(self.path)
+            if parts.path == "/api/status":
+                # o osmnx consulta antes de cada pedido para saber quanto esperar
+                self._send(200, b"Connected as: 0\nRate limit: 0\n2 slots available now.\n", "text/plain")
+                return
+            filename = cache_file(cache_folder, parts.path, query)
+            if filename is None:
+                self._send(404, b'{"error": "resposta fora do cache"}', "application/json")
+                return
+            if delay:
+                time.sleep(delay)
+            with open(filename, "rb") as f:
+                self._send(200, f.read(), "application/json")
+
+        def _send(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._respond(urlsplit(self.path).query)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            self._respond(self.rfile.read(length).decode("utf-8"))
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--cache-folder", default="./cache", help="cache do osmnx com as respostas")
+    parser.add_argument("--delay", type=float, default=0.0, help="segundos de espera em cada resposta")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.cache_folder, args.delay))
+    print(f"Servindo {args.cache_folder} em http://{args.host}:{args.port} (Ctrl+C para parar)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
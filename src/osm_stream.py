@@ -0,0 +1,285 @@
+"""
+Leitura em fluxo de dados do OSM: respostas JSON do Overpass e extratos .osm.pbf, um elemento
+por vez, sem carregar o arquivo inteiro. Serve tanto para montar grafos de regiões grandes
+(graph_loader.build_from_file) quanto para contar as tags das vias:
+
+    python osm_stream.py cache/<resposta do overpass>.json
+    python osm_stream.py pernambuco-latest.osm.pbf --node-index dense_file_array,/tmp/nodes.idx
+
+Os .osm.pbf (e os .osm em XML) precisam do pyosmium: pip install -r requirements-osm.txt.
+"""
+import argparse
+import codecs
+import json
+import math
+import os
+import re
+from collections import Counter
+
+from overpass import parse_maxspeed
+
+# bytes lidos de cada vez do arquivo (ou do download)
+CHUNK_SIZE = 1 << 16
+
+# índice de coordenadas dos nós do osmium: 'flex_mem' fica na memória; para extratos de
+# países, 'dense_file_array,<arquivo>' guarda no disco
+NODE_INDEX = "flex_mem"
+
+# arquivos lidos pelo osmium (.osm.pbf e o XML do OSM); o resto é tratado como JSON do Overpass
+OSMIUM_SUFFIXES = (".pbf", ".osm", ".osm.gz", ".osm.bz2")
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+# uma condição do filtro de vias do Overpass: ["chave"], ["chave"~"regex"] ou ["chave"!~"regex"]
+_FILTER_CLAUSE = re.compile(r'\["([^"]+)"(?:(!?~)"([^"]*)")?\]')
+
+
+class _JsonReader:
+    """Texto de um JSON lido aos pedaços, com o mínimo para andar nele sem carregar tudo."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decode = codecs.getincrementaldecoder('utf-8')().decode
+        self._decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+        self.finished = False
+
+    def _fill(self):
+        """Junta mais um pedaço ao que falta ler; False se o arquivo já tinha acabado."""
+        if self.finished:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self.finished = True
+            text = self._decode(b'', final=True)
+        else:
+            text = self._decode(chunk) if isinstance(chunk, bytes) else chunk
+        self.buffer = self.buffer[self.position:] + text
+        self.position = 0
+        return True
+
+    def peek(self):
+        """Próximo caractere que não é espaço, sem consumir ('' no fim do arquivo)."""
+        while True:
+            self.position = _WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._fill():
+                return ''
+
+    def skip(self, char):
+        """Consome char se ele for o próximo caractere. Retorna se consumiu."""
+        if self.peek() == char:
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, char):
+        if not self.skip(char):
+            raise ValueError(f"JSON do Overpass inválido: esperava {char!r}, veio {self.peek()!r}")
+
+    def value(self):
+        """Próximo valor JSON inteiro, lendo mais pedaços enquanto ele estiver cortado."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # um número no fim do pedaço ("0." de "0.6", "12" de "125") pode continuar no próximo
+            if self.finished or (end < len(self.buffer) and self.buffer[end] not in _NUMBER_CHARS):
+                self.position = end
+                return value
+            self._fill()
+
+
+class OverpassStream:
+    """
+    Elementos de uma resposta JSON do Overpass ({"version": ..., "elements": [...]}) lidos aos
+    pedaços: na memória ficam só o pedaço atual e o elemento sendo lido. source é um caminho,
+    um arquivo aberto em modo binário, uma requests.Response (stream=True) ou um iterável de
+    pedaços em bytes.
+
+    As outras chaves do objeto (version, osm3s...) vão para header e o "remark" (erro do
+    Overpass, como tempo esgotado, que vem depois dos elementos) vai para remark.
+    """
+
+    def __init__(self, source, chunk_size=CHUNK_SIZE):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.header = {}
+        self.remark = None
+
+    def _chunks(self):
+        source = self.source
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, 'rb') as f:
+                yield from iter(lambda: f.read(self.chunk_size), b'')
+        elif hasattr(source, 'iter_content'):
+            yield from source.iter_content(self.chunk_size)
+        elif hasattr(source, 'read'):
+            yield from iter(lambda: source.read(self.chunk_size), b'')
+        else:
+            yield from source
+
+    def __iter__(self):
+        reader = _JsonReader(self._chunks())
+        reader.expect('{')
+        if reader.skip('}'):
+            return
+        while True:
+            key = reader.value()
+            reader.expect(':')
+            if key == 'elements':
+                reader.expect('[')
+                if not reader.skip(']'):
+                    while True:
+                        yield reader.value()
+                        if not reader.skip(','):
+                            reader.expect(']')
+                            break
+            elif key == 'remark':
+                self.remark = reader.value()
+            else:
+                self.header[key] = reader.value()
+            if not reader.skip(','):
+                reader.expect('}')
+                return
+
+
+def iter_pbf_elements(path, node_index=NODE_INDEX):
+    """
+    Vias com highway de um extrato .osm.pbf (ou .osm em XML), no mesmo formato dos elementos
+    do Overpass com "out geom": {'type': 'way', 'id', 'nodes', 'tags', 'geometry': [...]}.
+
+    As coordenadas dos nós ficam no índice do osmium (node_index, ver NODE_INDEX) e cada via
+    sai já com as suas, então o arquivo é lido uma vez só e só a via atual vira objeto python.
+    """
+    try:
+        import osmium
+    except ImportError as error:
+        raise ImportError("Ler arquivos .osm.pbf precisa do pyosmium: pip install -r requirements-osm.txt") from error
+
+    processor = osmium.FileProcessor(path).with_locations(node_index).with_filter(osmium.filter.KeyFilter('highway'))
+    for obj in processor:
+        if not obj.is_way():
+            continue
+        nodes = []
+        geometry = []
+        for node in obj.nodes:
+            nodes.append(node.ref)
+            location = node.location
+            geometry.append({"lat": location.lat, "lon": location.lon} if location.valid() else None)
+        yield {
+            "type": "way",
+            "id": obj.id,
+            "nodes": nodes,
+            "tags": {tag.k: tag.v for tag in obj.tags},
+            "geometry": geometry,
+        }
+
+
+def iter_osm_elements(path, node_index=NODE_INDEX):
+    """Elementos de um arquivo do OSM pela extensão: .pbf ou .osm (iter_pbf_elements) ou JSON do Overpass."""
+    if path.endswith(OSMIUM_SUFFIXES):
+        return iter_pbf_elements(path, node_index)
+    return iter(OverpassStream(path))
+
+
+def network_way_filter(network_type="drive"):
+    """
+    Função tags -> bool com o mesmo filtro de vias que o osmnx manda para o Overpass
+    (_overpass._get_network_filter). As respostas do Overpass já vêm filtradas; os extratos
+    .osm.pbf trazem todas as vias (calçadas, trilhas, estacionamentos...).
+    """
+    from osmnx import _overpass
+
+    clauses = [
+        (key, operator, re.compile(pattern) if operator else None)
+        for key, operator, pattern in _FILTER_CLAUSE.findall(_overpass._get_network_filter(network_type))
+    ]
+
+    def keep(tags):
+        for key, operator, regex in clauses:
+            value = tags.get(key)
+            if operator == '!~':
+                if value is not None and regex.search(value):
+                    return False
+            elif value is None or (operator == '~' and not regex.search(value)):
+                return False
+        return True
+
+    return keep
+
+
+class TagStats:
+    """
+    Contadores das vias por tipo (highway), atualizados enquanto os elementos passam: vias,
+    trechos (pares de nós seguidos) e vias sem maxspeed que parse_maxspeed entenda. Nenhuma
+    via fica guardada, só os contadores.
+    """
+
+    def __init__(self):
+        self.nodes = 0
+        self.ways = Counter()
+        self.segments = Counter()
+        self.missing_maxspeed = Counter()
+
+    def add(self, element):
+        if element["type"] == "node":
+            self.nodes += 1
+            return
+        tags = element.get("tags", {})
+        highway = tags.get("highway")
+        if element["type"] != "way" or highway is None:
+            return
+        self.ways[highway] += 1
+        self.segments[highway] += max(len(element.get("nodes", ())) - 1, 0)
+        if math.isnan(parse_maxspeed(tags.get("maxspeed"))):
+            self.missing_maxspeed[highway] += 1
+
+    def rows(self):
+        """Uma linha por tipo de via, do mais comum para o menos."""
+        return [
+            {
+                "highway": highway,
+                "ways": ways,
+                "segments": self.segments[highway],
+                "missing_maxspeed": self.missing_maxspeed[highway],
+            }
+            for highway, ways in self.ways.most_common()
+        ]
+
+    def report(self):
+        """Tabela com as contagens, para o terminal."""
+        print(f"{'tipo de via':<20} {'vias':>10} {'trechos':>12} {'sem maxspeed':>14}")
+        for row in self.rows():
+            print(f"{row['highway']:<20} {row['ways']:>10} {row['segments']:>12} "
+                  f"{row['missing_maxspeed']:>8} ({100 * row['missing_maxspeed'] / row['ways']:3.0f}%)")
+        total = sum(self.ways.values())
+        missing = sum(self.missing_maxspeed.values())
+        print(f"{total} vias, {missing} sem maxspeed ({100 * missing / max(total, 1):.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="resposta do Overpass (.json) ou extrato do OSM (.osm.pbf)")
+    parser.add_argument("--node-index", default=NODE_INDEX, help="índice de nós do osmium, para .osm.pbf")
+    parser.add_argument("--output", help="salva as contagens em JSON")
+    args = parser.parse_args()
+
+    stats = TagStats()
+    for element in iter_osm_elements(args.path, args.node_index):
+        stats.add(element)
+    stats.report()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(stats.rows(), f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
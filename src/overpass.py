@@ -0,0 +1,134 @@
+import math
+import os
+import re
+
+import networkx as nx
+import numpy as np
+
+# mesmo raio usado pelo osmnx para calcular o 'length' das arestas
+EARTH_RADIUS_M = 6_371_009
+
+# tags das vias que o osmnx guarda nas arestas
+USEFUL_WAY_TAGS = (
+    'bridge', 'tunnel', 'oneway', 'lanes', 'ref', 'name', 'highway', 'maxspeed',
+    'service', 'access', 'area', 'landuse', 'width', 'est_width', 'junction',
+)
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Distância em metros entre dois pontos (graus), pelo grande círculo."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    h = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(h)))
+
+
+def haversine_array(lat1, lng1, lat2, lng2):
+    """haversine para arrays numpy (ou um array e um ponto)."""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    h = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(h)))
+
+
+# unidades de maxspeed além de km/h (o padrão do OSM quando não há unidade)
+MAXSPEED_UNITS = {'mph': 1.609344, 'knots': 1.852}
+
+_MAXSPEED = re.compile(r'\s*(\d+(?:\.\d+)?)\s*(mph|knots|km/h|kmh|kph)?\s*')
+
+
+def parse_maxspeed(value):
+    """
+    Velocidade máxima (km/h) de uma tag maxspeed do OSM. '60', '40 mph' e '10 knots' são
+    convertidos; vários valores ('60;80', ou a lista que o osmnx guarda) viram a média, como no
+    osmnx.add_edge_speeds. Sem tag, ou com valor sem número ('BR:urban', 'none', 'walk'), é nan.
+    """
+    if value is None:
+        return math.nan
+    values = value if isinstance(value, list) else str(value).split(';')
+    speeds = []
+    for item in values:
+        match = _MAXSPEED.fullmatch(str(item))
+        if match is None or float(match.group(1)) <= 0:
+            return math.nan
+        speeds.append(float(match.group(1)) * MAXSPEED_UNITS.get(match.group(2), 1.0))
+    return sum(speeds) / len(speeds)
+
+
+def is_oneway(tags):
+    """
+    Mesma regra do osmnx para network_type="drive": retorna 1 (sentido do way),
+    -1 (sentido contrário) ou 0 (mão dupla).
+    """
+    oneway = tags.get('oneway')
+    if oneway in ('-1', 'reverse'):
+        return -1
+    if oneway in ('yes', 'true', '1'):
+        return 1
+    if tags.get('highway') == 'motorway' or tags.get('junction') == 'roundabout':
+        return 1
+    return 0
+
+
+def list_cached_responses(cache_folder="./cache"):
+    """Lista os arquivos do cache do osmnx que são respostas do Overpass (os outros são do Nominatim)."""
+    paths = []
+    for filename in sorted(os.listdir(cache_folder)):
+        if not filename.endswith('.json'):
+            continue
+        path = os.path.join(cache_folder, filename)
+        with open(path, encoding='utf-8') as f:
+            # as respostas do Overpass começam com {"version": ..., o Nominatim retorna uma lista
+            if f.read(1) == '{':
+                paths.append(path)
+    return paths
+
+
+def graph_from_overpass_json(path, simplify=True):
+    """
+    Monta o MultiDiGraph a partir de uma resposta do Overpass salva em disco,
+    sem acessar a internet. Serve para rodar os benchmarks com as cidades do cache.
+    O arquivo é lido em fluxo (osm_stream.OverpassStream), um elemento por vez.
+    """
+    import osmnx as ox
+    from osm_stream import OverpassStream
+
+    graph = nx.MultiDiGraph(crs="epsg:4326")
+
+    nodes = {}
+    ways = []
+    for element in OverpassStream(path):
+        if element['type'] == 'node':
+            nodes[element['id']] = (element['lat'], element['lon'])
+        elif element['type'] == 'way' and 'highway' in element.get('tags', {}):
+            ways.append(element)
+
+    for way in ways:
+        tags = way['tags']
+        way_nodes = [n for n in way['nodes'] if n in nodes]
+        attrs = {tag: tags[tag] for tag in USEFUL_WAY_TAGS if tag in tags}
+        attrs['osmid'] = way['id']
+        direction = is_oneway(tags)
+        attrs['oneway'] = direction != 0
+
+        if direction == -1:
+            way_nodes.reverse()
+
+        for u, v in zip(way_nodes, way_nodes[1:]):
+            for node in (u, v):
+                if node not in graph:
+                    lat, lng = nodes[node]
+                    graph.add_node(node, y=lat, x=lng)
+            length = haversine(*nodes[u], *nodes[v])
+            graph.add_edge(u, v, reversed=False, length=length, **attrs)
+            if direction == 0:
+                graph.add_edge(v, u, reversed=True, length=length, **attrs)
+
+    # igual ao graph_from_place(retain_all=False): fica só a maior componente
+    graph = ox.truncate.largest_component(graph, strongly=False)
+    if simplify:
+        # anéis soltos ficam, como no NetworkBuilder do graph_loader
+        graph = ox.simplify_graph(graph, remove_rings=False)
+    return graph
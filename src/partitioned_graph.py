@@ -0,0 +1,788 @@
+"""
+Grafo particionado em células, para regiões grandes demais para um CompiledGraph inteiro na memória.
+
+Os nós são divididos em células (bisseção recursiva pelas coordenadas) em vários níveis:
+cada célula de um nível é a união de células do nível de baixo. Cada célula do nível 1 é
+salva como um CompiledGraph próprio (graph_store) e só é aberta quando uma consulta passa
+por ela. O que fica sempre na memória é a "sobreposição": as arestas que cruzam células
+(cortes) e, para cada célula de cada nível, a matriz de custos entre os seus nós de fronteira
+(clique), calculada uma vez por métrica (customização).
+
+A consulta é o Dijkstra multinível (MLD/CRP): dentro das células da origem e do destino anda
+pelas ruas; fora delas, pula cada célula pelo clique do nível mais alto que não contém nem a
+origem nem o destino. O custo é exatamente o do Dijkstra no grafo inteiro. Depois, cada pulo
+é desempacotado com uma busca dentro da célula, o que abre só as células por onde a rota passa.
+
+Particionar (save_partitioned_store) precisa do CompiledGraph inteiro uma vez, fora do app
+(pela linha de comando abaixo, por exemplo). Depois disso, a partição salva basta: perfis de
+velocidade e trânsito ao vivo são aplicados célula por célula, sem abrir o grafo inteiro.
+
+Uso (dentro da pasta src):
+    python partitioned_graph.py "Tamandaré, Pernambuco, Brazil" --cell-sizes 64,256 --queries 50
+"""
+import argparse
+import bisect
+import hashlib
+import heapq
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from compiled_graph import CompiledGraph, csr_dijkstra, dijkstra_tree, edge_travel_time, tree_path
+from graph_store import load_graph_store, save_graph_store, save_npz
+from instrumentation import record_search
+from live_traffic import LiveTraffic
+from overpass import EARTH_RADIUS_M
+from speed_profiles import apply_speed_profile, highway_speeds
+
+# muda sempre que o formato da pasta mudar
+PARTITION_VERSION = 3
+
+# máximo de nós por célula em cada nível, do menor para o maior; níveis com uma célula só são descartados
+CELL_SIZES = (256, 4096, 65536)
+
+# células do nível 1 abertas ao mesmo tempo (as menos usadas recentemente saem primeiro)
+MAX_RESIDENT_CELLS = 16
+
+# visões de uma célula aberta (perfil + trânsito ao vivo) guardadas ao mesmo tempo
+MAX_CELL_VIEWS = 4
+
+
+def _bisect_nodes(nodes, px, py):
+    """Divide os nós ao meio na direção em que estão mais espalhados (eixo principal das coordenadas)."""
+    xs = px[nodes] - px[nodes].mean()
+    ys = py[nodes] - py[nodes].mean()
+    _, vectors = np.linalg.eigh(np.cov(np.vstack((xs, ys))))
+    projection = xs * vectors[0, -1] + ys * vectors[1, -1]
+    order = np.argsort(projection, kind='stable')
+    half = len(nodes) // 2
+    return nodes[order[:half]], nodes[order[half:]]
+
+
+def partition_nodes(x, y, cell_sizes=CELL_SIZES):
+    """
+    Partição aninhada dos nós por bisseção recursiva, do nível mais grosso para o mais fino.
+
+    Retorna (order, level_offsets): order[i] é o nó (índice no grafo original) que fica na
+    posição i da nova numeração, e level_offsets[l - 1] são os limites das células do nível l
+    nessa numeração (as células de todos os níveis são faixas contíguas).
+    """
+    lat0 = float(np.mean(y))
+    px = np.radians(np.asarray(x, dtype=np.float64)) * np.cos(np.radians(lat0))
+    py = np.radians(np.asarray(y, dtype=np.float64))
+
+    pieces = [np.arange(len(px))]
+    levels = []
+    for max_size in sorted(cell_sizes, reverse=True):
+        refined = []
+        for piece in pieces:
+            stack = [piece]
+            while stack:
+                nodes = stack.pop()
+                if len(nodes) <= max_size:
+                    refined.append(np.sort(nodes))
+                else:
+                    first, second = _bisect_nodes(nodes, px, py)
+                    stack.append(second)
+                    stack.append(first)
+        pieces = refined
+        levels.append([len(piece) for piece in pieces])
+
+    order = np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.int64)
+    level_offsets = []
+    for sizes in reversed(levels):
+        # nível com uma célula só, ou igual ao de baixo, não ajuda a consulta (o nível 1 sempre fica)
+        if level_offsets and (len(sizes) == 1 or len(sizes) == len(level_offsets[-1]) - 1):
+            break
+        offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        level_offsets.append(offsets)
+    return order.astype(np.int64), level_offsets
+
+
+
+def _cell_graph(cgraph, nodes, edges, local_sources, local_targets):
+    """
+    CompiledGraph de uma célula: os nós (índices no grafo original, na ordem da célula) e as
+    arestas internas (ordenadas pela origem), com a tabela de textos reduzida à da célula.
+    """
+    offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(local_sources, minlength=len(nodes)), out=offsets[1:])
+
+    highway = np.asarray(cgraph.highway)[edges]
+    name = np.asarray(cgraph.name)[edges]
+    codes = np.concatenate((highway, name))
+    used = np.unique(codes[codes >= 0])
+
+    def remap(column):
+        return np.where(column >= 0, np.searchsorted(used, column), -1).astype(np.int32)
+
+    # pontos do desenho de cada aresta, copiados em blocos (como route_geometry.edges_coords)
+    geometry_offsets = np.asarray(cgraph.geometry_offsets)
+    starts = geometry_offsets[edges]
+    counts = geometry_offsets[edges + 1] - starts
+    cell_geometry_offsets = np.zeros(len(edges) + 1, dtype=np.int64)
+    np.cumsum(counts, out=cell_geometry_offsets[1:])
+    points = np.repeat(starts - cell_geometry_offsets[:-1], counts) + np.arange(cell_geometry_offsets[-1])
+
+    return CompiledGraph(
+        node_ids=np.asarray(cgraph.node_ids)[nodes],
+        x=np.asarray(cgraph.x)[nodes],
+        y=np.asarray(cgraph.y)[nodes],
+        offsets=offsets,
+        targets=np.asarray(local_targets, dtype=np.int32),
+        length=np.asarray(cgraph.length)[edges],
+        speed=np.asarray(cgraph.speed)[edges],
+        travel_time=np.asarray(cgraph.travel_time)[edges],
+        maxspeed=np.asarray(cgraph.maxspeed)[edges],
+        highway=remap(highway),
+        name=remap(name),
+        strings=[cgraph.strings[code] for code in used.tolist()],
+        geometry_offsets=cell_geometry_offsets,
+        geometry_x=np.asarray(cgraph.geometry_x)[points],
+        geometry_y=np.asarray(cgraph.geometry_y)[points],
+    )
+
+
+def save_partitioned_store(cgraph, path, cell_sizes=CELL_SIZES, metadata=None):
+    """
+    Particiona o grafo e salva em path: uma pasta por célula do nível 1 (graph_store, mais
+    edge_ids.npy com a posição de cada aresta no grafo original), a sobreposição (overlay.npz,
+    com as colunas das arestas entre células, e strings.json com os tipos de via delas) e
+    edge_cell.npy (célula do nível 1 de cada aresta do grafo original, -1 nos cortes).
+    Como o graph_store, escreve numa pasta temporária e renomeia no final.
+
+    É a única etapa que precisa do grafo inteiro na memória; para regiões grandes, rode uma vez
+    fora do app (python partitioned_graph.py ...) e os processos de rota abrem só a partição.
+    """
+    order, level_offsets = partition_nodes(cgraph.x, cgraph.y, cell_sizes)
+    new_index = np.empty(cgraph.num_nodes, dtype=np.int64)
+    new_index[order] = np.arange(cgraph.num_nodes)
+    sources = new_index[cgraph.edge_sources()]
+    targets = new_index[np.asarray(cgraph.targets)]
+
+    # nível do corte: em quantos níveis a aresta liga células diferentes (0 = aresta interna)
+    cut_level = np.zeros(cgraph.num_edges, dtype=np.int8)
+    for offsets in level_offsets:
+        cut_level += np.searchsorted(offsets, sources, side='right') != np.searchsorted(offsets, targets, side='right')
+    edges = np.argsort(sources, kind='stable')
+    internal = edges[cut_level[edges] == 0]
+    cuts = edges[cut_level[edges] > 0]
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    try:
+        cell_offsets = level_offsets[0]
+        bounds = np.searchsorted(sources[internal], cell_offsets)
+        for k in range(len(cell_offsets) - 1):
+            first = cell_offsets[k]
+            cell_edges = internal[bounds[k]:bounds[k + 1]]
+            cell = _cell_graph(cgraph, order[first:cell_offsets[k + 1]], cell_edges,
+                               sources[cell_edges] - first, targets[cell_edges] - first)
+            cell_path = os.path.join(tmp, "cells", str(k))
+            save_graph_store(cell, cell_path)
+            np.save(os.path.join(cell_path, "edge_ids.npy"), cell_edges)
+
+        # aresta do grafo original -> célula do nível 1, para saber o que o trânsito ao vivo muda
+        edge_cell = np.full(cgraph.num_edges, -1, dtype=np.int32)
+        edge_cell[internal] = np.searchsorted(cell_offsets, sources[internal], side='right') - 1
+        np.save(os.path.join(tmp, "edge_cell.npy"), edge_cell)
+
+        # id do OSM -> posição na partição, por busca binária num array ordenado (mapeado, não fica na memória)
+        node_ids = np.asarray(cgraph.node_ids)[order]
+        lookup = np.argsort(node_ids, kind='stable')
+        np.save(os.path.join(tmp, "lookup_ids.npy"), node_ids[lookup])
+        np.save(os.path.join(tmp, "lookup_index.npy"), lookup)
+
+        # tipo de via dos cortes, numa tabela de textos só deles (para aplicar os perfis de velocidade)
+        cut_highway = np.asarray(cgraph.highway)[cuts]
+        cut_strings = np.unique(cut_highway[cut_highway >= 0])
+        with open(os.path.join(tmp, "strings.json"), "w", encoding="utf-8") as f:
+            json.dump([cgraph.strings[code] for code in cut_strings.tolist()], f, ensure_ascii=False)
+
+        lats = np.asarray(cgraph.y)[order]
+        lngs = np.asarray(cgraph.x)[order]
+        starts = cell_offsets[:-1]
+        np.savez(
+            os.path.join(tmp, "overlay.npz"),
+            cut_source=sources[cuts],
+            cut_target=targets[cuts],
+            cut_target_id=node_ids[targets[cuts]],
+            cut_edge=cuts,
+            cut_level=cut_level[cuts],
+            cut_length=np.asarray(cgraph.length)[cuts],
+            cut_travel_time=np.asarray(cgraph.travel_time)[cuts],
+            cut_highway=np.where(cut_highway >= 0, np.searchsorted(cut_strings, cut_highway), -1).astype(np.int32),
+            cut_maxspeed=np.asarray(cgraph.maxspeed)[cuts],
+            # caixa (sul, oeste, norte, leste) de cada célula do nível 1, para nearest_node
+            cell_boxes=np.column_stack((
+                np.minimum.reduceat(lats, starts), np.minimum.reduceat(lngs, starts),
+                np.maximum.reduceat(lats, starts), np.maximum.reduceat(lngs, starts),
+            )),
+            **{f"offsets_{level}": offsets for level, offsets in enumerate(level_offsets, 1)},
+        )
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "version": PARTITION_VERSION,
+                "levels": len(level_offsets),
+                "cell_sizes": sorted(cell_sizes),
+                "num_nodes": cgraph.num_nodes,
+                "num_edges": cgraph.num_edges,
+                **(metadata or {}),
+            }, f, ensure_ascii=False)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+class PartitionedGraph:
+    """
+    Grafo salvo por save_partitioned_store. Na memória ficam só a sobreposição (cortes e nós
+    de fronteira de cada célula em cada nível); as células do nível 1 são abertas sob demanda
+    (graph_store, mapeado em memória) e no máximo max_cells ficam abertas ao mesmo tempo.
+
+    Os nós são identificados pela posição na numeração da partição, em que as células de
+    todos os níveis são faixas contíguas (a célula de um nó sai de uma busca binária).
+    """
+
+    def __init__(self, path, max_cells=MAX_RESIDENT_CELLS):
+        self.path = path
+        self.max_cells = max_cells
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.levels = self.meta["levels"]
+
+        with np.load(os.path.join(path, "overlay.npz")) as data:
+            overlay = {key: data[key] for key in data.files}
+        # limites das células de cada nível (índice 0 sem uso: o nível 0 são os próprios nós)
+        self.offsets = [None] + [overlay[f"offsets_{level}"].tolist() for level in range(1, self.levels + 1)]
+        self.cell_boxes = overlay["cell_boxes"]
+
+        cut_source = overlay["cut_source"]
+        cut_target = overlay["cut_target"]
+        cut_level = overlay["cut_level"]
+        self.cut_target = cut_target.tolist()
+        self.cut_target_id = overlay["cut_target_id"].tolist()
+        self.cut_level = cut_level.tolist()
+        self.cut_edge = overlay["cut_edge"]
+        self.cut_source = cut_source
+        self.cut_length = overlay["cut_length"]
+        self.cut_travel_time = overlay["cut_travel_time"]
+        self.cut_highway = overlay["cut_highway"]
+        self.cut_maxspeed = overlay["cut_maxspeed"]
+        with open(os.path.join(path, "strings.json"), encoding="utf-8") as f:
+            self.cut_strings = json.load(f)
+        # cortes que saem de cada nó: posições first..last (os cortes estão em ordem de origem)
+        tails, first = np.unique(cut_source, return_index=True)
+        last = np.append(first[1:], len(cut_source))
+        self._cuts_from = dict(zip(tails.tolist(), zip(first.tolist(), last.tolist())))
+
+        # nós de fronteira de cada célula em cada nível: pontas dos cortes de nível >= level
+        self.boundary = [None]
+        self._boundary_position = [None]
+        for level in range(1, self.levels + 1):
+            mask = cut_level >= level
+            nodes = np.unique(np.concatenate((cut_source[mask], cut_target[mask])))
+            offsets = overlay[f"offsets_{level}"]
+            bounds = np.searchsorted(nodes, offsets)
+            cells = np.searchsorted(offsets, nodes, side='right') - 1
+            self.boundary.append([nodes[bounds[c]:bounds[c + 1]].tolist() for c in range(len(offsets) - 1)])
+            self._boundary_position.append(dict(zip(nodes.tolist(), (np.arange(len(nodes)) - bounds[cells]).tolist())))
+
+        self._lookup_ids = np.load(os.path.join(path, "lookup_ids.npy"), mmap_mode='r')
+        self._lookup_index = np.load(os.path.join(path, "lookup_index.npy"), mmap_mode='r')
+        self.edge_cell = np.load(os.path.join(path, "edge_cell.npy"), mmap_mode='r')
+
+        self._cells = OrderedDict()
+        self._lock = threading.Lock()
+        # quantas vezes uma célula foi aberta do disco (reaberturas depois de sair do LRU contam de novo)
+        self.cells_opened = 0
+
+    @property
+    def num_nodes(self):
+        return self.meta["num_nodes"]
+
+    @property
+    def num_cells(self):
+        return len(self.offsets[1]) - 1
+
+    def cell_of(self, level, node):
+        """Célula do nível level que contém o nó."""
+        return bisect.bisect_right(self.offsets[level], node) - 1
+
+    def cell(self, k):
+        """CompiledGraph da célula k do nível 1 (arestas internas), abrindo do disco se preciso."""
+        with self._lock:
+            cell = self._cells.get(k)
+            if cell is not None:
+                self._cells.move_to_end(k)
+                return cell
+        cell_path = os.path.join(self.path, "cells", str(k))
+        cell = load_graph_store(cell_path)
+        # posição de cada aresta da célula no grafo original
+        cell.edge_ids = np.load(os.path.join(cell_path, "edge_ids.npy"), mmap_mode='r')
+        with self._lock:
+            cell = self._cells.setdefault(k, cell)
+            self.cells_opened += 1
+            while len(self._cells) > self.max_cells:
+                self._cells.popitem(last=False)
+        return cell
+
+    def resident_cells(self):
+        """Células do nível 1 abertas agora, da menos para a mais usada recentemente."""
+        with self._lock:
+            return list(self._cells)
+
+    def cut_columns(self, profile=None):
+        """(distância, tempo de viagem) dos cortes com o perfil de velocidade (None = velocidades salvas)."""
+        if profile is None:
+            return np.asarray(self.cut_length), np.asarray(self.cut_travel_time)
+        speed = highway_speeds(self.cut_strings, self.cut_highway, self.cut_maxspeed, profile)
+        return np.asarray(self.cut_length), edge_travel_time(np.asarray(self.cut_length), speed)
+
+    def affected_cells(self, edges):
+        """
+        Células de cada nível cujo clique depende das arestas dadas (posições no grafo original):
+        affected[level] é um conjunto de células. Uma aresta interna afeta a sua célula do nível
+        1; um corte de nível L, as células que o contêm nos níveis acima de L. Toda célula que
+        contém uma célula afetada também é afetada.
+        """
+        edges = np.asarray(edges, dtype=np.int64)
+        affected = [None] + [set() for _ in range(self.levels)]
+        cells = np.asarray(self.edge_cell[edges]) if len(edges) else np.zeros(0, dtype=np.int32)
+        affected[1].update(cells[cells >= 0].tolist())
+        for x in np.flatnonzero(np.isin(self.cut_edge, edges)).tolist():
+            for level in range(self.cut_level[x] + 1, self.levels + 1):
+                affected[level].add(self.cell_of(level, int(self.cut_source[x])))
+        for level in range(1, self.levels):
+            affected[level + 1].update(self.cell_of(level + 1, self.offsets[level][c]) for c in affected[level])
+        return affected
+
+    def node_index(self, osmid):
+        """Posição na partição de um nó (id do OSM)."""
+        i = int(np.searchsorted(self._lookup_ids, osmid))
+        if i == len(self._lookup_ids) or self._lookup_ids[i] != osmid:
+            raise KeyError(osmid)
+        return int(self._lookup_index[i])
+
+    def node_id(self, node):
+        """Id do OSM de um nó (posição na partição); abre a célula do nó."""
+        k = self.cell_of(1, node)
+        return int(self.cell(k).node_ids[node - self.offsets[1][k]])
+
+    def nearest_node(self, lat, lng):
+        """
+        (id do OSM, distância em metros) do nó mais próximo de (lat, lng), sem índice espacial
+        do grafo inteiro: as células são visitadas da caixa mais próxima para a mais distante e
+        a busca para quando a próxima caixa já está mais longe que o melhor nó encontrado.
+        """
+        scale_y = np.radians(1.0) * EARTH_RADIUS_M
+        scale_x = scale_y * np.cos(np.radians(lat))
+        south, west, north, east = self.cell_boxes.T
+        below = np.hypot(
+            np.maximum(0.0, np.maximum(west - lng, lng - east)) * scale_x,
+            np.maximum(0.0, np.maximum(south - lat, lat - north)) * scale_y,
+        )
+        best, best_node = float('inf'), None
+        for k in np.argsort(below, kind='stable').tolist():
+            if below[k] >= best:
+                break
+            cell = self.cell(k)
+            distance = np.hypot((np.asarray(cell.x) - lng) * scale_x, (np.asarray(cell.y) - lat) * scale_y)
+            i = int(np.argmin(distance))
+            if distance[i] < best:
+                best, best_node = float(distance[i]), int(cell.node_ids[i])
+        return best_node, best
+
+
+class MultiLevelOverlay:
+    """
+    Uma métrica ('length' ou 'speed') customizada sobre um PartitionedGraph: pesos dos cortes e,
+    para cada célula de cada nível, a matriz de custos entre os seus nós de fronteira
+    (cliques[level][célula][i, j], inf quando não há caminho por dentro da célula).
+
+    profile: perfil de velocidade (de speed_profiles; None usa as velocidades salvas) e traffic:
+    trânsito ao vivo (TrafficSnapshot, com as posições das arestas no grafo original). Os dois
+    são aplicados célula por célula quando ela é aberta, sem passar pelo grafo inteiro. A
+    partição é a mesma para qualquer peso.
+    """
+
+    def __init__(self, pgraph, weight_type, profile=None, traffic=None, cliques=None):
+        if weight_type not in ('length', 'speed'):
+            raise ValueError(f"weight_type desconhecido: {weight_type!r}")
+        self.pgraph = pgraph
+        self.weight_type = weight_type
+        self.profile = profile
+        self.traffic = traffic if traffic is not None and len(traffic.edges) else None
+        self.key = metric_fingerprint(profile, self.traffic)
+
+        cut_length, cut_time = pgraph.cut_columns(profile)
+        multipliers = _traffic_multipliers(self.traffic, pgraph.cut_edge)
+        closed = np.isinf(multipliers)
+        # 0 * inf dá nan, então as interditadas são tratadas à parte (como em LiveTraffic.apply)
+        self.cut_length = np.where(closed, np.inf, cut_length).tolist()
+        self.cut_time = np.where(closed, np.inf, cut_time * np.where(closed, 1.0, multipliers)).tolist()
+        self.cut_weights = self.cut_length if weight_type == 'length' else self.cut_time
+        self.cliques = cliques if cliques is not None else [None] + [[] for _ in range(pgraph.levels)]
+
+    def cell_view(self, k):
+        """Célula k do nível 1 com o perfil e o trânsito desta métrica (a visão sai da memória junto com a célula)."""
+        cell = self.pgraph.cell(k)
+        if self.key == "store":
+            return cell
+        views = cell.__dict__.setdefault("_metric_views", OrderedDict())
+        view = views.get(self.key)
+        if view is None:
+            view = apply_speed_profile(cell, self.profile) if self.profile is not None else cell
+            multipliers = _traffic_multipliers(self.traffic, cell.edge_ids)
+            if np.any(multipliers != 1):
+                live = LiveTraffic(cell)
+                live.multipliers = multipliers
+                view = live.apply(view)
+            views[self.key] = view
+            while len(views) > MAX_CELL_VIEWS:
+                views.popitem(last=False)
+        return view
+
+    def _edges_from(self, node, level, min_cut_level, max_cut_level):
+        """
+        Arestas que saem de node: as ruas da sua célula (level 0) ou o clique da sua célula no
+        nível level, mais os cortes com nível entre min_cut_level e max_cut_level.
+        Cada uma como (vizinho, peso, passo); o passo diz como desempacotar depois:
+        (-1, corte), (0, célula, aresta da célula) ou (nível, célula, i, j) para um clique.
+        """
+        pgraph = self.pgraph
+        edges = []
+        if level == 0:
+            k = pgraph.cell_of(1, node)
+            base = pgraph.offsets[1][k]
+            offsets, targets, weights = self.cell_view(k).adjacency(self.weight_type)
+            local = node - base
+            for e in range(offsets[local], offsets[local + 1]):
+                edges.append((targets[e] + base, weights[e], (0, k, e)))
+        else:
+            c = pgraph.cell_of(level, node)
+            i = pgraph._boundary_position[level][node]
+            row = self.cliques[level][c][i].tolist()
+            for j, (neighbour, weight) in enumerate(zip(pgraph.boundary[level][c], row)):
+                if j != i and weight != float('inf'):
+                    edges.append((neighbour, weight, (level, c, i, j)))
+
+        first, last = pgraph._cuts_from.get(node, (0, 0))
+        cut_level = pgraph.cut_level
+        for x in range(first, last):
+            if min_cut_level <= cut_level[x] <= max_cut_level:
+                edges.append((pgraph.cut_target[x], self.cut_weights[x], (-1, x)))
+        return edges
+
+    def _search(self, source, targets, edges_from, engine=None):
+        """
+        Dijkstra de source até fechar todos os targets (ou acabar o que alcançar).
+        Retorna (dist, pred), com pred[nó] = (nó anterior, passo).
+        """
+        inf = float('inf')
+        dist = {source: 0.0}
+        pred = {source: None}
+        heap = [(0.0, source)]
+        remaining = set(targets)
+        heappop = heapq.heappop
+        heappush = heapq.heappush
+        pops = stale_pops = relaxed_edges = 0
+
+        while heap:
+            current_cost, node = heappop(heap)
+            pops += 1
+            if current_cost > dist[node]:
+                stale_pops += 1
+                continue
+            remaining.discard(node)
+            if not remaining:
+                break
+            edges = edges_from(node)
+            relaxed_edges += len(edges)
+            for neighbour, weight, step in edges:
+                new_cost = current_cost + weight
+                if new_cost < dist.get(neighbour, inf):
+                    dist[neighbour] = new_cost
+                    pred[neighbour] = (node, step)
+                    heappush(heap, (new_cost, neighbour))
+
+        if engine is not None:
+            record_search(engine, pushes=pops + len(heap), pops=pops, stale_pops=stale_pops,
+                          relaxed_edges=relaxed_edges)
+        return dist, pred
+
+    def _inner_search(self, level, source, targets):
+        """
+        Busca dentro de uma célula do nível level (>= 2), sobre o nível de baixo: cliques das
+        células do nível level - 1 e os cortes entre elas que não saem da célula.
+        """
+        sub = level - 1
+        return self._search(source, targets, lambda node: self._edges_from(node, sub, sub, sub))
+
+    def _cell_steps(self, level, c, source, target):
+        """Passos do nível de baixo do caminho de source a target por dentro da célula c do nível level."""
+        if level == 1:
+            view = self.cell_view(c)
+            base = self.pgraph.offsets[1][c]
+            cost, _, predecessors = dijkstra_tree(view, source - base, self.weight_type, targets={target - base})
+            path = tree_path(view, cost, predecessors, target - base)
+            return [(0, c, e) for e in view.path_edges(path, self.weight_type)]
+        _, pred = self._inner_search(level, source, {target})
+        return _backtrack(pred, target)
+
+    def query(self, start_node, end_node):
+        """
+        Rota entre dois nós (ids do OSM), no formato dos outros motores: {'path', 'edges', 'cost',
+        'distance', 'time'}, com 'edges' nas posições do grafo original e os totais somados nas
+        células e nos cortes, sem precisar do grafo inteiro. Sem caminho: path e edges vazios,
+        custo e totais inf.
+        """
+        pgraph = self.pgraph
+        source = pgraph.node_index(start_node)
+        target = pgraph.node_index(end_node)
+        # células da origem e do destino em cada nível: nelas a busca desce um nível
+        ends = [None] + [
+            (pgraph.cell_of(level, source), pgraph.cell_of(level, target)) for level in range(1, pgraph.levels + 1)
+        ]
+
+        def edges_from(node):
+            for level in range(pgraph.levels, 0, -1):
+                if pgraph.cell_of(level, node) not in ends[level]:
+                    return self._edges_from(node, level, level, pgraph.levels)
+            return self._edges_from(node, 0, 1, pgraph.levels)
+
+        dist, pred = self._search(source, {target}, edges_from, engine='multi_level')
+        inf = float('inf')
+        if target not in dist:
+            return {"path": [], "edges": [], "cost": inf, "distance": inf, "time": inf}
+
+        # desempacota os cliques (de cima para baixo) até sobrarem só ruas e cortes
+        stack = list(reversed(_backtrack(pred, target)))
+        path = [int(start_node)]
+        edges = []
+        distance = time = 0.0
+        while stack:
+            step = stack.pop()
+            if step[0] > 0:
+                level, c, i, j = step
+                boundary = pgraph.boundary[level][c]
+                stack.extend(reversed(self._cell_steps(level, c, boundary[i], boundary[j])))
+            elif step[0] == 0:
+                _, k, e = step
+                cell, view = pgraph.cell(k), self.cell_view(k)
+                edges.append(int(cell.edge_ids[e]))
+                path.append(int(cell.node_ids[cell.targets[e]]))
+                distance += float(view.length[e])
+                time += float(view.travel_time[e])
+            else:
+                x = step[1]
+                edges.append(int(pgraph.cut_edge[x]))
+                path.append(pgraph.cut_target_id[x])
+                distance += self.cut_length[x]
+                time += self.cut_time[x]
+        return {"path": path, "edges": edges, "cost": dist[target], "distance": distance, "time": time}
+
+    def save(self, path):
+        save_npz(path, **{
+            f"clique_{level}": np.concatenate([np.ravel(m) for m in self.cliques[level]] or [np.zeros(0)])
+            for level in range(1, self.pgraph.levels + 1)
+        })
+
+    @classmethod
+    def load(cls, path, pgraph, weight_type, profile=None, traffic=None):
+        cliques = [None]
+        with np.load(path) as data:
+            for level in range(1, pgraph.levels + 1):
+                values = data[f"clique_{level}"]
+                sizes = [len(boundary) for boundary in pgraph.boundary[level]]
+                ends = np.cumsum([size * size for size in sizes])
+                cliques.append([
+                    block.reshape(size, size) for block, size in zip(np.split(values, ends[:-1]), sizes)
+                ])
+        return cls(pgraph, weight_type, profile, traffic, cliques)
+
+
+def _backtrack(pred, target):
+    """Passos do caminho até target, na ordem, a partir do pred de _search."""
+    steps = []
+    node = target
+    while pred[node] is not None:
+        node, step = pred[node]
+        steps.append(step)
+    steps.reverse()
+    return steps
+
+
+def _traffic_multipliers(traffic, edge_ids):
+    """Multiplicadores do trânsito ao vivo (TrafficSnapshot ou None) das arestas edge_ids do grafo original."""
+    multipliers = np.ones(len(edge_ids))
+    if traffic is not None and len(traffic.edges):
+        changed = np.asarray(traffic.edges)
+        edge_ids = np.asarray(edge_ids, dtype=np.int64)
+        i = np.minimum(np.searchsorted(changed, edge_ids), len(changed) - 1)
+        found = changed[i] == edge_ids
+        multipliers[found] = np.asarray(traffic.multipliers)[i[found]]
+    return multipliers
+
+
+def metric_fingerprint(profile, traffic=None):
+    """
+    Hash do perfil e do trânsito ao vivo ("store" = velocidades salvas, sem trânsito); identifica
+    as visões das células e entra no nome do arquivo da customização.
+    """
+    if profile is None and traffic is None:
+        return "store"
+    h = hashlib.sha1(json.dumps(profile, sort_keys=True).encode("utf-8"))
+    if traffic is not None:
+        h.update(np.ascontiguousarray(traffic.edges, dtype=np.int64).tobytes())
+        h.update(np.ascontiguousarray(traffic.multipliers, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+def changed_edges(weight_type, traffic, base_traffic):
+    """
+    Arestas (posições no grafo original) com peso diferente na métrica entre dois estados do
+    trânsito ao vivo (TrafficSnapshot ou None). A distância só muda quando a aresta é
+    interditada ou liberada.
+    """
+    edges = np.union1d(
+        np.asarray(traffic.edges if traffic is not None else [], dtype=np.int64),
+        np.asarray(base_traffic.edges if base_traffic is not None else [], dtype=np.int64),
+    )
+    new = _traffic_multipliers(traffic, edges)
+    old = _traffic_multipliers(base_traffic, edges)
+    if weight_type == 'length':
+        return edges[np.isinf(new) != np.isinf(old)]
+    return edges[new != old]
+
+
+def customize(pgraph, weight_type, profile=None, traffic=None, base=None):
+    """
+    Customização: calcula os cliques de todas as células, do nível 1 para cima (o nível l usa
+    os cliques do nível l - 1). Cada célula do nível 1 é aberta uma vez; trocar os pesos (perfil,
+    trânsito ao vivo) refaz só esta etapa, sem particionar de novo.
+
+    base: customização já pronta da mesma métrica e do mesmo perfil com outro trânsito (sem
+    trânsito, por exemplo). Só os cliques das células com arestas que mudaram de peso, e das
+    células que as contêm nos níveis de cima, são recalculados; os outros vêm de base.
+    """
+    overlay = MultiLevelOverlay(pgraph, weight_type, profile, traffic)
+    affected = None
+    if base is not None:
+        if base.pgraph is not pgraph or base.weight_type != weight_type or base.profile != profile:
+            raise ValueError("base precisa ser da mesma partição, métrica e perfil")
+        affected = pgraph.affected_cells(changed_edges(weight_type, overlay.traffic, base.traffic))
+    inf = float('inf')
+    for level in range(1, pgraph.levels + 1):
+        for c, boundary in enumerate(pgraph.boundary[level]):
+            if affected is not None and c not in affected[level]:
+                # os cliques não são alterados depois de prontos, então podem ser divididos
+                overlay.cliques[level].append(base.cliques[level][c])
+                continue
+            matrix = np.full((len(boundary), len(boundary)), inf)
+            if level == 1:
+                view = overlay.cell_view(c)
+                local = [node - pgraph.offsets[1][c] for node in boundary]
+                for i, source in enumerate(local):
+                    cost, _, _ = dijkstra_tree(view, source, weight_type, targets=local)
+                    matrix[i] = [cost[node] for node in local]
+            else:
+                for i, source in enumerate(boundary):
+                    dist, _ = overlay._inner_search(level, source, boundary)
+                    matrix[i] = [dist.get(node, inf) for node in boundary]
+            overlay.cliques[level].append(matrix)
+    return overlay
+
+
+def load_or_customize(pgraph, weight_type, profile=None):
+    """Carrega a customização de um perfil (sem trânsito) salva junto com a partição ou calcula e salva."""
+    folder = os.path.join(pgraph.path, "overlays")
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{metric_fingerprint(profile)}_{weight_type}.npz")
+    if os.path.exists(path):
+        return MultiLevelOverlay.load(path, pgraph, weight_type, profile)
+    overlay = customize(pgraph, weight_type, profile)
+    overlay.save(path)
+    return overlay
+
+
+def open_partitioned_store(path, cell_sizes=CELL_SIZES, max_cells=MAX_RESIDENT_CELLS):
+    """PartitionedGraph salvo em path, sem precisar do grafo inteiro; None se não existe ou é de outro formato."""
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("version") != PARTITION_VERSION or meta.get("cell_sizes") != sorted(cell_sizes):
+        return None
+    return PartitionedGraph(path, max_cells)
+
+
+def load_or_build(cgraph, path, cell_sizes=CELL_SIZES, max_cells=MAX_RESIDENT_CELLS):
+    """Abre a partição salva em path ou particiona cgraph e salva (outra versão do formato é refeita)."""
+    pgraph = open_partitioned_store(path, cell_sizes, max_cells)
+    if pgraph is None:
+        save_partitioned_store(cgraph, path, cell_sizes)
+        pgraph = PartitionedGraph(path, max_cells)
+    return pgraph
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("place", help="nome do lugar, como no app (o grafo vem do graph_loader)")
+    parser.add_argument("--cell-sizes", default=",".join(map(str, CELL_SIZES)),
+                        help="máximo de nós por célula em cada nível, separados por vírgula")
+    parser.add_argument("--max-cells", type=int, default=MAX_RESIDENT_CELLS, help="células abertas ao mesmo tempo")
+    parser.add_argument("--server", help="URL do osm_standin.py, para baixar sem internet")
+    parser.add_argument("--queries", type=int, default=0,
+                        help="consultas sorteadas, conferidas com o Dijkstra no grafo inteiro")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    from graph_loader import GraphLoader, OsmClient
+    from speed_profiles import DEFAULT_PROFILE, load_speed_profiles
+
+    cgraph = GraphLoader(load_speed_profiles()[DEFAULT_PROFILE], client=OsmClient(server=args.server)).load(args.place)
+    cell_sizes = [int(size) for size in args.cell_sizes.split(",")]
+    start = time.perf_counter()
+    pgraph = load_or_build(cgraph, os.path.join(cgraph.store_path, "partitioned"), cell_sizes, args.max_cells)
+    overlays = {weight_type: load_or_customize(pgraph, weight_type) for weight_type in ('length', 'speed')}
+    print(f"{args.place}: {pgraph.num_nodes} nós em {pgraph.num_cells} células ({time.perf_counter() - start:.1f} s)")
+    for level in range(1, pgraph.levels + 1):
+        sizes = [len(boundary) for boundary in pgraph.boundary[level]]
+        print(f"  nível {level}: {len(sizes)} células, {sum(sizes)} nós de fronteira (máx. {max(sizes)} por célula)")
+    print(f"  {len(pgraph.cut_target)} arestas entre células de {cgraph.num_edges}")
+
+    rng = random.Random(args.seed)
+    nodes = cgraph.node_ids.tolist()
+    differences = 0
+    elapsed = 0.0
+    for _ in range(args.queries):
+        s, t = rng.choice(nodes), rng.choice(nodes)
+        for weight_type, overlay in overlays.items():
+            begin = time.perf_counter()
+            route = overlay.query(s, t)
+            elapsed += time.perf_counter() - begin
+            expected = csr_dijkstra(cgraph, s, t, weight_type)[2]
+            if not (route["cost"] == expected or abs(route["cost"] - expected) <= 1e-6 * max(1.0, expected)):
+                differences += 1
+    if args.queries:
+        print(f"  {2 * args.queries} consultas, {elapsed / (2 * args.queries) * 1000:.2f} ms em média, "
+              f"{differences} com custo diferente do Dijkstra; {pgraph.cells_opened} aberturas de célula, "
+              f"{len(pgraph.resident_cells())} abertas no fim")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Dijkstras de referência sobre o MultiDiGraph do networkx, da primeira versão do app.
+
+O app não usa mais: as rotas saem dos motores sobre os arrays CSR (compiled_graph e os outros).
+Ficam aqui, longe do Streamlit, para o benchmark.py e os testes compararem os motores novos
+com eles.
+"""
+import heapq
+
+from heapdict import heapdict
+
+from instrumentation import record_search
+from speed_profiles import DEFAULT_PROFILE, load_speed_profiles
+
+def dijkstra(graph, start_node, end_node, weight_type):
+    """
+    weight_type='length'
+        Calcula a rota mais curta entre dois nós usando o algoritmo de Dijkstra.
+        O peso da aresta é a distância ('length').
+    weight_type='speed'
+        Calcula a rota mais rápida entre dois nós usando o algoritmo de Dijkstra.
+        O peso da aresta é a velocidade média da via ('speed').
+    """
+    # a comparação com a heapdict está em dijkstra_heapdict (rodar o benchmark.py)
+
+    # para simularmos a heap do jeito que aprendemos, precisamos usar 2 estruturas de dados, uma para o atual custo e outra para saber a ordem minHeap
+    cheapest_path = {node: float('inf') for node in graph.nodes}
+    cheapest_path[start_node] = 0
+    fastest_path_length = 0
+
+    # A gnt pode tentar usar heapdict para a estrutura da minHeap (com a heapq não é possivel apenas atualizar o custo de um nó já existente, ai inserimos o mesmo nó várias vezes com custos diferentes, mas eles são descartados logo quando retirados da heap, então não sei o quanto isso impacta na complexidade)
+    #minHeap = heapdict()
+    minHeap = [(0, start_node)]
+    #minHeap[start_node] = 0
+    heapq.heapify(minHeap)
+
+    predecessors = {node : None for node in graph.nodes}
+
+    # contadores para o record_search (o benchmark usa para os nós fechados)
+    pops = stale_pops = relaxed_edges = 0
+
+    while minHeap:
+        #current_cost, node = minHeap.popitem()
+        current_cost, node = heapq.heappop(minHeap)
+        pops += 1
+
+        # se chegamos no nó final (ou o nó de destino foi removido), podemos parar
+        if node == end_node:
+            break
+
+        # se o custo atual é maior que o custo mais barato conhecido, pulamos para a próxima iteração do while
+        if current_cost > cheapest_path[node]:
+            stale_pops += 1
+            continue
+
+        # iteramos sobre os vizinhos do nó atual
+        for _, neighbour, k, data in graph.edges(node, keys=True, data=True):
+            relaxed_edges += 1
+            if weight_type == 'length':
+                weight = data.get('length', 1)
+            elif weight_type == 'speed':
+                # Calcula o tempo de viagem como distância/velocidade
+                length = data.get('length', 1)  # distância em metros
+                speed = data.get('speed', 20)   # velocidade em km/h
+                # Converte velocidade de km/h para m/s: speed_ms = speed * 1000 / 3600
+                speed_ms = speed * (1000 / 3600)
+                weight = length / speed_ms  # tempo em segundos
+            else:
+                weight = data.get(weight_type, 1)
+                
+            new_cost = cheapest_path[node] + weight
+
+            if new_cost < cheapest_path[neighbour]:
+                cheapest_path[neighbour] = new_cost
+                predecessors[neighbour] = node
+                # atualiza o custo na heap e dale siftup
+                #minHeap[neighbour] = new_cost
+                heapq.heappush(minHeap, (new_cost, neighbour))
+
+    record_search('nx_dijkstra', pushes=pops + len(minHeap), pops=pops, stale_pops=stale_pops,
+                  relaxed_edges=relaxed_edges)
+
+    # "Backtracking" do caminho mais curto
+    path = []
+    node = end_node
+    while node is not None:
+        path.append(node)
+        node = predecessors[node]
+    path.reverse()
+
+    return predecessors, path, cheapest_path[end_node]
+
+def dijkstra_heapdict(graph, start_node, end_node, weight_type):
+    """
+    Mesmo dijkstra de cima, mas com a heapdict: em vez de inserir o nó de novo na heap com o
+    custo menor, atualiza a prioridade dele (decrease-key), então cada nó aparece uma vez só.
+    Serve para o benchmark.py comparar as duas estruturas.
+    """
+    cheapest_path = {node: float('inf') for node in graph.nodes}
+    cheapest_path[start_node] = 0
+    predecessors = {node: None for node in graph.nodes}
+
+    minHeap = heapdict()
+    minHeap[start_node] = 0
+    # com decrease-key não há entradas velhas na heap: todo pop fecha um nó
+    pops = relaxed_edges = 0
+
+    while minHeap:
+        node, current_cost = minHeap.popitem()
+        pops += 1
+
+        if node == end_node:
+            break
+
+        for _, neighbour, k, data in graph.edges(node, keys=True, data=True):
+            relaxed_edges += 1
+            if weight_type == 'length':
+                weight = data.get('length', 1)
+            elif weight_type == 'speed':
+                length = data.get('length', 1)
+                speed = data.get('speed', 20)
+                weight = length / (speed * (1000 / 3600))
+            else:
+                weight = data.get(weight_type, 1)
+
+            new_cost = current_cost + weight
+
+            if new_cost < cheapest_path[neighbour]:
+                cheapest_path[neighbour] = new_cost
+                predecessors[neighbour] = node
+                # atualiza o custo na heap (sobe o nó se ele já estiver lá)
+                minHeap[neighbour] = new_cost
+
+    record_search('nx_dijkstra_heapdict', pushes=pops + len(minHeap), pops=pops, stale_pops=0,
+                  relaxed_edges=relaxed_edges)
+
+    path = []
+    node = end_node
+    while node is not None:
+        path.append(node)
+        node = predecessors[node]
+    path.reverse()
+
+    return predecessors, path, cheapest_path[end_node]
+
+def set_edge_speed(graph, profile=None):
+    """
+    Adiciona um atributo 'speed' às arestas do grafo com base no tipo de via e atribui valores de velocidade.
+    Usa o perfil padrão de speed_profiles.json se nenhum for passado.
+
+    O app não usa mais: os grafos são montados pelo graph_loader e os perfis aplicados direto nos
+    arrays (speed_profiles.apply_speed_profile). Fica para o caminho antigo com networkx do
+    benchmark.py, junto com dijkstra e dijkstra_heapdict.
+    """
+    if profile is None:
+        profile = load_speed_profiles()[DEFAULT_PROFILE]
+    highway_speeds = profile['speeds']
+    default_speed = profile['default']
+
+    # Uma passada só pelas arestas: toda aresta recebe uma velocidade aqui, então não precisa
+    # inicializar antes com nx.set_edge_attributes
+    for u, v, k, data in graph.edges(keys=True, data=True):
+        highway_type = data.get('highway', 'unclassified')
+        if isinstance(highway_type, list):
+            # Se highway for uma lista, pega o primeiro elemento
+            highway_type = highway_type[0]
+        data['speed'] = highway_speeds.get(highway_type, default_speed)
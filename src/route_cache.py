@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def graph_version(cgraph):
+    """Identifica o grafo: a chave do graph_store, ou um hash da topologia se ele não veio do disco."""
+    store_path = getattr(cgraph, "store_path", None)
+    if store_path:
+        return os.path.basename(os.path.normpath(store_path))
+    return _memo_hash(cgraph, "_topology_hash", (cgraph.node_ids, cgraph.offsets, cgraph.targets))
+
+
+def speed_profile_hash(cgraph):
+    """
+    Hash dos tempos de viagem das arestas. Se as velocidades de set_edge_speed mudarem,
+    o hash muda e as rotas antigas deixam de ser encontradas no cache.
+    """
+    return _memo_hash(cgraph, "_speed_hash", (cgraph.travel_time,))
+
+
+def _memo_hash(cgraph, attribute, arrays):
+    # guarda o hash no próprio grafo, junto com os ids dos arrays (se o array for trocado, recalcula)
+    ids = tuple(id(array) for array in arrays)
+    memo = getattr(cgraph, attribute, None)
+    if memo is not None and memo[0] == ids:
+        return memo[1]
+    h = hashlib.sha1()
+    for array in arrays:
+        h.update(np.ascontiguousarray(array).tobytes())
+    digest = h.hexdigest()[:16]
+    setattr(cgraph, attribute, (ids, digest))
+    return digest
+
+
+def _plain(value):
+    # escalares e arrays do numpy (ids de nós, frações de aresta) viram números e listas do python
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"valor que não cabe no cache de rotas: {type(value).__name__}")
+
+
+def _dumps(value):
+    """JSON canônico (chaves ordenadas, sem espaços): a mesma chave gera sempre o mesmo texto."""
+    return json.dumps(value, default=_plain, sort_keys=True, separators=(",", ":"))
+
+
+def _as_tuple(value):
+    # o JSON devolve listas; as chaves são tuplas (ex.: ("edge", aresta, fração))
+    if isinstance(value, list):
+        return tuple(_as_tuple(item) for item in value)
+    return value
+
+
+def _key_hash(key):
+    return hashlib.sha1(_dumps(key).encode("utf-8")).hexdigest()
+
+
+class RouteCache:
+    """
+    Cache das rotas calculadas, com chave (versão do grafo, início, fim, métrica, hash das velocidades).
+
+    Fica em memória com LRU limitado a max_entries. Se disk_path for passado, também usa um
+    SQLite compartilhado entre processos (limitado a disk_max_entries, apagando os menos usados).
+    No disco as rotas e as chaves ficam em JSON (nada de pickle: ler o arquivo nunca executa
+    código), e cada linha é achada pelo sha1 do JSON canônico da chave. Voltando do disco, as
+    listas das rotas continuam listas (as tuplas viram listas) e as chaves voltam a ser tuplas.
+    Pode ser usado por várias sessões ao mesmo tempo (as operações são protegidas por um lock).
+    """
+
+    def __init__(self, max_entries=1024, disk_path=None, disk_max_entries=100_000):
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False, timeout=30)
+            # a tabela antiga "routes" guardava pickle: é apagada sem ser lida
+            self._disk.execute("DROP TABLE IF EXISTS routes")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS route_json ("
+                " hash TEXT PRIMARY KEY, graph TEXT, speed TEXT, key TEXT, value TEXT, last_used REAL)"
+            )
+            self._disk.execute("CREATE INDEX IF NOT EXISTS route_json_last_used ON route_json (last_used)")
+            self._disk.execute("CREATE INDEX IF NOT EXISTS route_json_graph ON route_json (graph, speed)")
+            self._disk.commit()
+
+    @staticmethod
+    def make_key(cgraph, start, end, metric):
+        """start/end podem ser ids de nós ou qualquer outra coisa hashável (ex.: ponto projetado na rua)."""
+        return (graph_version(cgraph), start, end, metric, speed_profile_hash(cgraph))
+
+    def get(self, key):
+        """Rota salva para a chave, ou None."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+            if self._disk is not None:
+                key_hash = _key_hash(key)
+                row = self._disk.execute("SELECT value FROM route_json WHERE hash = ?", (key_hash,)).fetchone()
+                if row is not None:
+                    self._disk.execute("UPDATE route_json SET last_used = ? WHERE hash = ?", (time.time(), key_hash))
+                    self._disk.commit()
+                    value = json.loads(row[0])
+                    self._put_memory(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._put_memory(key, value)
+            if self._disk is not None:
+                self._write_disk(key, _dumps(value), time.time())
+                # apaga as rotas menos usadas quando passar do limite
+                self._disk.execute(
+                    "DELETE FROM route_json WHERE hash IN ("
+                    " SELECT hash FROM route_json ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.disk_max_entries,),
+                )
+                self._disk.commit()
+
+    def _write_disk(self, key, value_text, last_used):
+        self._disk.execute(
+            "INSERT OR REPLACE INTO route_json (hash, graph, speed, key, value, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+            (_key_hash(key), str(key[0]), str(key[4]), _dumps(key), value_text, last_used),
+        )
+
+    def _put_memory(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, graph=None):
+        """Apaga tudo, ou só as rotas de uma versão de grafo (ver graph_version)."""
+        with self._lock:
+            if graph is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == graph]:
+                    del self._entries[key]
+            if self._disk is not None:
+                if graph is None:
+                    self._disk.execute("DELETE FROM route_json")
+                else:
+                    self._disk.execute("DELETE FROM route_json WHERE graph = ?", (str(graph),))
+                self._disk.commit()
+
+    def rekey(self, graph, old_hash, new_hash, keep):
+        """
+        Depois de uma mudança nos pesos (ver live_traffic): as rotas de graph com o hash de
+        velocidades old_hash para as quais keep(chave, rota) é verdadeiro passam para new_hash,
+        as outras são apagadas. Assim só as rotas afetadas pela mudança são recalculadas.
+        """
+        if old_hash == new_hash:
+            return
+
+        def new_key(key):
+            return key[:4] + (new_hash,)
+
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == graph and key[4] == old_hash]:
+                value = self._entries.pop(key)
+                if keep(key, value):
+                    self._entries[new_key(key)] = value
+
+            if self._disk is not None:
+                rows = self._disk.execute(
+                    "SELECT hash, key, value, last_used FROM route_json WHERE graph = ? AND speed = ?",
+                    (str(graph), str(old_hash)),
+                ).fetchall()
+                for key_hash, key_text, value_text, last_used in rows:
+                    key = _as_tuple(json.loads(key_text))
+                    self._disk.execute("DELETE FROM route_json WHERE hash = ?", (key_hash,))
+                    if keep(key, json.loads(value_text)):
+                        self._write_disk(new_key(key), value_text, last_used)
+                self._disk.commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "entries": len(self._entries),
+            }
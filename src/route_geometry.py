@@ -0,0 +1,117 @@
+import math
+
+import numpy as np
+import shapely
+
+from overpass import EARTH_RADIUS_M
+
+# tolerância (metros) do Douglas–Peucker: abaixo disso a diferença some no mapa mesmo com zoom alto
+ROUTE_TOLERANCE_M = 2.0
+
+
+def edges_coords(cgraph, edges):
+    """
+    (lat, lng) de uma sequência de arestas seguindo o desenho das ruas (geometry), como array (k, 2).
+    Os pontos de cada aresta saem direto dos arrays do grafo; o primeiro ponto de cada aresta
+    (igual ao último da anterior) é descartado, menos o da primeira.
+    """
+    edges = np.asarray(edges, dtype=np.int64)
+    geometry_offsets = np.asarray(cgraph.geometry_offsets)
+    starts = geometry_offsets[edges]
+    starts[1:] += 1
+    counts = geometry_offsets[edges + 1] - starts
+    # índices de todos os pontos: cada bloco começa em starts[k] e anda de 1 em 1
+    first_output = np.cumsum(counts) - counts
+    points = np.repeat(starts - first_output, counts) + np.arange(counts.sum())
+    return np.column_stack((np.asarray(cgraph.geometry_y)[points], np.asarray(cgraph.geometry_x)[points]))
+
+
+def simplify_coords(coords, tolerance_m=ROUTE_TOLERANCE_M):
+    """
+    Douglas–Peucker (shapely) numa projeção local em metros, para a tolerância valer igual
+    em todas as direções. Primeiro e último pontos são sempre mantidos.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if len(coords) < 3:
+        return coords
+    lat0, lng0 = coords[:, 0].mean(), coords[:, 1].mean()
+    scale_y = np.radians(1.0) * EARTH_RADIUS_M
+    scale_x = scale_y * np.cos(np.radians(lat0))
+    meters = np.column_stack(((coords[:, 1] - lng0) * scale_x, (coords[:, 0] - lat0) * scale_y))
+    simplified = shapely.get_coordinates(shapely.simplify(shapely.linestrings(meters), tolerance_m))
+    return np.column_stack((simplified[:, 1] / scale_y + lat0, simplified[:, 0] / scale_x + lng0))
+
+
+def encode_polyline(coords, precision=5):
+    """
+    Codifica [(lat, lng), ...] no formato de polyline do Google (o que o Leaflet.encoded lê):
+    diferenças entre pontos consecutivos, arredondadas, em blocos de 5 bits como texto.
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    values = np.round(coords * 10 ** precision).astype(np.int64)
+    deltas = np.diff(values, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    # sinal no bit mais baixo (zig-zag), como no algoritmo original
+    deltas = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+
+    chars = []
+    for value in deltas.tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return "".join(chars)
+
+
+def route_geometry(cgraph, route, weight_type, tolerance_m=ROUTE_TOLERANCE_M):
+    """
+    Linha simplificada de uma rota (no formato de shortest_and_fastest) como array (k, 2) de (lat, lng).
+    Rotas que começam ou terminam no meio da rua ('coords') ganham os pontos projetados nas pontas.
+    Rotas sem 'edges' (motores que só devolvem os nós) usam CompiledGraph.path_edges.
+    """
+    path = route["path"]
+    edges = route.get("edges")
+    if edges is None:
+        edges = cgraph.path_edges(path, weight_type)
+    elif "edge_share" in route:
+        # as ruas dos pontos projetados são percorridas só em parte: a linha vai reta do ponto até o nó
+        if len(edges) == 1:
+            # os dois pontos na mesma rua: direto de um ao outro, sem passar pelas pontas da rua
+            path = []
+        edges = edges[1:-1]
+
+    if len(edges):
+        coords = edges_coords(cgraph, edges)
+    else:
+        coords = np.array(cgraph.coords(path), dtype=np.float64).reshape(-1, 2)
+    ends = route.get("coords")
+    if ends:
+        coords = np.vstack(([ends[0]], coords, [ends[-1]]))
+    return simplify_coords(coords, tolerance_m)
+
+
+def bounds(*lines):
+    """[[sul, oeste], [norte, leste]] de um conjunto de linhas (lat, lng), no formato do fit_bounds."""
+    points = np.vstack(lines)
+    south, west = points.min(axis=0).tolist()
+    north, east = points.max(axis=0).tolist()
+    return [[south, west], [north, east]]
+
+
+def view_for_bounds(box, width_px=800, height_px=500, padding=0.1, max_zoom=18):
+    """
+    (centro, zoom) para mostrar box inteiro num mapa de width_px x height_px, a mesma conta do
+    fit_bounds do Leaflet (Web Mercator, zoom inteiro), para passar como center/zoom ao st_folium.
+    """
+    (south, west), (north, east) = box
+
+    def mercator_y(lat):
+        return math.log(math.tan(math.pi / 4 + math.radians(lat) / 2))
+
+    usable = 1 - 2 * padding
+    zooms = [max_zoom]
+    if east > west:
+        zooms.append(math.log2(width_px * usable * 360 / (256 * (east - west))))
+    if north > south:
+        zooms.append(math.log2(height_px * usable * 2 * math.pi / (256 * (mercator_y(north) - mercator_y(south)))))
+    center = [(south + north) / 2, (west + east) / 2]
+    return center, max(int(math.floor(min(zooms))), 0)
@@ -0,0 +1,62 @@
+import numpy as np
+
+
+def route_summary(cgraph, edges, edge_share=(1.0, 1.0)):
+    """
+    Resumo de uma rota a partir das arestas usadas pela busca, numa passada vetorizada sobre
+    as colunas do grafo (length, travel_time, name, highway), sem olhar aresta por aresta:
+
+    'distance' e 'time': totais da rota;
+    'streets': trechos seguidos na mesma rua, [{'name', 'distance', 'time'}] na ordem da rota
+               (name None para ruas sem nome);
+    'highways': distância e tempo por tipo de via, [{'highway', 'distance', 'time'}], do maior
+                trecho para o menor.
+
+    edge_share: fração percorrida da primeira e da última aresta (rotas que começam ou terminam
+    no meio da rua, ver spatial_index.route_between_snaps).
+    """
+    edges = np.asarray(edges, dtype=np.int64)
+    if len(edges) == 0:
+        return {"distance": 0.0, "time": 0.0, "streets": [], "highways": []}
+
+    share = np.ones(len(edges))
+    share[0] *= edge_share[0]
+    share[-1] *= edge_share[1]
+    lengths = np.asarray(cgraph.length)[edges] * share
+    times = np.asarray(cgraph.travel_time)[edges] * share
+    strings = cgraph.strings
+
+    def text(code):
+        return strings[code] if code >= 0 else None
+
+    # trechos: começa um novo sempre que o código do nome muda de uma aresta para a outra
+    names = np.asarray(cgraph.name)[edges]
+    starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]])
+    streets = [
+        {"name": text(code), "distance": distance, "time": time}
+        for code, distance, time in zip(
+            names[starts].tolist(),
+            np.add.reduceat(lengths, starts).tolist(),
+            np.add.reduceat(times, starts).tolist(),
+        )
+    ]
+
+    codes, groups = np.unique(np.asarray(cgraph.highway)[edges], return_inverse=True)
+    highway_lengths = np.bincount(groups, weights=lengths)
+    highway_times = np.bincount(groups, weights=times)
+    highways = [
+        {"highway": text(int(codes[i])), "distance": float(highway_lengths[i]), "time": float(highway_times[i])}
+        for i in np.argsort(-highway_lengths, kind='stable').tolist()
+    ]
+
+    return {
+        "distance": float(lengths.sum()),
+        "time": float(times.sum()),
+        "streets": streets,
+        "highways": highways,
+    }
+
+
+def street_names(summary, unnamed='Sem nome'):
+    """Nomes das ruas da rota, em ordem e sem repetir ruas seguidas."""
+    return [street["name"] or unnamed for street in summary["streets"]]
@@ -0,0 +1,520 @@
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import numpy as np
+
+from alternative_routes import alternative_routes, alternatives, merge_alternatives
+from bidirectional_astar import bidirectional_astar
+from compiled_graph import csr_dijkstra
+from contraction_hierarchies import build_contraction_hierarchy, load_or_build as load_or_build_hierarchy
+from graph_store import load_graph_store
+from instrumentation import Trace, merge_counters, use_trace
+from isochrones import isochrones_geojson
+from live_traffic import LiveTraffic, TrafficSnapshot
+from multi_criteria import pareto_front, pareto_routes, shortest_and_fastest
+from partitioned_graph import customize as customize_overlay, load_or_build as load_or_build_partitioned, load_or_customize, open_partitioned_store
+from route_summary import route_summary
+from spatial_index import EdgeSnap, SpatialIndex, route_between_snaps, routes_between_snaps
+from speed_profiles import load_speed_profiles, profile_graph, profile_max_speed
+from time_dependent import TimeDependentWeights, td_path_totals, td_route
+
+# pedidos por processo que podem esperar na fila antes de o serviço recusar novos
+QUEUE_PER_WORKER = 4
+
+# segundos que um pedido espera por um lugar na fila antes de receber ServiceBusy
+QUEUE_TIMEOUT = 2.0
+
+# segundos que um pedido pode esperar na fila do pool antes de desistir com RouteTimeout
+REQUEST_TIMEOUT = 30.0
+
+# objetos montados por cidade em cada processo (perfis, trânsito, hierarquias...), os menos usados saem
+MAX_CONTEXT_ENTRIES = 32
+
+# pedido de rota de uma sessão: cidade (pasta do graph_store), perfil de velocidade, trânsito ao vivo
+# (LiveTraffic.snapshot), motor, pontas (ids do OSM, ou EdgeSnap para sair do meio da rua) e
+# horário de saída em segundos desde a meia-noite (None = sem horário)
+RouteRequest = namedtuple("RouteRequest", ["store_path", "profile", "traffic", "engine", "start", "end", "departure"])
+
+# trânsito de uma cidade sem nenhuma alteração ao vivo (o que prepare_job monta)
+NO_TRAFFIC = TrafficSnapshot((0, 0), np.zeros(0, dtype=np.int64), np.zeros(0))
+
+
+class ServiceBusy(Exception):
+    """A fila do serviço de rotas está cheia; o pedido deve ser repetido mais tarde."""
+
+
+class RouteTimeout(ServiceBusy):
+    """
+    O pedido passou request_timeout segundos na fila sem começar a rodar e saiu dela. Um pedido
+    que já estava rodando não expira: o processo do pool não pode ser interrompido e continuaria
+    ocupando o lugar na fila, então run espera o resultado dele.
+    """
+
+
+class CityContext:
+    """
+    Grafo de uma cidade e o que as buscas montam em cima dele (perfis, trânsito ao vivo,
+    Contraction Hierarchies, células, pesos por horário, índice espacial), um por cidade em
+    cada processo. O grafo é aberto do graph_store mapeado em memória, então todos os
+    processos do pool dividem as mesmas páginas.
+
+    O grafo só é aberto quando algum motor precisa dele: com uma partição já salva
+    (store_path/partitioned), as buscas do motor multinível abrem só as células que visitam.
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.profiles = load_speed_profiles()
+        self._graph = None
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        # hierarquias refeitas em segundo plano: última versão pedida por (perfil, métrica) e as agendadas
+        self._rebuilds = None
+        self._latest_hierarchy = {}
+        self._scheduled = set()
+
+    @property
+    def graph(self):
+        """Grafo inteiro da cidade (graph_store), aberto no primeiro uso."""
+        if self._graph is None:
+            graph = load_graph_store(self.store_path)
+            if graph is None:
+                raise FileNotFoundError(f"Nenhum grafo salvo em {self.store_path}")
+            with self._lock:
+                if self._graph is None:
+                    self._graph = graph
+        return self._graph
+
+    def _memoized(self, key, build):
+        with self._lock:
+            value = self._memo.get(key)
+            if value is not None:
+                self._memo.move_to_end(key)
+                return value
+        # monta fora do lock: uma hierarquia lenta não trava as buscas que já têm o que precisam
+        value = build()
+        with self._lock:
+            value = self._memo.setdefault(key, value)
+            while len(self._memo) > MAX_CONTEXT_ENTRIES:
+                self._memo.popitem(last=False)
+        return value
+
+    def live_traffic(self, traffic):
+        return self._memoized(("traffic", traffic.versions), lambda: LiveTraffic.from_snapshot(self.graph, traffic))
+
+    def routing_graph(self, profile_name, traffic):
+        """Grafo com o perfil de velocidade e o trânsito ao vivo do pedido (visões, sem copiar o grafo)."""
+        return self._memoized(
+            ("graph", profile_name, traffic.versions),
+            lambda: self.live_traffic(traffic).apply(profile_graph(self.graph, profile_name, self.profiles)),
+        )
+
+    def contraction_hierarchy(self, profile_name, weight_type, traffic):
+        """
+        Hierarquia de uma métrica para um perfil. Só a versão da métrica no trânsito ao vivo entra
+        na chave: uma lentidão refaz só a hierarquia de 'speed'.
+
+        Com trânsito ao vivo, a hierarquia é refeita numa thread de fundo e, até ficar pronta,
+        retorna None (find_route usa o A* bidirecional, que dá o mesmo custo). Uma versão que já
+        foi superada por outra mais nova antes de começar não é montada.
+        """
+        version = traffic.versions[0 if weight_type == 'length' else 1]
+        key = ("ch", profile_name, weight_type, version)
+        if not version:
+            return self._memoized(key, lambda: load_or_build_hierarchy(
+                self.routing_graph(profile_name, traffic), weight_type, folder=os.path.join(self.store_path, "ch")
+            ))
+
+        with self._lock:
+            hierarchy = self._memo.get(key)
+            if hierarchy is not None:
+                self._memo.move_to_end(key)
+                return hierarchy
+            metric = (profile_name, weight_type)
+            self._latest_hierarchy[metric] = max(version, self._latest_hierarchy.get(metric, 0))
+            if key not in self._scheduled:
+                self._scheduled.add(key)
+                if self._rebuilds is None:
+                    self._rebuilds = ThreadPoolExecutor(1, thread_name_prefix="ch-rebuild")
+                self._rebuilds.submit(self._rebuild_hierarchy, key, traffic)
+        return None
+
+    def _rebuild_hierarchy(self, key, traffic):
+        _, profile_name, weight_type, version = key
+        try:
+            with self._lock:
+                superseded = self._latest_hierarchy[(profile_name, weight_type)] > version
+            if not superseded:
+                graph = self.routing_graph(profile_name, traffic)
+                # pesos do trânsito ao vivo duram pouco, não vale a pena salvar no disco
+                self._memoized(key, lambda: build_contraction_hierarchy(graph, weight_type))
+        finally:
+            with self._lock:
+                self._scheduled.discard(key)
+
+    def partitioned(self):
+        """
+        Partição da cidade (partitioned_graph). Se ainda não foi salva, é feita uma vez a partir
+        do grafo inteiro; depois abre sem ele.
+        """
+        def build():
+            path = os.path.join(self.store_path, "partitioned")
+            return open_partitioned_store(path) or load_or_build_partitioned(self.graph, path)
+
+        return self._memoized(("partitioned",), build)
+
+    def multi_level_overlay(self, profile_name, weight_type, traffic):
+        """
+        Custos entre as fronteiras das células (partitioned_graph) para uma métrica e um perfil.
+        O perfil e o trânsito ao vivo são aplicados célula por célula, sem abrir o grafo inteiro.
+        As duas versões do trânsito entram na chave porque a rota também traz os totais da outra métrica.
+
+        Com trânsito ao vivo, a customização parte da do perfil sem trânsito e só recalcula as
+        células com arestas alteradas (e as que as contêm nos níveis de cima).
+        """
+        def base():
+            return load_or_customize(self.partitioned(), weight_type, self.profiles[profile_name])
+
+        def build():
+            return customize_overlay(
+                self.partitioned(), weight_type, self.profiles[profile_name], traffic,
+                base=self._memoized(("overlay", profile_name, weight_type, (0, 0)), base),
+            )
+
+        if not any(traffic.versions):
+            return self._memoized(("overlay", profile_name, weight_type, (0, 0)), base)
+        return self._memoized(("overlay", profile_name, weight_type, traffic.versions), build)
+
+    def time_dependent_weights(self, profile_name, traffic):
+        """Tempos de viagem por hora do dia do perfil (time_factors), sobre o trânsito ao vivo."""
+        return self._memoized(
+            ("td", profile_name, traffic.versions[1]),
+            lambda: TimeDependentWeights(self.routing_graph(profile_name, traffic), self.profiles[profile_name]),
+        )
+
+    def max_speed(self, profile_name):
+        """Maior velocidade (km/h) do perfil neste grafo, para a heurística do A*."""
+        return self._memoized(
+            ("max_speed", profile_name),
+            lambda: profile_max_speed(self.profiles[profile_name], self.graph)
+        )
+
+    def spatial_index(self):
+        return self._memoized(("spatial_index",), lambda: SpatialIndex(self.graph))
+
+
+_contexts = {}
+_contexts_lock = threading.Lock()
+
+
+def city_context(store_path):
+    """CityContext da cidade neste processo, aberto no primeiro pedido."""
+    with _contexts_lock:
+        context = _contexts.get(store_path)
+        if context is None:
+            context = _contexts[store_path] = CityContext(store_path)
+        return context
+
+
+def find_route(context, request, weight_type):
+    """Rota de uma métrica com o motor do pedido. Retorna (predecessors, path, cost)."""
+    if request.engine == "Contraction Hierarchies":
+        hierarchy = context.contraction_hierarchy(request.profile, weight_type, request.traffic)
+        if hierarchy is not None:
+            path, cost = hierarchy.query(request.start, request.end)
+            return None, path, cost
+        # hierarquia sendo refeita com o trânsito novo: o A* bidirecional responde enquanto isso
+    if request.engine == "Multinível (células)":
+        overlay = context.multi_level_overlay(request.profile, weight_type, request.traffic)
+        route = overlay.query(request.start, request.end)
+        return None, route["path"], route["cost"]
+    graph = context.routing_graph(request.profile, request.traffic)
+    if request.engine in ("A* bidirecional", "Contraction Hierarchies"):
+        path, cost, _ = bidirectional_astar(
+            graph, request.start, request.end, weight_type,
+            max_speed=context.max_speed(request.profile)
+        )
+        return None, path, cost
+    return csr_dijkstra(graph, request.start, request.end, weight_type)
+
+
+def engine_route(context, request, weight_type):
+    """
+    Rota de uma métrica com o motor do pedido, com 'path', 'edges', 'cost', 'distance' e 'time'
+    (None nos totais quando não há caminho). O motor multinível já devolve as arestas e os
+    totais, sem abrir o grafo inteiro; os outros só devolvem os nós e o resto sai do caminho.
+    """
+    if request.engine == "Multinível (células)":
+        overlay = context.multi_level_overlay(request.profile, weight_type, request.traffic)
+        route = overlay.query(request.start, request.end)
+        if not route["path"]:
+            route["distance"] = route["time"] = None
+        return route
+    _, path, cost = find_route(context, request, weight_type)
+    route = {"path": path, "edges": [], "cost": cost, "distance": None, "time": None}
+    if path:
+        graph = context.routing_graph(request.profile, request.traffic)
+        route["edges"] = graph.path_edges(path, weight_type)
+        summary = route_summary(graph, route["edges"])
+        route["distance"], route["time"] = summary["distance"], summary["time"]
+    return route
+
+
+def pairwise_search(context, request, sources, targets):
+    """
+    Busca com a interface de multi_criteria.shared_search (várias origens e destinos com custo
+    inicial e final) para os motores que só ligam um nó a outro: roda o motor do pedido para
+    cada par (no máximo 2 x 2, as pontas das ruas dos pontos) e fica com o melhor de cada métrica.
+    """
+    node_ids = context.graph.node_ids
+    inf = float('inf')
+    routes = {}
+    for metric, weight_type in enumerate(('length', 'speed')):
+        best = (inf, None, None, None)
+        for source, distance, time in sources:
+            for target, (remaining_distance, remaining_time) in targets.items():
+                pair = request._replace(start=int(node_ids[source]), end=int(node_ids[target]))
+                route = engine_route(context, pair, weight_type)
+                start_cost, end_cost = ((distance, remaining_distance), (time, remaining_time))[metric]
+                if route["path"] and start_cost + route["cost"] + end_cost < best[0]:
+                    best = (start_cost + route["cost"] + end_cost, route, (distance, time), (remaining_distance, remaining_time))
+        total, route, start, end = best
+        if route is None:
+            routes[weight_type] = {"path": [], "edges": [], "cost": inf, "distance": inf, "time": inf}
+            continue
+        routes[weight_type] = {
+            "path": route["path"],
+            "edges": route["edges"],
+            "cost": total,
+            "distance": start[0] + route["distance"] + end[0],
+            "time": start[1] + route["time"] + end[1],
+        }
+    return routes
+
+
+def find_routes(context, request):
+    """
+    Retorna (shortest, fastest), cada um com 'path', 'edges', 'cost', 'distance' e 'time'.
+    Com o Dijkstra as duas rotas saem de uma chamada só (shortest_and_fastest); pontas EdgeSnap saem do meio da rua.
+    Com horário de saída, a mais rápida vem da busca dependente do tempo (Dijkstra, ou A* nos
+    outros motores) e os totais da mais curta são calculados saindo no mesmo horário.
+
+    Só o motor multinível, sem horário de saída e entre nós, roda sem abrir o grafo inteiro:
+    o índice espacial e os pesos por horário precisam dele.
+    """
+    if isinstance(request.start, EdgeSnap):
+        graph = context.routing_graph(request.profile, request.traffic)
+        search = None if request.engine == "Dijkstra" else partial(pairwise_search, context, request)
+        routes = route_between_snaps(graph, context.spatial_index(), request.start, request.end, search)
+        return routes['length'], routes['speed']
+
+    if request.departure is not None:
+        tdw = context.time_dependent_weights(request.profile, request.traffic)
+        fastest, _ = td_route(
+            tdw, request.start, request.end, request.departure,
+            max_speed=context.max_speed(request.profile),
+            use_astar=request.engine != "Dijkstra"
+        )
+        _, path, cost = find_route(context, request, 'length')
+        shortest = {"path": path, "edges": [], "cost": cost, "distance": None, "time": None}
+        if path:
+            shortest["edges"] = tdw.cgraph.path_edges(path, 'length')
+            shortest["distance"], shortest["time"] = td_path_totals(tdw, shortest["edges"], request.departure)
+        return shortest, fastest
+
+    if request.engine == "Dijkstra":
+        graph = context.routing_graph(request.profile, request.traffic)
+        routes = shortest_and_fastest(graph, request.start, request.end)
+        return routes['length'], routes['speed']
+
+    return engine_route(context, request, 'length'), engine_route(context, request, 'speed')
+
+
+def route_job(request):
+    """Rota mais curta e mais rápida de um RouteRequest (roda num processo ou thread do pool)."""
+    return find_routes(city_context(request.store_path), request)
+
+
+def pareto_job(request):
+    """Rotas de Pareto (distância x tempo) entre as pontas do pedido; pontas EdgeSnap saem do meio da rua."""
+    context = city_context(request.store_path)
+    graph = context.routing_graph(request.profile, request.traffic)
+    if not isinstance(request.start, EdgeSnap):
+        return pareto_routes(graph, request.start, request.end)
+    routes = routes_between_snaps(
+        graph, context.spatial_index(), request.start, request.end, partial(pareto_routes, graph)
+    )
+    for route in routes:
+        route["cost"] = route["distance"]
+    return pareto_front(routes)
+
+
+def alternatives_job(request, k):
+    """
+    Até k rotas diferentes por métrica entre as pontas do pedido (alternative_routes), a melhor
+    primeiro; pontas EdgeSnap saem do meio da rua, como a rota de route_job.
+    """
+    context = city_context(request.store_path)
+    graph = context.routing_graph(request.profile, request.traffic)
+    max_speed = context.max_speed(request.profile)
+    if not isinstance(request.start, EdgeSnap):
+        return alternative_routes(graph, request.start, request.end, k, max_speed=max_speed)
+    result = {}
+    for weight_type in ('length', 'speed'):
+        routes = routes_between_snaps(
+            graph, context.spatial_index(), request.start, request.end,
+            partial(alternatives, graph, weight_type=weight_type, k=k, max_speed=max_speed)
+        )
+        for route in routes:
+            route["cost"] = route["distance"] if weight_type == 'length' else route["time"]
+        result[weight_type] = merge_alternatives(graph, routes, weight_type, k)
+    return result
+
+
+def isochrones_job(store_path, profile_name, traffic, start_node, minutes):
+    """Isócronas (GeoJSON) a partir de um nó, com o perfil e o trânsito ao vivo dados."""
+    context = city_context(store_path)
+    return isochrones_geojson(context.routing_graph(profile_name, traffic), start_node, minutes)
+
+
+def prepare_job(store_path, profile_name, engine):
+    """
+    Monta o que o motor precisa antes da primeira busca, sem trânsito ao vivo: as hierarquias das
+    duas métricas ou a partição e a customização das células. Tudo fica salvo junto com o grafo
+    (store_path/ch, store_path/partitioned), então os outros processos do pool só abrem os arquivos.
+    """
+    context = city_context(store_path)
+    for weight_type in ('length', 'speed'):
+        if engine == "Contraction Hierarchies":
+            context.contraction_hierarchy(profile_name, weight_type, NO_TRAFFIC)
+        elif engine == "Multinível (células)":
+            context.multi_level_overlay(profile_name, weight_type, NO_TRAFFIC)
+
+
+def _run_job(job, args):
+    # roda com um trace próprio e devolve os contadores das buscas junto com o resultado,
+    # para quem pediu somar no trace da sua execução (o trace não atravessa processos)
+    trace = Trace(job.__name__)
+    with use_trace(trace):
+        result = job(*args)
+    return result, trace.counters
+
+
+class RoutingService:
+    """
+    Serviço de rotas de um servidor inteiro: todas as sessões mandam as buscas para o mesmo pool.
+
+    Com processes=True, as buscas rodam num pool de processos (spawn). Cada processo abre cada
+    cidade do graph_store uma vez (CityContext), mapeada em memória, então a memória cresce com
+    as cidades carregadas e o número de processos, não com o número de usuários. Com
+    processes=False, as buscas rodam num pool de threads do próprio processo.
+
+    Cabem max_pending pedidos ao mesmo tempo (rodando ou na fila). Com a fila cheia, um pedido
+    novo espera até queue_timeout segundos por um lugar e depois recebe ServiceBusy, em vez de
+    deixar a fila crescer sem limite. Um pedido que passa de request_timeout segundos na fila
+    sem começar sai dela com RouteTimeout (um ServiceBusy).
+
+    As hierarquias e as células de uma cidade são montadas uma vez, por prepare, fora do prazo
+    dos pedidos: a primeira montagem pode levar mais que request_timeout numa cidade grande.
+    """
+
+    def __init__(self, workers=None, processes=True, max_pending=None, queue_timeout=QUEUE_TIMEOUT,
+                 request_timeout=REQUEST_TIMEOUT):
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.processes = processes
+        self.max_pending = max_pending or self.workers * QUEUE_PER_WORKER
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        if processes:
+            # spawn: o servidor do Streamlit tem várias threads, e fork copiaria locks no meio do uso
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="routing")
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.served = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._prepared = {}
+
+    def submit(self, job, *args):
+        """
+        Future com (resultado, contadores das buscas) de job(*args). job precisa ser uma função
+        de módulo (vai por pickle para os processos). Levanta ServiceBusy se a fila estiver cheia.
+        """
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise ServiceBusy(f"{self.max_pending} pedidos de rota na fila")
+        try:
+            future = self._pool.submit(_run_job, job, args)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.pending += 1
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self._lock:
+            self.pending -= 1
+            if not future.cancelled() and future.exception() is None:
+                self.served += 1
+        self._slots.release()
+
+    def run(self, job, *args):
+        """
+        Roda job(*args) no pool e espera o resultado; os contadores das buscas vão para o trace
+        ativo. Levanta ServiceBusy com a fila cheia e RouteTimeout se o pedido passar de
+        request_timeout segundos na fila sem começar.
+        """
+        future = self.submit(job, *args)
+        try:
+            result, counters = future.result(timeout=self.request_timeout)
+        except FutureTimeout:
+            if not future.cancel():
+                # já está rodando: o lugar só volta quando terminar, então o resultado ainda serve
+                result, counters = future.result()
+            else:
+                with self._lock:
+                    self.timed_out += 1
+                raise RouteTimeout(f"pedido de rota na fila por mais de {self.request_timeout:g} s") from None
+        merge_counters(counters)
+        return result
+
+    def prepare(self, store_path, profile_name, engine):
+        """
+        Future do prepare_job da cidade, do perfil e do motor. A primeira chamada manda a montagem
+        para o pool (fora da fila limitada e sem prazo) e as outras devolvem o mesmo future;
+        depois de uma falha, a próxima chamada tenta de novo.
+        """
+        key = (store_path, profile_name, engine)
+        with self._lock:
+            future = self._prepared.get(key)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self._prepared[key] = self._pool.submit(_run_job, prepare_job, key)
+        return future
+
+    def stats(self):
+        """
+        Pedidos em andamento (rodando ou na fila), atendidos (sem erro), recusados e expirados na
+        fila desde que o serviço subiu.
+        """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "served": self.served,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,295 @@
+from collections import namedtuple
+from functools import partial
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from multi_criteria import shared_search
+from overpass import EARTH_RADIUS_M
+
+# pedaços de rua maiores que isso são quebrados na hora de indexar, para a busca
+# pelos vizinhos mais próximos poder usar um raio pequeno
+MAX_PIECE_LENGTH_M = 50.0
+
+# ponto projetado numa aresta: posição da aresta, fração do caminho (0 = nó de saída, 1 = nó de chegada),
+# distância em metros até o clique e coordenadas do ponto projetado
+EdgeSnap = namedtuple("EdgeSnap", ["edge", "fraction", "distance", "lat", "lng"])
+
+
+class SpatialIndex:
+    """
+    Índice espacial de um CompiledGraph, montado uma vez por grafo carregado.
+
+    As coordenadas são projetadas em metros (equiretangular em volta do centro da cidade).
+    Os nós ficam numa KD-tree; as ruas (a geometry de cada aresta) são quebradas em
+    pedaços de no máximo MAX_PIECE_LENGTH_M, e o ponto médio de cada pedaço vai para
+    outra KD-tree. Todas as consultas recebem arrays de lat/lng e rodam vetorizadas.
+    """
+
+    def __init__(self, cgraph):
+        self.cgraph = cgraph
+        self.lat0, self.lng0 = cgraph.centroid()
+        self._cos_lat0 = np.cos(np.radians(self.lat0))
+
+        node_xy = self._project(np.asarray(cgraph.y), np.asarray(cgraph.x))
+        self.node_tree = cKDTree(node_xy)
+
+        self._build_edge_pieces()
+        self.twin = self._find_twins()
+
+    def _project(self, lats, lngs):
+        """(lat, lng) em graus -> (x, y) em metros."""
+        x = np.radians(np.asarray(lngs, dtype=np.float64) - self.lng0) * self._cos_lat0 * EARTH_RADIUS_M
+        y = np.radians(np.asarray(lats, dtype=np.float64) - self.lat0) * EARTH_RADIUS_M
+        return np.column_stack((x, y))
+
+    def _unproject(self, xy):
+        lngs = np.degrees(xy[:, 0] / (EARTH_RADIUS_M * self._cos_lat0)) + self.lng0
+        lats = np.degrees(xy[:, 1] / EARTH_RADIUS_M) + self.lat0
+        return lats, lngs
+
+    def _build_edge_pieces(self):
+        cgraph = self.cgraph
+        points = self._project(np.asarray(cgraph.geometry_y), np.asarray(cgraph.geometry_x))
+        geometry_offsets = np.asarray(cgraph.geometry_offsets)
+        num_edges = cgraph.num_edges
+
+        # segmentos consecutivos, sem ligar o último ponto de uma aresta ao primeiro da próxima
+        starts = np.arange(len(points) - 1)
+        starts = starts[~np.isin(starts + 1, geometry_offsets[1:])]
+        segment_edge = np.searchsorted(geometry_offsets, starts, side='right') - 1
+        a = points[starts]
+        b = points[starts + 1]
+        segment_length = np.hypot(*(b - a).T)
+
+        # quanto da aresta já foi percorrido no começo de cada segmento
+        cumulative = np.cumsum(segment_length)
+        edge_first_segment = np.searchsorted(segment_edge, np.arange(num_edges))
+        before_edge = np.concatenate(([0.0], cumulative))[edge_first_segment]
+        segment_along = cumulative - segment_length - before_edge[segment_edge]
+        self.edge_length = np.bincount(segment_edge, weights=segment_length, minlength=num_edges)
+
+        # quebra os segmentos longos em pedaços iguais
+        pieces = np.maximum(1, np.ceil(segment_length / MAX_PIECE_LENGTH_M).astype(np.int64))
+        piece_segment = np.repeat(np.arange(len(starts)), pieces)
+        piece_number = np.arange(len(piece_segment)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        t0 = piece_number / pieces[piece_segment]
+        t1 = (piece_number + 1) / pieces[piece_segment]
+        direction = (b - a)[piece_segment]
+
+        self.piece_a = a[piece_segment] + direction * t0[:, None]
+        self.piece_b = a[piece_segment] + direction * t1[:, None]
+        self.piece_edge = segment_edge[piece_segment]
+        self.piece_along = segment_along[piece_segment] + segment_length[piece_segment] * t0
+        self.max_piece_length = float(np.max(np.hypot(*(self.piece_b - self.piece_a).T), initial=0.0))
+        self.piece_tree = cKDTree((self.piece_a + self.piece_b) / 2)
+
+    def _find_twins(self):
+        """Para cada aresta u -> v, a aresta v -> u da mesma rua (mão dupla), ou -1."""
+        cgraph = self.cgraph
+        sources = np.repeat(np.arange(cgraph.num_nodes), np.diff(cgraph.offsets))
+        targets = np.asarray(cgraph.targets)
+        lengths = np.round(np.asarray(cgraph.length), 3)
+
+        by_key = {}
+        for e, key in enumerate(zip(sources.tolist(), targets.tolist(), lengths.tolist())):
+            by_key.setdefault(key, e)
+        twin = np.full(cgraph.num_edges, -1, dtype=np.int64)
+        for e, (u, v, length) in enumerate(zip(sources.tolist(), targets.tolist(), lengths.tolist())):
+            twin[e] = by_key.get((v, u, length), -1)
+        return twin
+
+    def nearest_nodes(self, lats, lngs):
+        """Ids do OSM dos nós mais próximos de cada ponto e a distância em metros."""
+        distances, nodes = self.node_tree.query(self._project(lats, lngs), workers=-1)
+        return np.asarray(self.cgraph.node_ids)[nodes], distances
+
+    def nearest_edges(self, lats, lngs):
+        """
+        Projeta cada ponto na rua mais próxima. Retorna uma lista de EdgeSnap.
+
+        Primeiro acha o pedaço com o ponto médio mais perto; a distância até esse pedaço
+        é um limite superior, então basta olhar os pedaços cujo ponto médio esteja a menos
+        de (limite + metade do maior pedaço) e ficar com o mais perto de verdade.
+        """
+        points = self._project(lats, lngs)
+        _, first = self.piece_tree.query(points, workers=-1)
+        upper, _ = self._distance_to_pieces(points, first)
+        candidates = self.piece_tree.query_ball_point(points, upper + self.max_piece_length / 2 + 1e-6, workers=-1)
+
+        # avalia todos os candidatos de todos os pontos de uma vez
+        counts = np.fromiter((len(c) for c in candidates), dtype=np.int64, count=len(candidates))
+        point_of = np.repeat(np.arange(len(points)), counts)
+        pieces = np.fromiter((p for c in candidates for p in c), dtype=np.int64, count=int(counts.sum()))
+        distances, t = self._distance_to_pieces(points[point_of], pieces)
+
+        # menor distância por ponto (ordena por ponto e depois por distância)
+        order = np.lexsort((distances, point_of))
+        first_of_point = order[np.searchsorted(point_of[order], np.arange(len(points)))]
+        best_piece = pieces[first_of_point]
+        best_t = t[first_of_point]
+
+        a = self.piece_a[best_piece]
+        projected = a + (self.piece_b[best_piece] - a) * best_t[:, None]
+        lats_out, lngs_out = self._unproject(projected)
+
+        edges = self.piece_edge[best_piece]
+        piece_length = np.hypot(*(self.piece_b[best_piece] - a).T)
+        along = self.piece_along[best_piece] + piece_length * best_t
+        fractions = np.clip(along / np.maximum(self.edge_length[edges], 1e-9), 0.0, 1.0)
+
+        return [
+            EdgeSnap(int(edge), float(fraction), float(distance), float(lat), float(lng))
+            for edge, fraction, distance, lat, lng
+            in zip(edges, fractions, distances[first_of_point], lats_out, lngs_out)
+        ]
+
+    def _distance_to_pieces(self, points, pieces):
+        """Distância de cada ponto ao pedaço correspondente e a posição (0..1) da projeção."""
+        a = self.piece_a[pieces]
+        ab = self.piece_b[pieces] - a
+        squared = np.einsum('ij,ij->i', ab, ab)
+        t = np.clip(np.einsum('ij,ij->i', points - a, ab) / np.where(squared > 0, squared, 1.0), 0.0, 1.0)
+        closest = a + ab * t[:, None]
+        return np.hypot(*(points - closest).T), t
+
+
+def _edge_source(cgraph, e):
+    return int(np.searchsorted(cgraph.offsets, e, side='right') - 1)
+
+
+def _snap_ends(cgraph, index, snap):
+    """
+    Os dois jeitos de sair (ou chegar) de um ponto no meio de uma rua:
+    [(nó, distância, tempo, aresta, fração)] com o nó de chegada da aresta e, se a rua for
+    mão dupla, o nó de saída pela aresta gêmea. Os custos são proporcionais à fração da
+    aresta que é percorrida.
+    """
+    e = int(snap.edge)
+    u = _edge_source(cgraph, e)
+    v = int(cgraph.targets[e])
+    forward = [(v, (1 - snap.fraction) * cgraph.length[e], (1 - snap.fraction) * cgraph.travel_time[e], e, 1 - snap.fraction)]
+    backward = [(u, snap.fraction * cgraph.length[e], snap.fraction * cgraph.travel_time[e], e, snap.fraction)]
+
+    twin = int(index.twin[e])
+    if twin != -1:
+        forward.append((u, snap.fraction * cgraph.length[twin], snap.fraction * cgraph.travel_time[twin], twin, snap.fraction))
+        backward.append((v, (1 - snap.fraction) * cgraph.length[twin], (1 - snap.fraction) * cgraph.travel_time[twin], twin, 1 - snap.fraction))
+    # forward: ir do ponto até um nó; backward: ir de um nó até o ponto
+    return forward, backward
+
+
+def _same_edge(index, start_snap, end_snap):
+    """
+    (aresta, fração percorrida) para ir direto de start_snap a end_snap quando os dois estão
+    na mesma rua e o sentido dela permite; None se não der.
+    """
+    twin = int(index.twin[start_snap.edge])
+    if end_snap.edge not in (start_snap.edge, twin):
+        return None
+    # posição do destino medida ao longo da aresta da origem
+    end_position = end_snap.fraction if end_snap.edge == start_snap.edge else 1 - end_snap.fraction
+    if end_position >= start_snap.fraction:
+        return int(start_snap.edge), end_position - start_snap.fraction
+    if twin != -1:
+        return twin, start_snap.fraction - end_position
+    return None
+
+
+def _direct_route(cgraph, same_edge, start_snap, end_snap):
+    """Rota direta entre os dois pontos na mesma rua (_same_edge), sem 'cost'."""
+    edge, gap = same_edge
+    ends = [_edge_source(cgraph, edge), int(cgraph.targets[edge])]
+    return {
+        "path": [int(cgraph.node_ids[node]) for node in ends], "edges": [edge], "edge_share": (gap, 1.0),
+        "distance": gap * float(cgraph.length[edge]), "time": gap * float(cgraph.travel_time[edge]),
+        "coords": [(start_snap.lat, start_snap.lng), (end_snap.lat, end_snap.lng)],
+    }
+
+
+def route_between_snaps(cgraph, index, start_snap, end_snap, search=None):
+    """
+    Rota mais curta e mais rápida começando e terminando nos pontos projetados nas ruas
+    (em vez de no nó mais próximo). Mesmo formato de shortest_and_fastest, com duas chaves
+    a mais: 'coords', que já inclui os pontos projetados nas pontas para desenhar no mapa,
+    e 'edge_share', a fração percorrida da primeira e da última aresta de 'edges' (as ruas
+    onde estão os pontos, que entram em 'edges' mesmo sendo percorridas só em parte).
+
+    search(sources, targets) faz a busca entre os nós das pontas, com os argumentos e o
+    retorno de multi_criteria.shared_search (o padrão). Os motores que só ligam um nó a outro
+    (A*, Contraction Hierarchies, células) passam uma busca que testa cada par de nós.
+    Com os dois pontos na mesma rua, 'path' são as duas pontas da rua e 'edges' só ela.
+    """
+    sources, _ = _snap_ends(cgraph, index, start_snap)
+    _, arrivals = _snap_ends(cgraph, index, end_snap)
+
+    # aresta (e fração) usada para sair do ponto até cada nó, e de cada nó até o destino
+    departures = {}
+    for node, _, _, edge, share in sources:
+        departures.setdefault(node, (edge, share))
+    targets = {}
+    arrival_edges = {}
+    for node, distance, time, edge, share in arrivals:
+        if node not in targets or distance < targets[node][0]:
+            targets[node] = (distance, time)
+            arrival_edges[node] = (edge, share)
+
+    if search is None:
+        search = partial(shared_search, cgraph)
+    routes = search([(node, float(d), float(t)) for node, d, t, _, _ in sources],
+                    {node: (float(d), float(t)) for node, (d, t) in targets.items()})
+
+    # os dois pontos na mesma rua: vai direto, se o sentido da rua permitir
+    same_edge = _same_edge(index, start_snap, end_snap)
+    start_coords = (start_snap.lat, start_snap.lng)
+    end_coords = (end_snap.lat, end_snap.lng)
+    for weight_type, route in routes.items():
+        if same_edge is not None:
+            direct = _direct_route(cgraph, same_edge, start_snap, end_snap)
+            cost = direct["distance"] if weight_type == 'length' else direct["time"]
+            if cost <= route["cost"]:
+                route.update(direct, cost=cost)
+                continue
+        if route["path"]:
+            first_edge, first_share = departures[cgraph.index[route["path"][0]]]
+            last_edge, last_share = arrival_edges[cgraph.index[route["path"][-1]]]
+            route["edges"] = [first_edge] + route["edges"] + [last_edge]
+            route["edge_share"] = (first_share, last_share)
+        route["coords"] = [start_coords] + cgraph.coords(route["path"]) + [end_coords]
+    return routes
+
+
+def routes_between_snaps(cgraph, index, start_snap, end_snap, search):
+    """
+    Várias rotas entre dois pontos projetados nas ruas, para as buscas que devolvem uma lista
+    de rotas entre dois nós (rotas de Pareto, alternativas). search(start_node, end_node), com
+    ids do OSM, roda para cada nó por onde dá para sair da rua de partida e cada nó por onde dá
+    para chegar à rua de destino (no máximo 2 x 2), e cada rota ganha os pedaços dessas ruas,
+    como em route_between_snaps. Com os dois pontos na mesma rua, a ida direta entra também.
+
+    Toda rota entre os dois pontos passa por um desses pares (ou é a ida direta), então quem
+    chama só precisa juntar as listas: tirar as dominadas, escolher as k melhores... As rotas
+    voltam sem 'cost', que depende da métrica de quem chama.
+    """
+    departures, _ = _snap_ends(cgraph, index, start_snap)
+    _, arrivals = _snap_ends(cgraph, index, end_snap)
+    start_coords = (start_snap.lat, start_snap.lng)
+    end_coords = (end_snap.lat, end_snap.lng)
+
+    routes = []
+    same_edge = _same_edge(index, start_snap, end_snap)
+    if same_edge is not None:
+        routes.append(_direct_route(cgraph, same_edge, start_snap, end_snap))
+    for source, start_distance, start_time, first_edge, first_share in departures:
+        for target, end_distance, end_time, last_edge, last_share in arrivals:
+            node_routes = search(int(cgraph.node_ids[source]), int(cgraph.node_ids[target]))
+            for route in node_routes:
+                routes.append({
+                    "path": route["path"],
+                    "edges": [first_edge] + list(route["edges"]) + [last_edge],
+                    "edge_share": (first_share, last_share),
+                    "distance": float(start_distance) + route["distance"] + float(end_distance),
+                    "time": float(start_time) + route["time"] + float(end_time),
+                    "coords": [start_coords] + cgraph.coords(route["path"]) + [end_coords],
+                })
+    return routes
@@ -0,0 +1,81 @@
+import json
+import os
+
+import numpy as np
+
+from compiled_graph import edge_travel_time
+
+DEFAULT_PROFILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "speed_profiles.json")
+DEFAULT_PROFILE = "car"
+
+
+def load_speed_profiles(path=DEFAULT_PROFILES_PATH):
+    """
+    Lê os perfis de velocidade. Cada perfil tem 'label' (nome na interface), 'default'
+    (km/h para tipos de via fora da tabela) e 'speeds' ({tipo de via: km/h}). Opcionalmente,
+    'time_factors' com a variação ao longo do dia (ver time_dependent.TimeDependentWeights) e
+    'use_maxspeed': true para usar a tag maxspeed das ruas que têm uma (ver edge_speeds).
+    """
+    with open(path, encoding="utf-8") as f:
+        profiles = json.load(f)
+    for name, profile in profiles.items():
+        if "speeds" not in profile or "default" not in profile:
+            raise ValueError(f"Perfil de velocidade '{name}' precisa de 'speeds' e 'default'")
+        profile.setdefault("label", name)
+    return profiles
+
+
+def profile_max_speed(profile, cgraph=None):
+    """
+    Maior velocidade do perfil (km/h), usada como limite pela heurística do A*. Com
+    'use_maxspeed', as placas de cgraph também contam (sem cgraph, o limite pode ficar baixo).
+    """
+    max_speed = max(max(profile["speeds"].values()), profile["default"])
+    if profile.get("use_maxspeed") and cgraph is not None:
+        maxspeed = np.asarray(cgraph.maxspeed)
+        if np.any(~np.isnan(maxspeed)):
+            max_speed = max(max_speed, float(np.nanmax(maxspeed)))
+    return max_speed
+
+
+def highway_speeds(strings, highway, maxspeed, profile, string_id=None):
+    """
+    Velocidade (km/h) pelo perfil de arestas dadas pelas colunas highway (códigos em strings) e
+    maxspeed, sem laço em python: monta uma tabela indexada pelo código do tipo de via e indexa
+    com o array inteiro. Com 'use_maxspeed', as arestas com a tag maxspeed usam o limite da placa
+    no lugar da tabela. string_id (texto -> código) evita montar o dict de strings de novo.
+    """
+    if string_id is None:
+        string_id = {s: i for i, s in enumerate(strings)}.get
+    table = np.full(len(strings), float(profile["default"]))
+    for highway_type, speed in profile["speeds"].items():
+        code = string_id(highway_type)
+        if code is not None:
+            table[code] = speed
+    speeds = table[np.asarray(highway)]
+    if profile.get("use_maxspeed"):
+        maxspeed = np.asarray(maxspeed)
+        speeds = np.where(np.isnan(maxspeed), speeds, maxspeed)
+    return speeds
+
+
+def edge_speeds(cgraph, profile):
+    """Velocidade (km/h) de cada aresta do grafo pelo perfil (ver highway_speeds)."""
+    return highway_speeds(cgraph.strings, cgraph.highway, cgraph.maxspeed, profile, cgraph.string_id)
+
+
+def apply_speed_profile(cgraph, profile):
+    """
+    Grafo com os tempos de viagem do perfil. É uma visão: divide todos os arrays com
+    cgraph e só tem speed/travel_time próprios, então vários perfis convivem sem copiar o grafo.
+    """
+    speed = edge_speeds(cgraph, profile)
+    return cgraph.with_speeds(speed, edge_travel_time(np.asarray(cgraph.length), speed))
+
+
+def profile_graph(cgraph, name, profiles):
+    """apply_speed_profile com cache: cada perfil é calculado uma vez por grafo."""
+    views = cgraph.__dict__.setdefault("_profile_views", {})
+    if name not in views:
+        views[name] = apply_speed_profile(cgraph, profiles[name])
+    return views[name]
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# os módulos do app ficam em src/ e são importados sem pacote (como nos scripts)
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
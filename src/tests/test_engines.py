@@ -0,0 +1,135 @@
+import math
+import os
+import random
+from collections import namedtuple
+
+import numpy as np
+import pytest
+
+from conftest import SRC
+from alternative_routes import alternatives
+from bidirectional_astar import bidirectional_astar
+from compiled_graph import compile_graph, csr_dijkstra
+from contraction_hierarchies import build_contraction_hierarchy
+from instrumentation import Trace, use_trace
+from live_traffic import CLOSED, LiveTraffic
+from multi_criteria import shortest_and_fastest
+from overpass import graph_from_overpass_json
+from partitioned_graph import PartitionedGraph, customize, save_partitioned_store
+from reference_dijkstra import dijkstra, dijkstra_heapdict, set_edge_speed
+from speed_profiles import apply_speed_profile, load_speed_profiles, profile_max_speed
+
+# uma das respostas do Overpass do cache (sem internet), com uns 2 mil nós depois de simplificar
+CACHED_RESPONSE = os.path.join(SRC, "cache", "645c23c50edf992649c338e8a935dbd034a076ba.json")
+SEED = 42
+NUM_PAIRS = 25
+WEIGHT_TYPES = ('length', 'speed')
+
+City = namedtuple("City", ["graph", "cgraph", "pairs", "max_speed", "hierarchies", "overlays"])
+
+
+@pytest.fixture(scope="module")
+def city(tmp_path_factory):
+    graph = graph_from_overpass_json(CACHED_RESPONSE)
+    set_edge_speed(graph)
+    cgraph = compile_graph(graph)
+    rng = random.Random(SEED)
+    nodes = cgraph.node_ids.tolist()
+    pairs = [(rng.choice(nodes), rng.choice(nodes)) for _ in range(NUM_PAIRS)]
+
+    # células pequenas, para a consulta passar por mais de um nível
+    path = str(tmp_path_factory.mktemp("partitioned") / "store")
+    save_partitioned_store(cgraph, path, cell_sizes=(64, 256))
+    pgraph = PartitionedGraph(path, max_cells=4)
+    return City(
+        graph, cgraph, pairs,
+        max_speed=profile_max_speed(load_speed_profiles()["car"], cgraph),
+        hierarchies={w: build_contraction_hierarchy(cgraph, w) for w in WEIGHT_TYPES},
+        overlays={w: customize(pgraph, w) for w in WEIGHT_TYPES},
+    )
+
+
+def first_alternative(city, s, t, w):
+    routes = alternatives(city.cgraph, s, t, w, 3, max_speed=city.max_speed)
+    return routes[0]["cost"] if routes else math.inf
+
+
+ENGINES = {
+    "nx_heapq": lambda city, s, t, w: dijkstra(city.graph, s, t, w)[2],
+    "nx_heapdict": lambda city, s, t, w: dijkstra_heapdict(city.graph, s, t, w)[2],
+    "shared": lambda city, s, t, w: shortest_and_fastest(city.cgraph, s, t)[w]["cost"],
+    "astar": lambda city, s, t, w: bidirectional_astar(city.cgraph, s, t, w, max_speed=city.max_speed)[1],
+    "ch": lambda city, s, t, w: city.hierarchies[w].query(s, t)[1],
+    "mld": lambda city, s, t, w: city.overlays[w].query(s, t)["cost"],
+    "alternatives": first_alternative,
+}
+
+
+def assert_same_cost(cost, expected):
+    if math.isinf(expected):
+        assert math.isinf(cost)
+    else:
+        assert cost == pytest.approx(expected, rel=1e-9, abs=1e-9)
+
+
+@pytest.mark.parametrize("weight_type", WEIGHT_TYPES)
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_matches_csr_dijkstra(city, engine, weight_type):
+    run = ENGINES[engine]
+    for s, t in city.pairs:
+        assert_same_cost(run(city, s, t, weight_type), csr_dijkstra(city.cgraph, s, t, weight_type)[2])
+
+
+def search_counters(run):
+    """(nós fechados, arestas relaxadas) somados das buscas feitas em run."""
+    trace = Trace("teste")
+    with use_trace(trace):
+        run()
+    return (sum(c["pops"] - c["stale_pops"] for c in trace.counters.values()),
+            sum(c["relaxed_edges"] for c in trace.counters.values()))
+
+
+def test_shared_search_does_the_work_of_two_searches(city):
+    cgraph = city.cgraph
+    for s, t in city.pairs:
+        shared = search_counters(lambda: shortest_and_fastest(cgraph, s, t))
+        separate = search_counters(lambda: [csr_dijkstra(cgraph, s, t, w) for w in WEIGHT_TYPES])
+        if not math.isfinite(csr_dijkstra(cgraph, s, t, 'length')[2]):
+            assert shared == separate
+            continue
+        # duas buscas intercaladas: os nós fechados das duas separadas mais o pop que encerra
+        # cada métrica, e as arestas do destino (que o csr_dijkstra não abre) uma vez por métrica
+        target = cgraph.index[t]
+        out_degree = int(cgraph.offsets[target + 1] - cgraph.offsets[target])
+        assert shared == (separate[0] + 2, separate[1] + 2 * out_degree)
+
+
+@pytest.mark.parametrize("weight_type", WEIGHT_TYPES)
+def test_overlay_with_profile_and_traffic_matches_csr_dijkstra(city, weight_type):
+    profile = load_speed_profiles()["bike"]
+    pgraph = city.overlays[weight_type].pgraph
+    base = customize(pgraph, weight_type, profile)
+
+    rng = np.random.default_rng(SEED)
+    live = LiveTraffic(city.cgraph)
+    live.update(rng.choice(city.cgraph.num_edges, 40, replace=False), 3.0)
+    live.update(rng.choice(city.cgraph.num_edges, 20, replace=False), CLOSED)
+    traffic = live.snapshot()
+    expected_graph = live.apply(apply_speed_profile(city.cgraph, profile))
+
+    # a customização a partir de base só refaz as células com ruas alteradas, e tem que dar o mesmo
+    overlay = customize(pgraph, weight_type, profile, traffic, base=base)
+    full = customize(pgraph, weight_type, profile, traffic)
+    for level in range(1, pgraph.levels + 1):
+        for incremental, complete in zip(overlay.cliques[level], full.cliques[level]):
+            assert np.array_equal(incremental, complete)
+
+    for s, t in city.pairs:
+        route = overlay.query(s, t)
+        _, path, expected = csr_dijkstra(expected_graph, s, t, weight_type)
+        assert_same_cost(route["cost"], expected)
+        if path:
+            summary_length = np.asarray(expected_graph.length)[route["edges"]].sum()
+            summary_time = np.asarray(expected_graph.travel_time)[route["edges"]].sum()
+            assert route["distance"] == pytest.approx(summary_length)
+            assert route["time"] == pytest.approx(summary_time)
@@ -0,0 +1,115 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from conftest import FIXTURES, SRC
+from graph_loader import build_from_file
+from osm_stream import OverpassStream, TagStats, iter_osm_elements
+from overpass import graph_from_overpass_json
+from speed_profiles import load_speed_profiles
+
+TINY_JSON = os.path.join(FIXTURES, "tiny.json")
+TINY_OSM = os.path.join(FIXTURES, "tiny.osm")
+# resposta do Overpass do cache (acentos escapados como \u00e9, que também podem ser cortados no meio)
+CACHED_RESPONSE = os.path.join(SRC, "cache", "ae99cb8b029c3d9dfe098c9008a14e0c4678b335.json")
+
+COLUMNS = ("node_ids", "x", "y", "offsets", "targets", "length", "maxspeed", "highway", "name",
+           "geometry_offsets", "geometry_x", "geometry_y", "travel_time")
+
+
+def car():
+    return load_speed_profiles()["car"]
+
+
+def edge_pairs(cgraph):
+    """(id do OSM da origem, id do destino, tipo de via) de cada aresta."""
+    sources = cgraph.node_ids[cgraph.edge_sources()]
+    targets = cgraph.node_ids[np.asarray(cgraph.targets)]
+    return {(int(u), int(v), cgraph.strings[code]) for u, v, code in zip(sources, targets, cgraph.highway)}
+
+
+def chunked(data, size):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 13, 4093])
+def test_overpass_stream_small_response_at_odd_chunk_sizes(chunk_size):
+    with open(TINY_JSON, encoding="utf-8") as f:
+        expected = json.load(f)
+    stream = OverpassStream(TINY_JSON, chunk_size=chunk_size)
+    assert list(stream) == expected["elements"]
+    assert stream.header == {"version": expected["version"], "generator": expected["generator"]}
+
+
+@pytest.mark.parametrize("chunk_size", [7, 13, 1021, 65537])
+def test_overpass_stream_cached_response_at_odd_chunk_sizes(chunk_size):
+    with open(CACHED_RESPONSE, encoding="utf-8") as f:
+        expected = json.load(f)["elements"]
+    assert list(OverpassStream(CACHED_RESPONSE, chunk_size=chunk_size)) == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 5])
+def test_overpass_stream_keeps_remark_and_split_characters(chunk_size):
+    # "é" tem dois bytes e "0.6" é um número que pode ser cortado no meio
+    data = json.dumps({
+        "version": 0.6,
+        "elements": [{"type": "node", "id": 1, "lat": -8.75, "lon": -35.1, "tags": {"name": "Tamandaré"}}],
+        "remark": "runtime error: Query timed out",
+    }, ensure_ascii=False).encode("utf-8")
+    stream = OverpassStream(chunked(data, chunk_size))
+    assert list(stream) == json.loads(data)["elements"]
+    assert stream.header == {"version": 0.6}
+    assert stream.remark == "runtime error: Query timed out"
+
+
+def test_overpass_stream_empty_elements():
+    assert list(OverpassStream([b'{"version": 0.6, "elements": [', b']}'])) == []
+
+
+def test_tag_stats_count_every_way():
+    stats = TagStats()
+    for element in iter_osm_elements(TINY_JSON):
+        stats.add(element)
+    assert stats.nodes == 7
+    assert stats.ways == {"residential": 2, "primary": 1, "tertiary": 1, "unclassified": 1, "footway": 1}
+    # só a Avenida B tem maxspeed
+    assert sum(stats.missing_maxspeed.values()) == 5
+
+
+def test_build_from_json_keeps_drive_network():
+    cgraph = build_from_file(TINY_JSON, car())
+    assert 7 not in cgraph.node_ids.tolist()
+    pairs = edge_pairs(cgraph)
+    # mão única da Avenida B (3 -> 4) e da Rua C ao contrário (6 -> 5 -> 4, só os cruzamentos ficam)
+    assert (3, 4, "primary") in pairs and (4, 3, "primary") not in pairs
+    assert {(6, 5, "residential"), (5, 4, "residential")} <= pairs
+    assert not {(5, 6, "residential"), (4, 5, "residential")} & pairs
+    assert all(highway != "footway" for _, _, highway in pairs)
+    primary = np.asarray(cgraph.highway) == cgraph.strings.index("primary")
+    assert np.all(np.asarray(cgraph.maxspeed)[primary] == 60)
+    assert np.all(np.isnan(np.asarray(cgraph.maxspeed)[~primary]))
+
+
+def test_build_keeps_isolated_roundabout(tmp_path):
+    # rotatória de mão única sem nenhuma rua chegando: nenhum nó é ponta
+    ring = [(1, -8.74, -35.1), (2, -8.74, -35.099), (3, -8.741, -35.099), (4, -8.741, -35.1)]
+    elements = [{"type": "node", "id": i, "lat": lat, "lon": lng} for i, lat, lng in ring]
+    elements.append({"type": "way", "id": 10, "nodes": [1, 2, 3, 4, 1],
+                     "tags": {"highway": "tertiary", "junction": "roundabout"}})
+    path = tmp_path / "ring.json"
+    path.write_text(json.dumps({"version": 0.6, "elements": elements}), encoding="utf-8")
+
+    pairs = {(u, v) for u, v, _ in edge_pairs(build_from_file(str(path), car()))}
+    assert pairs == {(1, 2), (2, 3), (3, 4), (4, 1)}
+    assert pairs == set(graph_from_overpass_json(str(path)).edges())
+
+
+def test_osm_file_matches_overpass_json():
+    pytest.importorskip("osmium")
+    from_json = build_from_file(TINY_JSON, car())
+    from_osm = build_from_file(TINY_OSM, car())
+    for column in COLUMNS:
+        assert np.array_equal(np.asarray(getattr(from_osm, column)), np.asarray(getattr(from_json, column)), equal_nan=True), column
+    assert from_osm.strings == from_json.strings
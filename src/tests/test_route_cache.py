@@ -0,0 +1,51 @@
+import sqlite3
+
+import numpy as np
+
+from route_cache import RouteCache
+
+
+def key(start, end, metric, speed="v1"):
+    return ("cidade", start, end, metric, speed)
+
+
+def test_disk_cache_roundtrip_with_numpy_keys(tmp_path):
+    path = str(tmp_path / "routes.sqlite")
+    snapped = ("edge", np.int64(7), np.float64(0.25))
+    route = {"path": [1, 2, 3], "edges": np.array([7, 8]), "cost": np.float64(12.5), "time": float("inf")}
+    cache = RouteCache(disk_path=path)
+    cache.put(key(np.int64(1), snapped, "length"), route)
+
+    # outro processo: só o SQLite, sem a memória
+    other = RouteCache(disk_path=path)
+    value = other.get(key(1, ("edge", 7, 0.25), "length"))
+    assert value == {"path": [1, 2, 3], "edges": [7, 8], "cost": 12.5, "time": float("inf")}
+    assert other.disk_hits == 1
+
+    # nada de pickle no arquivo: as rotas ficam em texto JSON
+    with sqlite3.connect(path) as db:
+        assert {type(v) for (v,) in db.execute("SELECT value FROM route_json")} == {str}
+
+
+def test_disk_rekey_keeps_only_routes_that_pass(tmp_path):
+    path = str(tmp_path / "routes.sqlite")
+    cache = RouteCache(disk_path=path)
+    cache.put(key(1, ("edge", 7, 0.5), "length"), {"edges": [7, 8]})
+    cache.put(key(1, 3, ("speed", 3600)), {"edges": [9]})
+    cache.put(key(2, 3, "length", speed="outro"), {"edges": [7]})
+
+    seen = []
+
+    def keep(k, value):
+        seen.append(k)
+        return 7 not in value["edges"]
+
+    RouteCache(disk_path=path).rekey("cidade", "v1", "v2", keep)
+    # as chaves voltam do disco como tuplas, iguais às do app
+    assert sorted(seen, key=repr) == sorted([key(1, ("edge", 7, 0.5), "length"), key(1, 3, ("speed", 3600))], key=repr)
+
+    other = RouteCache(disk_path=path)
+    assert other.get(key(1, 3, ("speed", 3600), speed="v2")) == {"edges": [9]}
+    assert other.get(key(1, ("edge", 7, 0.5), "length", speed="v2")) is None
+    assert other.get(key(1, ("edge", 7, 0.5), "length")) is None
+    assert other.get(key(2, 3, "length", speed="outro")) == {"edges": [7]}
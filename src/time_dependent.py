@@ -0,0 +1,228 @@
+import heapq
+from bisect import bisect_right
+
+import numpy as np
+
+from instrumentation import record_search
+from overpass import haversine
+
+DAY = 24 * 3600
+
+# folga para erros de arredondamento: a heurística nunca pode passar do custo real
+HEURISTIC_SLACK = 0.999999
+
+
+class TimeDependentWeights:
+    """
+    Tempos de viagem que mudam com a hora do dia.
+
+    O perfil de velocidade pode ter 'time_factors': {tipo de via ou 'default': [[hora, fator], ...]},
+    curvas lineares por partes (hora de 0 a 24) que multiplicam a velocidade do perfil.
+    Tipos de via sem curva própria usam a 'default'; sem 'time_factors' o fator é sempre 1.
+
+    As curvas são levadas para uma grade única de horários (a união de todos os pontos), então
+    em cada intervalo o fator de qualquer aresta é f0 + inclinação * (t - início do intervalo).
+    O tempo da aresta é calculado na hora em que se sai do nó de origem dela.
+
+    As curvas precisam manter a propriedade FIFO (sair mais tarde de uma rua nunca faz chegar
+    antes no fim dela), que é o que deixa td_route exato; o construtor confere e levanta
+    ValueError se alguma curva acelera rápido demais para as ruas mais longas do grafo.
+    """
+
+    def __init__(self, cgraph, profile):
+        self.cgraph = cgraph
+        time_factors = profile.get("time_factors", {})
+
+        curves = [time_factors.get("default", [[0, 1.0], [24, 1.0]])]
+        row_names = ["default"]
+        row_codes = []
+        for highway_type, points in time_factors.items():
+            if highway_type != "default":
+                curves.append(points)
+                row_names.append(highway_type)
+                row_codes.append((cgraph.string_id(highway_type), len(curves) - 1))
+
+        hours = sorted({0.0, 24.0} | {float(hour) for points in curves for hour, _ in points})
+        table = np.array([
+            np.interp(hours, [hour for hour, _ in points], [factor for _, factor in points])
+            for points in curves
+        ])
+        if np.any(table <= 0):
+            raise ValueError("Os fatores de 'time_factors' precisam ser maiores que zero")
+
+        self.breaks = [hour * 3600 for hour in hours]
+        # (fator no começo do intervalo, inclinação por segundo) de cada linha da tabela
+        self._segments = [
+            (table[:, s].tolist(), ((table[:, s + 1] - table[:, s]) / (self.breaks[s + 1] - self.breaks[s])).tolist())
+            for s in range(len(hours) - 1)
+        ]
+        self.max_factor = float(table.max())
+
+        # linha da tabela de cada aresta, pelo código do tipo de via
+        code_row = np.zeros(len(cgraph.strings), dtype=np.int64)
+        for code, row in row_codes:
+            if code is not None:
+                code_row[code] = row
+        self.edge_rows = code_row[np.asarray(cgraph.highway)].tolist()
+        self._check_fifo(table, hours, row_names)
+
+    def _check_fifo(self, table, hours, row_names):
+        """
+        Levanta ValueError se alguma linha da tabela quebra a FIFO numa aresta do grafo.
+
+        Num intervalo o fator é f = f0 + a * s e o tempo da aresta é base / f, que muda
+        -base * a / f² segundos por segundo; com a > 0 o pior ponto é o começo (f = f0). A FIFO
+        pede que essa taxa fique acima de -1 para a maior base das arestas de cada linha. Na
+        meia-noite o fator volta de uma vez para o das 0h, que não pode ser maior que o das 24h.
+        """
+        base = np.asarray(self.cgraph.weights('speed'), dtype=np.float64)
+        rows = np.asarray(self.edge_rows, dtype=np.int64)
+        # ruas interditadas (tempo infinito) nunca entram numa rota
+        finite = np.isfinite(base)
+        max_base = np.zeros(len(table))
+        np.maximum.at(max_base, rows[finite], base[finite])
+
+        for s, (start_factors, slopes) in enumerate(self._segments):
+            rate = max_base * np.asarray(slopes) / np.asarray(start_factors) ** 2
+            if np.any(rate >= 1):
+                row = int(np.argmax(rate))
+                raise ValueError(
+                    f"'time_factors' de {row_names[row]!r} quebra a FIFO entre {hours[s]:g}h e {hours[s + 1]:g}h: "
+                    f"numa rua de {max_base[row]:.0f} s, sair mais tarde faria chegar antes"
+                )
+        jumps = (max_base > 0) & (table[:, 0] > table[:, -1])
+        if np.any(jumps):
+            row = int(np.argmax(jumps))
+            raise ValueError(
+                f"'time_factors' de {row_names[row]!r} quebra a FIFO na meia-noite: "
+                f"o fator das 0h ({table[row, 0]:g}) é maior que o das 24h ({table[row, -1]:g})"
+            )
+
+    def segment(self, t):
+        """(fatores, inclinações, segundos desde o começo do intervalo) para o instante t (segundos)."""
+        time_of_day = t % DAY
+        s = min(bisect_right(self.breaks, time_of_day) - 1, len(self._segments) - 1)
+        start_factors, slopes = self._segments[s]
+        return start_factors, slopes, time_of_day - self.breaks[s]
+
+    def travel_time(self, e, t):
+        """Tempo (segundos) para percorrer a aresta e saindo no instante t."""
+        _, _, base = self.cgraph.adjacency('speed')
+        start_factors, slopes, elapsed = self.segment(t)
+        row = self.edge_rows[e]
+        return base[e] / (start_factors[row] + slopes[row] * elapsed)
+
+
+def td_route(tdw, start_node, end_node, departure, max_speed=None, use_astar=True):
+    """
+    Rota mais rápida saindo às departure (segundos desde a meia-noite) com os tempos de tdw.
+
+    É o Dijkstra comum com o custo de cada nó sendo o horário de chegada: o tempo de uma aresta
+    é avaliado na hora em que a busca sai do nó. Isso só dá a rota exata com a FIFO (sair mais
+    tarde de uma rua nunca faz chegar antes no fim dela), que TimeDependentWeights confere ao
+    montar as curvas do perfil.
+    Com use_astar soma o haversine dividido pela maior velocidade possível (max_speed, em km/h,
+    vezes o maior fator do dia), que nunca passa do tempo real.
+
+    Retorna (route, settled): route no mesmo formato de shortest_and_fastest ('path', 'edges',
+    'cost', 'distance', 'time'; cost == time) e o número de nós fechados.
+    """
+    cgraph = tdw.cgraph
+    offsets, targets, base = cgraph.adjacency('speed')
+    _, _, lengths = cgraph.adjacency('length')
+    edge_rows = tdw.edge_rows
+    source = cgraph.index[start_node]
+    target = cgraph.index[end_node]
+    inf = float('inf')
+
+    if use_astar:
+        if max_speed is None:
+            max_speed = cgraph.max_speed()
+        scale = HEURISTIC_SLACK / (max_speed * tdw.max_factor * (1000 / 3600))
+        x = cgraph.x
+        y = cgraph.y
+        target_lat, target_lng = float(y[target]), float(x[target])
+        potentials = {}
+
+        def potential(node):
+            p = potentials.get(node)
+            if p is None:
+                p = haversine(float(y[node]), float(x[node]), target_lat, target_lng) * scale
+                potentials[node] = p
+            return p
+    else:
+        def potential(node):
+            return 0.0
+
+    arrival = {source: float(departure)}
+    distance = {source: 0.0}
+    predecessors = {source: -1}
+    minHeap = [(departure + potential(source), source)]
+    settled = 0
+    pops = relaxed_edges = 0
+
+    heappop = heapq.heappop
+    heappush = heapq.heappush
+
+    while minHeap:
+        key, node = heappop(minHeap)
+        pops += 1
+        current_time = arrival[node]
+        # entrada velha na heap (o nó já foi inserido de novo com chegada mais cedo)
+        if key > current_time + potential(node):
+            continue
+        settled += 1
+        if node == target:
+            break
+
+        # o intervalo da tabela é o mesmo para todas as arestas que saem do nó
+        start_factors, slopes, elapsed = tdw.segment(current_time)
+        current_distance = distance[node]
+        first, last = offsets[node], offsets[node + 1]
+        relaxed_edges += last - first
+        for e in range(first, last):
+            neighbour = targets[e]
+            row = edge_rows[e]
+            new_time = current_time + base[e] / (start_factors[row] + slopes[row] * elapsed)
+            if new_time < arrival.get(neighbour, inf):
+                arrival[neighbour] = new_time
+                distance[neighbour] = current_distance + lengths[e]
+                predecessors[neighbour] = e
+                heappush(minHeap, (new_time + potential(neighbour), neighbour))
+
+    record_search('td_astar' if use_astar else 'td_dijkstra', pushes=pops + len(minHeap), pops=pops,
+                  stale_pops=pops - settled, relaxed_edges=relaxed_edges)
+
+    if target not in arrival:
+        return {"path": [], "edges": [], "cost": inf, "distance": inf, "time": inf}, settled
+
+    # predecessors guarda a aresta por onde se chegou a cada nó
+    node_ids = cgraph.node_ids
+    sources = cgraph.edge_sources()
+    path = [int(node_ids[target])]
+    edges = []
+    e = predecessors[target]
+    while e != -1:
+        edges.append(e)
+        node = sources[e]
+        path.append(int(node_ids[node]))
+        e = predecessors[node]
+    path.reverse()
+    edges.reverse()
+
+    time = arrival[target] - departure
+    return {"path": path, "edges": edges, "cost": time, "distance": distance[target], "time": time}, settled
+
+
+def td_path_totals(tdw, edges, departure):
+    """
+    Distância e tempo de uma rota (as arestas, na ordem) saindo às departure, com os tempos de tdw.
+    Para caminhos que vieram só com os nós, as arestas saem de CompiledGraph.path_edges.
+    """
+    lengths = tdw.cgraph.adjacency('length')[2]
+    distance = 0.0
+    t = float(departure)
+    for e in edges:
+        distance += lengths[e]
+        t += tdw.travel_time(e, t)
+    return distance, t - departure